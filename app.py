@@ -1,18 +1,79 @@
-from flask import Flask, request, jsonify, render_template, redirect, session, make_response, abort
+from flask import Flask, request, jsonify, render_template, redirect, session, make_response, abort, g, has_request_context
 import sqlite3
 import uuid
 import time
-import requests
 import random
 import os
+import sys
 import base64
 import datetime
-from math import radians, cos, sin, asin, sqrt
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import atexit
+import hashlib
+import json
+import io
+import re
+import bisect
+from collections import OrderedDict, deque
+from types import MappingProxyType
+import tempfile
+from stat import S_ISDIR, S_IMODE
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from math import radians, cos, sin, asin, sqrt, pi
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
 from werkzeug.utils import secure_filename
+from jinja2 import FileSystemBytecodeCache
+
+# =========================================================
+# ✅ LAZY IMPORTS (keep worker boot fast)
+# =========================================================
+# requests / Pillow pull in large dependency trees; they are imported
+# on first use instead of in every worker at boot.
+def _http():
+    import requests
+    return requests
+
+
+def _pil():
+    """
+    Returns: (Image, ImageOps) or (None, None) when Pillow is missing.
+    """
+    try:
+        from PIL import Image, ImageOps
+        return Image, ImageOps
+    except ImportError:
+        return None, None
+
 
 app = Flask(__name__)
 
+# =========================================================
+# ✅ TEMPLATE CACHING
+# =========================================================
+# compiled template bytecode survives worker restarts / cold starts.
+# Cache files are unmarshalled and executed, so the directory must be
+# ours and closed to everyone else; otherwise templates compile in memory.
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR") or ""
+
+
+def _jinja_bytecode_cache():
+    try:
+        if not JINJA_CACHE_DIR:
+            # Jinja's per-uid temp dir, created 0700 and ownership-checked
+            return FileSystemBytecodeCache()
+        os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(JINJA_CACHE_DIR)
+        if not S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or S_IMODE(st.st_mode) & 0o077:
+            print("⚠️ template cache off: JINJA_CACHE_DIR must be a private directory owned by this user")
+            return None
+        return FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    except (OSError, RuntimeError, AttributeError) as e:
+        print("⚠️ template cache off:", e)
+        return None
+
+
+app.jinja_options = {**app.jinja_options, "bytecode_cache": _jinja_bytecode_cache()}
+
 # =========================================================
 # ✅ SECRET KEY (safe for deploy)
 # =========================================================
@@ -27,20 +88,645 @@ OVERPASS_URLS = [
     "https://overpass.nchc.org.tw/api/interpreter",
 ]
 
+# full override (comma separated), e.g. local stub for benchmarks
+if (os.environ.get("OVERPASS_URLS") or "").strip():
+    OVERPASS_URLS = [u.strip() for u in os.environ["OVERPASS_URLS"].split(",") if u.strip()]
+
+NOMINATIM_URL = (os.environ.get("NOMINATIM_URL") or "").strip() or "https://nominatim.openstreetmap.org"
+# "{lang}" is replaced by the wiki language
+WIKIPEDIA_URL = (os.environ.get("WIKIPEDIA_URL") or "").strip() or "https://{lang}.wikipedia.org"
+
+# =========================================================
+# ✅ UPSTREAM HTTP (per-worker keep-alive session pool)
+# =========================================================
+# One requests.Session per worker process: connections to Overpass,
+# Nominatim and Wikipedia stay alive and are reused instead of paying a
+# TCP + TLS handshake on every call. Connect and read timeouts are
+# separate (a dead mirror fails in seconds, a heavy query keeps its read
+# budget) and transient connect errors / 502-504s retry in the transport.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "10"))  # hosts with a kept pool
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", "8"))  # kept-alive connections per host
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_USER_AGENT = "MoodMap/1.0 (contact: moodmap)"
+HTTP_SESSION = {"session": None, "pid": None}
+HTTP_SESSION_LOCK = threading.Lock()
+
+
+def http_timeout(read_sec):
+    return (HTTP_CONNECT_TIMEOUT, float(read_sec))
+
+
+def http_session():
+    # created lazily so every forked worker owns its sockets
+    if HTTP_SESSION["session"] is not None and HTTP_SESSION["pid"] == os.getpid():
+        return HTTP_SESSION["session"]
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION["session"] is None or HTTP_SESSION["pid"] != os.getpid():
+            requests = _http()
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=HTTP_RETRIES,
+                connect=HTTP_RETRIES,
+                read=1,  # GET on a connection the server closed meanwhile
+                status=HTTP_RETRIES,
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                # Overpass POSTs only retry failed connects; mirrors fail over above this
+                allowed_methods=frozenset(("GET", "HEAD")),
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS,
+                pool_maxsize=HTTP_POOL_PER_HOST,
+                max_retries=retry,
+            )
+            s = requests.Session()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["User-Agent"] = HTTP_USER_AGENT
+            HTTP_SESSION["session"] = s
+            HTTP_SESSION["pid"] = os.getpid()
+    return HTTP_SESSION["session"]
+
+
+# =========================================================
+# ✅ HTTP CACHE (honours upstream Cache-Control, per worker)
+# =========================================================
+# Used for Wikipedia summaries: fresh entries (max-age minus Age) are
+# served from memory, stale ones are revalidated with ETag /
+# Last-Modified so an unchanged page costs a 304. HTTP_CACHE_MAX=0
+# turns the layer off.
+HTTP_CACHE = OrderedDict()  # url -> {"expires", "etag", "last_modified", "data"}
+HTTP_CACHE_MAX = int(os.environ.get("HTTP_CACHE_MAX", "2000"))
+
+
+def _cache_control(header):
+    out = {}
+    for part in (header or "").lower().split(","):
+        key, _, val = part.strip().partition("=")
+        if key:
+            out[key] = val.strip().strip('"')
+    return out
+
+
+def _int_or_zero(x):
+    try:
+        return max(0, int(x))
+    except:
+        return 0
+
+
+def http_get_json_cached(url, read_sec, **kwargs):
+    """
+    GET -> (status, json or None); only 200s are cached.
+    """
+    item = HTTP_CACHE.get(url) if HTTP_CACHE_MAX > 0 else None
+    if item is not None and item["expires"] > time.time():
+        cache_hit("http", True)
+        return 200, item["data"]
+    cache_hit("http", False)
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if item is not None:
+        if item["etag"]:
+            headers["If-None-Match"] = item["etag"]
+        if item["last_modified"]:
+            headers["If-Modified-Since"] = item["last_modified"]
+
+    r = http_session().get(url, headers=headers, timeout=http_timeout(read_sec), **kwargs)
+    if r.status_code == 304 and item is not None:
+        data = item["data"]
+    elif r.status_code == 200:
+        data = r.json()
+    else:
+        return r.status_code, None
+
+    cc = _cache_control(r.headers.get("Cache-Control"))
+    if HTTP_CACHE_MAX <= 0 or "no-store" in cc or "private" in cc:
+        HTTP_CACHE.pop(url, None)
+        return 200, data
+    max_age = 0 if "no-cache" in cc else _int_or_zero(cc.get("max-age"))
+    etag = r.headers.get("ETag") or (item or {}).get("etag")
+    last_modified = r.headers.get("Last-Modified") or (item or {}).get("last_modified")
+    if not max_age and not etag and not last_modified:
+        return 200, data
+    HTTP_CACHE[url] = {
+        "expires": time.time() + max_age - _int_or_zero(r.headers.get("Age")),
+        "etag": etag,
+        "last_modified": last_modified,
+        "data": data,
+    }
+    HTTP_CACHE.move_to_end(url)
+    if len(HTTP_CACHE) > HTTP_CACHE_MAX:
+        HTTP_CACHE.popitem(last=False)
+    return 200, data
+
 # =========================================================
 # ✅ UPLOAD CONFIG
 # =========================================================
 UPLOAD_FOLDER = os.path.join("static", "uploads", "pfp")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 ALLOWED_EXT = {"png", "jpg", "jpeg", "webp"}
 MAX_PFP_SIZE_MB = 4
 
+# avatar variants produced from every upload (px, square, webp)
+PFP_SIZES = (64, 256)
+PFP_LIST_SIZE = 64
+PFP_PAGE_SIZE = 256
+PFP_MAX_PIXELS = 40_000_000
+
+# hard cap on request bodies (base64 of MAX_PFP_SIZE_MB + json overhead)
+app.config["MAX_CONTENT_LENGTH"] = (MAX_PFP_SIZE_MB * 4 // 3 + 2) * 1024 * 1024
+
 # =========================================================
 # ✅ BREVO CONFIG (Render-safe)
 # =========================================================
 BREVO_API_KEY = (os.environ.get("BREVO_API_KEY") or "").strip()
 BREVO_SENDER = (os.environ.get("BREVO_SENDER") or "").strip()
+BREVO_READ_TIMEOUT_SEC = 15
+
+# "brevo" (real) or "stub" (local/tests: records instead of sending)
+EMAIL_TRANSPORT = (os.environ.get("EMAIL_TRANSPORT") or "brevo").strip().lower()
+
+# =========================================================
+# ✅ METRICS (per-worker, merged across workers via files)
+# =========================================================
+# Each worker keeps counters/histograms in memory and snapshots them to
+# METRICS_DIR/<run>/<pid>-<token>.json; /metrics merges every snapshot, so
+# no external collector is needed. <run> is one server start (gunicorn.conf.py
+# sets MOODMAPS_RUN_ID in the master), the token makes a reused pid write a
+# new file. When a worker exits, the master folds its file into archived.json
+# (archive_worker_metrics), so the directory holds one file per live worker.
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "moodmaps-metrics")
+METRICS_RUN_ID = os.environ.get("MOODMAPS_RUN_ID") or f"{int(time.time())}-{os.getpid()}"
+METRICS_RUN_DIR = os.path.join(METRICS_DIR, METRICS_RUN_ID)
+METRICS_ARCHIVE = "archived.json"
+METRICS_STALE_RUN_SEC = 24 * 3600
+METRICS_PROC = {"pid": None, "file": None}
+METRICS_FLUSH_SEC = float(os.environ.get("METRICS_FLUSH_SEC", "5"))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_HELP = {
+    "moodmaps_http_request_seconds": "Flask route latency",
+    "moodmaps_upstream_seconds": "Outbound helper latency",
+    "moodmaps_overpass_requests_total": "Overpass calls per mirror and result",
+    "moodmaps_cache_requests_total": "Cache lookups by cache and result",
+    "moodmaps_sqlite_write_seconds": "SQLite write statement latency (includes busy waits)",
+    "moodmaps_sqlite_locked_total": "SQLite 'database is locked' errors",
+}
+METRICS_COUNTERS = {}
+METRICS_HISTOGRAMS = {}
+METRICS_LOCK = threading.Lock()
+METRICS_FLUSHER = {"thread": None, "pid": None}
+
+
+def _metric_key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def metrics_inc(name, value=1, **labels):
+    key = _metric_key(name, labels)
+    with METRICS_LOCK:
+        METRICS_COUNTERS[key] = METRICS_COUNTERS.get(key, 0) + value
+    _ensure_metrics_flusher()
+
+
+def metrics_observe(name, seconds, **labels):
+    key = _metric_key(name, labels)
+    with METRICS_LOCK:
+        h = METRICS_HISTOGRAMS.get(key)
+        if h is None:
+            # [bucket counts..., +Inf count, sum]
+            h = [0] * (len(METRICS_BUCKETS) + 1) + [0.0]
+            METRICS_HISTOGRAMS[key] = h
+        for i, le in enumerate(METRICS_BUCKETS):
+            if seconds <= le:
+                h[i] += 1
+                break
+        else:
+            h[len(METRICS_BUCKETS)] += 1
+        h[-1] += seconds
+    _ensure_metrics_flusher()
+
+
+def timed(name, span_kind=None, **labels):
+    """
+    Decorator: observe wall time of the wrapped call into histogram `name`
+    (and into the request's profiling span `span_kind`, if given).
+    """
+    def deco(fn):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                metrics_observe(name, elapsed, **labels)
+                if span_kind:
+                    add_span(span_kind, elapsed)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return deco
+
+
+@app.before_request
+def _metrics_request_start():
+    g._metrics_t0 = time.perf_counter()
+
+
+@app.after_request
+def _metrics_request_end(resp):
+    t0 = g.get("_metrics_t0")
+    if t0 is not None:
+        metrics_observe(
+            "moodmaps_http_request_seconds",
+            time.perf_counter() - t0,
+            endpoint=request.endpoint or "unmatched",
+            method=request.method,
+            status=resp.status_code,
+        )
+    return resp
+
+
+def cache_hit(cache: str, hit: bool):
+    metrics_inc("moodmaps_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def _metrics_snapshot():
+    with METRICS_LOCK:
+        return {
+            "counters": [[k[0], list(k[1]), v] for k, v in METRICS_COUNTERS.items()],
+            "histograms": [[k[0], list(k[1]), list(h)] for k, h in METRICS_HISTOGRAMS.items()],
+        }
+
+
+def _metrics_file():
+    if METRICS_PROC["pid"] != os.getpid():
+        METRICS_PROC["pid"] = os.getpid()
+        METRICS_PROC["file"] = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+    return os.path.join(METRICS_RUN_DIR, METRICS_PROC["file"])
+
+
+def _write_json_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(data, fp)
+    os.replace(tmp, path)
+
+
+def flush_metrics():
+    try:
+        os.makedirs(METRICS_RUN_DIR, exist_ok=True)
+        _write_json_atomic(_metrics_file(), _metrics_snapshot())
+    except Exception as e:
+        print("⚠️ flush_metrics error:", e)
+
+
+def _prune_metric_runs():
+    """Removes snapshot dirs of earlier server runs (nothing written for a day)."""
+    if not os.path.isdir(METRICS_DIR):
+        return
+    try:
+        for name in os.listdir(METRICS_DIR):
+            path = os.path.join(METRICS_DIR, name)
+            if name == METRICS_RUN_ID or time.time() - os.path.getmtime(path) < METRICS_STALE_RUN_SEC:
+                continue
+            if os.path.isdir(path):
+                for fn in os.listdir(path):
+                    os.remove(os.path.join(path, fn))
+                os.rmdir(path)
+            else:
+                os.remove(path)  # pre-run-dir <pid>.json snapshots
+    except Exception as e:
+        print("⚠️ metrics prune error:", e)
+
+
+def _metrics_flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SEC)
+        flush_metrics()
+
+
+def _ensure_metrics_flusher():
+    if METRICS_FLUSHER["thread"] and METRICS_FLUSHER["pid"] == os.getpid():
+        return
+    # forked worker: drop counters inherited from the parent
+    if METRICS_FLUSHER["pid"] not in (None, os.getpid()):
+        with METRICS_LOCK:
+            METRICS_COUNTERS.clear()
+            METRICS_HISTOGRAMS.clear()
+    elif METRICS_FLUSHER["pid"] is None:
+        _prune_metric_runs()
+    METRICS_FLUSHER["pid"] = os.getpid()
+    t = threading.Thread(target=_metrics_flush_loop, name="metrics-flusher", daemon=True)
+    t.start()
+    METRICS_FLUSHER["thread"] = t
+
+
+def _add_snapshot(counters, histograms, snap):
+    for name, labels, v in snap.get("counters", []):
+        key = (name, tuple(tuple(x) for x in labels))
+        counters[key] = counters.get(key, 0) + v
+    for name, labels, h in snap.get("histograms", []):
+        key = (name, tuple(tuple(x) for x in labels))
+        cur = histograms.get(key)
+        histograms[key] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+
+
+def _read_json(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except Exception:
+        return None
+
+
+def merged_metrics():
+    """
+    Sum of this run's live worker snapshots (ours is flushed first) plus
+    the archive of exited workers, so counters stay monotonic.
+    """
+    flush_metrics()
+    counters = {}
+    histograms = {}
+    # worker files first, archive last: a file folded in between is then
+    # either read here and skipped below, or already in the archive we read
+    snaps = {}
+    for fn in os.listdir(METRICS_RUN_DIR):
+        if fn.endswith(".json") and fn != METRICS_ARCHIVE:
+            snap = _read_json(os.path.join(METRICS_RUN_DIR, fn))
+            if snap is not None:
+                snaps[fn] = snap
+    archive = _read_json(os.path.join(METRICS_RUN_DIR, METRICS_ARCHIVE)) or {}
+    absorbed = set(archive.get("absorbed", []))
+    _add_snapshot(counters, histograms, archive)
+    for fn, snap in snaps.items():
+        if fn not in absorbed:
+            _add_snapshot(counters, histograms, snap)
+    return counters, histograms
+
+
+def archive_worker_metrics(pid):
+    """
+    Folds an exited worker's snapshot into archived.json and deletes it.
+    Called from the gunicorn master (child_exit), the only archive writer.
+    """
+    try:
+        names = [fn for fn in os.listdir(METRICS_RUN_DIR) if fn.startswith(f"{pid}-") and fn.endswith(".json")]
+        if not names:
+            return
+        path = os.path.join(METRICS_RUN_DIR, METRICS_ARCHIVE)
+        archive = _read_json(path) or {}
+        counters, histograms = {}, {}
+        _add_snapshot(counters, histograms, archive)
+        absorbed = [fn for fn in archive.get("absorbed", []) if os.path.exists(os.path.join(METRICS_RUN_DIR, fn))]
+        for fn in names:
+            if fn in absorbed:
+                continue
+            _add_snapshot(counters, histograms, _read_json(os.path.join(METRICS_RUN_DIR, fn)) or {})
+            absorbed.append(fn)
+        _write_json_atomic(path, {
+            "counters": [[k[0], list(k[1]), v] for k, v in counters.items()],
+            "histograms": [[k[0], list(k[1]), list(h)] for k, h in histograms.items()],
+            # readers skip these while they still exist
+            "absorbed": absorbed,
+        })
+        for fn in names:
+            os.remove(os.path.join(METRICS_RUN_DIR, fn))
+    except Exception as e:
+        print("⚠️ archive_worker_metrics error:", e)
+
+
+def _prom_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    counters, histograms = merged_metrics()
+    lines = []
+
+    for name in sorted({k[0] for k in counters}):
+        lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), v in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_prom_labels(labels)} {v}")
+
+    for name in sorted({k[0] for k in histograms}):
+        lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            cum = 0
+            for i, le in enumerate(METRICS_BUCKETS):
+                cum += h[i]
+                lines.append(f"{name}_bucket{_prom_labels(labels, [('le', le)])} {cum}")
+            cum += h[len(METRICS_BUCKETS)]
+            lines.append(f"{name}_bucket{_prom_labels(labels, [('le', '+Inf')])} {cum}")
+            lines.append(f"{name}_sum{_prom_labels(labels)} {h[-1]}")
+            lines.append(f"{name}_count{_prom_labels(labels)} {cum}")
+
+    return "\n".join(lines) + "\n"
+
+
+# =========================================================
+# ✅ REQUEST PROFILING (opt-in, sampled + slow requests)
+# =========================================================
+# PROFILE_SAMPLE_PCT: % of requests always recorded (cProfile too if PROFILE_CPROFILE=1)
+# PROFILE_SLOW_MS: any request slower than this is recorded (0 = off)
+PROFILE_SAMPLE_PCT = float(os.environ.get("PROFILE_SAMPLE_PCT", "0"))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_CPROFILE = os.environ.get("PROFILE_CPROFILE", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "moodmaps-profiles")
+PROFILE_LOG_MAX_BYTES = 2 * 1024 * 1024
+PROFILE_LOG_BACKUPS = 3
+# logs of exited workers are only removed here: of those, keep the newest
+# PROFILE_MAX_FILES and nothing older than PROFILE_MAX_AGE_SEC
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "40"))
+PROFILE_MAX_AGE_SEC = int(os.environ.get("PROFILE_MAX_AGE_SEC", str(7 * 24 * 3600)))
+PROFILE_PRUNE_EVERY_SEC = 600
+PROFILE_PRUNED_AT = {"ts": 0.0}
+PROFILE_LOG_RE = re.compile(r"requests-(\d+)\.jsonl(?:\.\d+)?")
+PROFILE_ENABLED = PROFILE_SAMPLE_PCT > 0 or PROFILE_SLOW_MS > 0
+PROFILE_LOGGER = {"logger": None, "pid": None}
+PROFILE_SPAN_KINDS = ("db", "upstream", "scoring", "render")
+
+
+def add_span(kind: str, seconds: float):
+    if not PROFILE_ENABLED or not has_request_context():
+        return
+    spans = g.get("_profile_spans")
+    if spans is not None:
+        spans[kind] = spans.get(kind, 0.0) + seconds
+
+
+class profile_span:
+    """with profile_span("scoring"): ..."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_span(self.kind, time.perf_counter() - self.t0)
+        return False
+
+
+def _pid_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        pass  # e.g. EPERM: exists, owned by someone else
+    return True
+
+
+def prune_profiles():
+    """
+    Deletes old request logs of exited processes; live workers' logs
+    (ours included) are left to their own rotation.
+    """
+    PROFILE_PRUNED_AT["ts"] = time.time()
+    try:
+        files = []
+        for fn in os.listdir(PROFILE_DIR):
+            m = PROFILE_LOG_RE.fullmatch(fn)
+            if not m or _pid_alive(int(m.group(1))):
+                continue
+            path = os.path.join(PROFILE_DIR, fn)
+            files.append((os.path.getmtime(path), path))
+        files.sort(reverse=True)
+        cutoff = time.time() - PROFILE_MAX_AGE_SEC
+        for i, (mtime, path) in enumerate(files):
+            if i >= PROFILE_MAX_FILES or mtime < cutoff:
+                os.remove(path)
+    except Exception as e:
+        print("⚠️ profile prune error:", e)
+
+
+def _profile_logger():
+    # one rotating file per worker: RotatingFileHandler is not multi-process safe
+    if PROFILE_LOGGER["logger"] is None or PROFILE_LOGGER["pid"] != os.getpid():
+        import logging
+        from logging.handlers import RotatingFileHandler
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        logger = logging.getLogger(f"moodmaps.profile.{os.getpid()}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(
+            os.path.join(PROFILE_DIR, f"requests-{os.getpid()}.jsonl"),
+            maxBytes=PROFILE_LOG_MAX_BYTES,
+            backupCount=PROFILE_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.handlers = [handler]
+        PROFILE_LOGGER["logger"] = logger
+        PROFILE_LOGGER["pid"] = os.getpid()
+        prune_profiles()
+    elif time.time() - PROFILE_PRUNED_AT["ts"] > PROFILE_PRUNE_EVERY_SEC:
+        prune_profiles()
+    return PROFILE_LOGGER["logger"]
+
+
+@app.before_request
+def _profile_request_start():
+    if not PROFILE_ENABLED:
+        return None
+    g._profile_t0 = time.perf_counter()
+    g._profile_spans = {}
+    g._profile_sampled = random.random() * 100 < PROFILE_SAMPLE_PCT
+    g._profile_cprofile = None
+    if g._profile_sampled and PROFILE_CPROFILE:
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            g._profile_cprofile = prof
+        except ValueError:
+            # another profiler already active in this thread
+            pass
+    return None
+
+
+@app.after_request
+def _profile_request_end(resp):
+    if not PROFILE_ENABLED or g.get("_profile_t0") is None:
+        return resp
+    try:
+        total_ms = (time.perf_counter() - g._profile_t0) * 1000
+        prof = g.get("_profile_cprofile")
+        if prof is not None:
+            prof.disable()
+
+        slow = PROFILE_SLOW_MS > 0 and total_ms >= PROFILE_SLOW_MS
+        if not (g._profile_sampled or slow):
+            return resp
+
+        spans_ms = {k: round(g._profile_spans.get(k, 0.0) * 1000, 2) for k in PROFILE_SPAN_KINDS}
+        record = {
+            "ts": int(time.time()),
+            "pid": os.getpid(),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint or "",
+            "status": resp.status_code,
+            "total_ms": round(total_ms, 2),
+            "spans_ms": spans_ms,
+            "other_ms": round(max(0.0, total_ms - sum(spans_ms.values())), 2),
+            "sampled": bool(g._profile_sampled),
+            "slow": bool(slow),
+        }
+        if prof is not None:
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(25)
+            record["cprofile"] = out.getvalue()
+
+        _profile_logger().info(json.dumps(record))
+    except Exception as e:
+        print("⚠️ profiling error:", e)
+    return resp
+
+
+def slowest_recent_requests(limit=50, max_lines_per_file=2000):
+    """
+    Reads every worker's profile log (current + rotated files)
+    and returns the slowest records first.
+    """
+    records = []
+    if not os.path.isdir(PROFILE_DIR):
+        return records
+    for fn in os.listdir(PROFILE_DIR):
+        if not fn.startswith("requests-"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, fn)) as fp:
+                lines = deque(fp, maxlen=max_lines_per_file)
+        except Exception:
+            continue
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            rec.pop("cprofile", None)
+            records.append(rec)
+    records.sort(key=lambda r: -float(r.get("total_ms") or 0))
+    return records[:limit]
+
 
 # =========================================================
 # ✅ DB HELPERS (Better handling)
@@ -48,13 +734,41 @@ BREVO_SENDER = (os.environ.get("BREVO_SENDER") or "").strip()
 DB_PATH = os.environ.get("DB_PATH", "users.db")
 
 
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Times write statements (lock/busy waits included) and counts
+    'database is locked' errors for /metrics.
+    """
+
+    def _timed(self, fn, sql, *args):
+        is_write = sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE", "REPLAC")
+        t0 = time.perf_counter()
+        try:
+            return fn(sql, *args)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                metrics_inc("moodmaps_sqlite_locked_total")
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            if is_write:
+                metrics_observe("moodmaps_sqlite_write_seconds", elapsed)
+            add_span("db", elapsed)
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, *args)
+
+
 def get_db():
     """
     Better SQLite connection:
     - busy_timeout prevents 'database is locked'
     - WAL mode improves concurrent access
     """
-    db = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    db = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, factory=InstrumentedConnection)
     db.row_factory = sqlite3.Row
     try:
         db.execute("PRAGMA journal_mode=WAL;")
@@ -99,78 +813,330 @@ def allowed_file(filename):
 
 
 # =========================================================
-# ✅ DB INIT
+# ✅ DB INIT (one-time migrate step + fast worker boot)
 # =========================================================
-with get_db() as db:
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            remember_token TEXT
-        )
-    """)
+# Bump whenever the schema/index/backfill steps in migrate() change.
+SCHEMA_VERSION = "7"
 
-    ensure_column(db, "users", "username TEXT")
-    ensure_column(db, "users", "is_private INTEGER DEFAULT 0")
-    ensure_column(db, "users", "current_mood TEXT")
-    ensure_column(db, "users", "profile_pic TEXT")
 
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS favorites(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            place_id TEXT NOT NULL,
-            name TEXT,
-            category TEXT,
-            lat REAL,
-            lon REAL,
-            created_at INTEGER,
-            UNIQUE(user_id, place_id)
-        )
-    """)
+def migrate():
+    """
+    Creates/upgrades schema, indexes and one-time data fixes.
+    Run once per deploy (`python app.py migrate`, Procfile release step);
+    workers only compare schema_version on boot.
+    """
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS password_resets(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            code TEXT NOT NULL,
-            expires_at INTEGER NOT NULL
-        )
-    """)
+    with get_db() as db:
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS users(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                remember_token TEXT
+            )
+        """)
+
+        ensure_column(db, "users", "username TEXT")
+        ensure_column(db, "users", "is_private INTEGER DEFAULT 0")
+        ensure_column(db, "users", "current_mood TEXT")
+        ensure_column(db, "users", "profile_pic TEXT")
 
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS follows(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            follower_id INTEGER NOT NULL,
-            following_id INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            created_at INTEGER,
-            UNIQUE(follower_id, following_id)
-        )
-    """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS favorites(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                place_id TEXT NOT NULL,
+                name TEXT,
+                category TEXT,
+                lat REAL,
+                lon REAL,
+                created_at INTEGER,
+                UNIQUE(user_id, place_id)
+            )
+        """)
 
-    try:
-        db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-    except:
-        pass
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS password_resets(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                to_email TEXT NOT NULL,
+                payload TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at INTEGER,
+                claimed_by TEXT,
+                claimed_at INTEGER,
+                last_error TEXT,
+                created_at INTEGER,
+                sent_at INTEGER
+            )
+        """)
+
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON email_outbox(status, next_attempt_at)")
+        except:
+            pass
+
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS follows(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                follower_id INTEGER NOT NULL,
+                following_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at INTEGER,
+                UNIQUE(follower_id, following_id)
+            )
+        """)
+
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        except:
+            pass
+
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)")
+        except:
+            pass
+
+        # followers of X / follow stats / relationship lookups by target
+        # (the UNIQUE(follower_id, following_id) index can't seek on following_id)
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_follows_following ON follows(following_id, status, created_at)")
+        except:
+            pass
+
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites(user_id, created_at)")
+        except:
+            pass
+
+        # per-place aggregates (favorites warmer)
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_favorites_place ON favorites(place_id, created_at)")
+        except:
+            pass
 
+        # learned candidates/km² per (mood, map tile), see ADAPTIVE SEARCH RADIUS
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS tile_density(
+                mood TEXT NOT NULL,
+                tile TEXT NOT NULL,
+                density REAL NOT NULL,
+                samples INTEGER DEFAULT 0,
+                updated_at INTEGER,
+                PRIMARY KEY (mood, tile)
+            )
+        """)
+
+        # long-lived Wikipedia summaries, see WIKIPEDIA SUMMARY CACHE
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS wiki_summaries(
+                lang TEXT NOT NULL,
+                title TEXT NOT NULL,
+                ok INTEGER NOT NULL,
+                resolved_title TEXT,
+                extract TEXT,
+                thumbnail TEXT,
+                fetched_at INTEGER NOT NULL,
+                PRIMARY KEY (lang, title)
+            )
+        """)
+
+        # reverse-geocode store, see REVERSE-GEOCODE STORE
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cell TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                min_lat REAL,
+                min_lon REAL,
+                max_lat REAL,
+                max_lon REAL,
+                address TEXT NOT NULL,
+                source TEXT NOT NULL,
+                updated_at INTEGER,
+                UNIQUE(cell, lat, lon)
+            )
+        """)
+
+        # shared place details payloads, see PLACE DETAILS SYSTEM / FAVORITES WARMER
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS place_details(
+                place_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at INTEGER NOT NULL
+            )
+        """)
+
+        # time-decayed save counts, see PLACE POPULARITY
+        created = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='place_popularity'"
+        ).fetchone() is None
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS place_popularity(
+                place_id TEXT PRIMARY KEY,
+                weight REAL NOT NULL,
+                saves INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER
+            )
+        """)
+        if created:
+            backfill_popularity(db)
+
+        # followed users' saves per follower, see FRIEND ACTIVITY FEED
+        created = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='friend_saves'"
+        ).fetchone() is None
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS friend_saves(
+                user_id INTEGER NOT NULL,
+                cy INTEGER NOT NULL,
+                cx INTEGER NOT NULL,
+                place_id TEXT NOT NULL,
+                friend_id INTEGER NOT NULL,
+                saved_at INTEGER,
+                PRIMARY KEY (user_id, cy, cx, place_id, friend_id)
+            ) WITHOUT ROWID
+        """)
+        # unsave / account delete fan-in
+        try:
+            db.execute("CREATE INDEX IF NOT EXISTS idx_friend_saves_friend ON friend_saves(friend_id, place_id)")
+        except:
+            pass
+        if created:
+            backfill_friend_feed(db)
+
+        # =========================================================
+        # ✅ MAINTENANCE MODE (DB META STORAGE)
+        # =========================================================
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS app_meta(
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("maintenance_mode", "0"))
+        db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("user_cache_gen", "0"))
+        db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("nominatim_next_at", "0"))
+        db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("place_warm_lease", "0"))
+        db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("place_warm_cursor", "{}"))
+
+    migrate_legacy_pfps()
+
+    with get_db() as db:
+        db.execute("INSERT OR REPLACE INTO app_meta(key, value) VALUES(?,?)",
+                   ("schema_version", SCHEMA_VERSION))
+
+
+def ensure_schema():
+    """
+    Worker boot path: one indexed read when the DB is already migrated.
+    MOODMAPS_SKIP_MIGRATE=1 skips even that (release step owns migrations).
+    """
+    if os.environ.get("MOODMAPS_SKIP_MIGRATE") == "1":
+        return
     try:
-        db.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)")
-    except:
+        with get_db() as db:
+            row = db.execute("SELECT value FROM app_meta WHERE key=?", ("schema_version",)).fetchone()
+        if row and row["value"] == SCHEMA_VERSION:
+            return
+    except sqlite3.OperationalError:
+        # fresh DB: app_meta does not exist yet
         pass
+    migrate()
 
-    # =========================================================
-    # ✅ MAINTENANCE MODE (DB META STORAGE)
-    # =========================================================
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS app_meta(
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?,?)", ("maintenance_mode", "0"))
+
+# =========================================================
+# ✅ STATIC ASSETS (content-hash fingerprints + immutable caching)
+# =========================================================
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_MANIFEST = {}
+STATIC_MANIFEST_STATE = {"built": False}
+
+
+def _file_digest(path: str, length=16):
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(64 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:length]
+
+
+def build_static_manifest():
+    """
+    filename (relative to /static) -> content digest.
+    Uploads are skipped: avatars carry their digest in the file name.
+    """
+    manifest = {}
+    root = app.static_folder
+    uploads_root = os.path.join(root, "uploads")
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.abspath(dirpath).startswith(os.path.abspath(uploads_root)):
+            dirnames[:] = []
+            continue
+        for fn in filenames:
+            full = os.path.join(dirpath, fn)
+            rel = os.path.relpath(full, root).replace("\\", "/")
+            try:
+                manifest[rel] = _file_digest(full)
+            except Exception as e:
+                print("⚠️ static manifest error:", rel, e)
+    STATIC_MANIFEST.clear()
+    STATIC_MANIFEST.update(manifest)
+    STATIC_MANIFEST_STATE["built"] = True
+    return manifest
+
+
+def static_manifest():
+    # built on first use, not at import
+    if not STATIC_MANIFEST_STATE["built"]:
+        build_static_manifest()
+    return STATIC_MANIFEST
+
+
+def _is_content_addressed_upload(filename: str):
+    name = (filename or "").rsplit("/", 1)[-1]
+    return filename.startswith("uploads/pfp/") and name.startswith("pfp_")
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for('static', filename='script.js') -> /static/script.js?v=<digest>
+    if endpoint != "static":
+        return
+    digest = static_manifest().get(values.get("filename") or "")
+    if digest and "v" not in values:
+        values["v"] = digest
+
+
+@app.after_request
+def static_cache_headers(resp):
+    try:
+        if request.endpoint != "static" or resp.status_code != 200:
+            return resp
+        filename = (request.view_args or {}).get("filename") or ""
+        digest = static_manifest().get(filename)
+        fingerprinted = digest and request.args.get("v") == digest
+        if fingerprinted or _is_content_addressed_upload(filename):
+            resp.cache_control.public = True
+            resp.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+            resp.cache_control.immutable = True
+            resp.cache_control.no_cache = None
+    except Exception as e:
+        print("⚠️ static_cache_headers error:", e)
+    return resp
 
 
 # =========================================================
@@ -226,97 +1192,84 @@ def maintenance_gate():
             if request.path in allowed_paths:
                 return None
 
-            return render_template("maintenance.html"), 503
+            return render_cached("maintenance.html"), 503
     except Exception as e:
         print("⚠️ maintenance_gate error:", e)
         return None
 
 
+# =========================================================
+# ✅ RENDERED PAGE CACHE
+# =========================================================
+RENDER_CACHE = OrderedDict()
+RENDER_CACHE_MAX = 512
+
+
+def render_cached(template_name: str, **context):
+    """
+    render_template() memoized on (template, context).
+    Only for pages whose output depends on the passed kwargs alone
+    (login/signup/forgot/reset/maintenance, index per user).
+    """
+    if app.debug:
+        with profile_span("render"):
+            return render_template(template_name, **context)
+
+    key = (template_name, tuple(sorted(context.items())))
+    html = RENDER_CACHE.get(key)
+    cache_hit("render", html is not None)
+    if html is not None:
+        RENDER_CACHE.move_to_end(key)
+        return html
+
+    with profile_span("render"):
+        html = render_template(template_name, **context)
+    RENDER_CACHE[key] = html
+    if len(RENDER_CACHE) > RENDER_CACHE_MAX:
+        RENDER_CACHE.popitem(last=False)
+    return html
+
+
 # =========================================================
 # ✅ EMAIL TEMPLATE
 # =========================================================
+EMAIL_TEMPLATES = {}
+
+
+def _email_template(name: str):
+    # compiled once per worker (and served from the bytecode cache on boot)
+    tpl = EMAIL_TEMPLATES.get(name)
+    if tpl is None:
+        tpl = app.jinja_env.get_template(name)
+        EMAIL_TEMPLATES[name] = tpl
+    return tpl
+
+
 def build_reset_email_html(code: str):
-    return f"""
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width,initial-scale=1">
-  <title>MoodMap Reset Code</title>
-</head>
-<body style="margin:0;background:#05070f;font-family:Inter,Arial,sans-serif;color:#e5e7eb;">
-  <div style="max-width:640px;margin:0 auto;padding:28px 16px;">
-    <div style="
-      border-radius:22px;
-      background: radial-gradient(circle at 15% 20%, rgba(167,139,250,0.35), transparent 55%),
-                  radial-gradient(circle at 85% 70%, rgba(34,211,238,0.32), transparent 55%),
-                  linear-gradient(135deg, rgba(255,255,255,0.10), rgba(255,255,255,0.04));
-      border:1px solid rgba(255,255,255,0.16);
-      padding:26px 22px;
-      box-shadow:0 40px 120px rgba(0,0,0,0.65);
-    ">
-      <div style="display:flex;align-items:center;gap:12px;margin-bottom:14px;">
-        <div style="
-          width:44px;height:44px;border-radius:14px;
-          display:flex;align-items:center;justify-content:center;
-          font-weight:900;color:white;
-          background:linear-gradient(135deg,#22d3ee,#a78bfa);
-        ">M</div>
-        <div>
-          <div style="font-size:18px;font-weight:900;letter-spacing:-0.2px;">MoodMap</div>
-          <div style="opacity:.72;font-size:13px;margin-top:3px;">Password reset request</div>
-        </div>
-      </div>
-
-      <div style="font-size:14px;line-height:1.65;opacity:.92;">
-        Hey 👋 <br><br>
-        Use this 6-digit code to reset your password:
-      </div>
-
-      <div style="
-        margin:16px 0 10px;
-        border-radius:18px;
-        border:1px solid rgba(255,255,255,0.16);
-        background:rgba(0,0,0,0.25);
-        padding:14px 14px;
-        text-align:center;
-      ">
-        <div style="font-size:30px;font-weight:1000;letter-spacing:6px;color:white;">
-          {code}
-        </div>
-        <div style="font-size:12px;opacity:.68;margin-top:6px;">
-          Valid for 10 minutes
-        </div>
-      </div>
-
-      <div style="font-size:13px;opacity:.72;line-height:1.55;margin-top:12px;">
-        If you didn’t request a password reset, you can safely ignore this email.
-      </div>
-
-      <div style="margin-top:18px;border-top:1px solid rgba(255,255,255,0.10);padding-top:14px;
-                  font-size:12px;opacity:.55;">
-        © {time.strftime("%Y")} MoodMap — Smart mood based recommendations
-      </div>
-    </div>
-  </div>
-</body>
-</html>
-"""
+    return _email_template("email/reset_code.html").render(
+        code=code,
+        year=datetime.date.today().year
+    )
 
 
 # =========================================================
 # ✅ BREVO EMAIL SENDING (THE REAL FIX)
 # =========================================================
-def send_reset_email(to_email: str, code: str) -> bool:
+EMAIL_STUB_SENT = []
+
+
+def _brevo_send(to_email: str, subject: str, html: str, text: str):
+    """
+    Returns: (ok, error_message)
+    """
     if not BREVO_API_KEY or not BREVO_SENDER:
         print("❌ BREVO env vars missing")
         print("   BREVO_API_KEY:", "SET" if BREVO_API_KEY else "EMPTY")
         print("   BREVO_SENDER:", BREVO_SENDER or "EMPTY")
-        return False
+        return False, "brevo env missing"
 
     try:
         url = "https://api.brevo.com/v3/smtp/email"
-        html = build_reset_email_html(code)
 
         payload = {
             "sender": {
@@ -324,9 +1277,9 @@ def send_reset_email(to_email: str, code: str) -> bool:
                 "email": BREVO_SENDER
             },
             "to": [{"email": to_email}],
-            "subject": "MoodMap Password Reset Code",
+            "subject": subject,
             "htmlContent": html,
-            "textContent": f"Your MoodMap reset code is {code}. Valid for 10 minutes."
+            "textContent": text
         }
 
         headers = {
@@ -335,19 +1288,342 @@ def send_reset_email(to_email: str, code: str) -> bool:
             "content-type": "application/json"
         }
 
-        print("📨 Sending reset email via Brevo API ->", to_email)
-        r = requests.post(url, json=payload, headers=headers, timeout=15)
+        print("📨 Sending email via Brevo API ->", to_email)
+        r = http_session().post(url, json=payload, headers=headers, timeout=http_timeout(BREVO_READ_TIMEOUT_SEC))
 
         if r.status_code in (200, 201, 202):
             print("✅ Brevo email sent ✅")
-            return True
+            return True, ""
 
         print("❌ Brevo failed:", r.status_code, r.text)
-        return False
+        return False, f"brevo {r.status_code}"
 
     except Exception as e:
         print("❌ Brevo exception:", repr(e))
+        return False, repr(e)
+
+
+def _stub_send(to_email: str, subject: str, html: str, text: str):
+    EMAIL_STUB_SENT.append({
+        "to": to_email,
+        "subject": subject,
+        "html": html,
+        "text": text,
+        "sent_at": int(time.time())
+    })
+    print("📨 [stub] email ->", to_email, "|", subject)
+    return True, ""
+
+
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="send_email")
+def send_email(to_email: str, subject: str, html: str, text: str):
+    if EMAIL_TRANSPORT == "stub":
+        return _stub_send(to_email, subject, html, text)
+    return _brevo_send(to_email, subject, html, text)
+
+
+def send_reset_email(to_email: str, code: str) -> bool:
+    ok, _ = send_email(
+        to_email,
+        "MoodMap Password Reset Code",
+        build_reset_email_html(code),
+        f"Your MoodMap reset code is {code}. Valid for 10 minutes."
+    )
+    return ok
+
+
+# =========================================================
+# ✅ EMAIL OUTBOX (durable queue + background sender)
+# =========================================================
+# /api/forgot only inserts a row here; a per-worker thread claims due
+# rows in batches and talks to the provider off the request path.
+OUTBOX_BATCH = 20
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE_SEC = 5
+OUTBOX_BACKOFF_MAX_SEC = 15 * 60
+# a claim is only taken over once its whole batch must have timed out,
+# otherwise a slow batch would be sent twice
+OUTBOX_CLAIM_STALE_SEC = int(OUTBOX_BATCH * (HTTP_CONNECT_TIMEOUT + BREVO_READ_TIMEOUT_SEC)) + 120
+OUTBOX_POLL_SEC = float(os.environ.get("OUTBOX_POLL_SEC", "5"))
+OUTBOX_RETENTION_SEC = 7 * 24 * 3600  # finished rows (payload already redacted)
+OUTBOX_PURGE_EVERY_SEC = 3600
+OUTBOX_PURGED_AT = {"value": 0.0}
+OUTBOX_WAKE = threading.Event()
+OUTBOX_SENDER = {"thread": None, "pid": None}
+
+
+def _render_outbox_email(kind: str, payload: dict):
+    """
+    Returns: (subject, html, text)
+    """
+    if kind == "reset_code":
+        code = str(payload.get("code") or "")
+        return (
+            "MoodMap Password Reset Code",
+            build_reset_email_html(code),
+            f"Your MoodMap reset code is {code}. Valid for 10 minutes."
+        )
+    raise ValueError(f"unknown outbox kind: {kind}")
+
+
+def enqueue_email(kind: str, to_email: str, payload: dict, db=None):
+    now = int(time.time())
+    row = (kind, to_email, json.dumps(payload), "pending", 0, now, now)
+    sql = """
+        INSERT INTO email_outbox(kind, to_email, payload, status, attempts, next_attempt_at, created_at)
+        VALUES(?,?,?,?,?,?,?)
+    """
+    if db is not None:
+        # caller owns the transaction and calls wake_outbox() after commit
+        db.execute(sql, row)
+        return
+    with get_db() as conn:
+        conn.execute(sql, row)
+    wake_outbox()
+
+
+def wake_outbox():
+    _ensure_outbox_sender()
+    OUTBOX_WAKE.set()
+
+
+def _outbox_backoff(attempts: int):
+    delay = OUTBOX_BACKOFF_BASE_SEC * (2 ** max(0, attempts - 1))
+    delay = min(delay, OUTBOX_BACKOFF_MAX_SEC)
+    # jitter so workers don't retry in lockstep
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def _claim_outbox_batch():
+    now = int(time.time())
+    claim_id = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    with get_db() as db:
+        db.execute("""
+            UPDATE email_outbox
+            SET status='sending', claimed_by=?, claimed_at=?
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE (status='pending' AND next_attempt_at<=?)
+                   OR (status='sending' AND claimed_at<?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+        """, (claim_id, now, now, now - OUTBOX_CLAIM_STALE_SEC, OUTBOX_BATCH))
+        rows = db.execute("""
+            SELECT id, kind, to_email, payload, attempts
+            FROM email_outbox
+            WHERE claimed_by=? AND status='sending'
+        """, (claim_id,)).fetchall()
+
+        batch = []
+        for r in rows:
+            if _outbox_still_valid(db, r, now):
+                batch.append(dict(r))
+            else:
+                # code expired or replaced by a newer request: never send it
+                db.execute("""
+                    UPDATE email_outbox SET status='skipped', payload=NULL, claimed_by=NULL
+                    WHERE id=?
+                """, (r["id"],))
+    return batch
+
+
+def _outbox_still_valid(db, item, now):
+    if item["kind"] != "reset_code":
+        return True
+    try:
+        code = str(json.loads(item["payload"] or "{}").get("code") or "")
+    except:
         return False
+    row = db.execute("""
+        SELECT 1 FROM password_resets pr
+        JOIN users u ON u.id = pr.user_id
+        WHERE u.email=? AND pr.code=? AND pr.expires_at>?
+    """, (item["to_email"], code, now)).fetchone()
+    return row is not None
+
+
+def purge_outbox():
+    """Deletes finished rows past OUTBOX_RETENTION_SEC."""
+    with get_db() as db:
+        cur = db.execute("""
+            DELETE FROM email_outbox
+            WHERE status IN ('sent', 'failed', 'skipped') AND created_at<?
+        """, (int(time.time()) - OUTBOX_RETENTION_SEC,))
+    return cur.rowcount
+
+
+def process_outbox_once():
+    """
+    Sends one batch of due emails.
+    Returns the number of rows processed.
+    """
+    batch = _claim_outbox_batch()
+    if not batch:
+        return 0
+
+    results = []
+    for item in batch:
+        attempts = int(item["attempts"] or 0) + 1
+        try:
+            subject, html, text = _render_outbox_email(item["kind"], json.loads(item["payload"] or "{}"))
+            ok, err = send_email(item["to_email"], subject, html, text)
+        except Exception as e:
+            ok, err = False, repr(e)
+        results.append((item["id"], attempts, ok, err))
+
+    now = int(time.time())
+    with get_db() as db:
+        for outbox_id, attempts, ok, err in results:
+            if ok:
+                db.execute("""
+                    UPDATE email_outbox
+                    SET status='sent', attempts=?, sent_at=?, last_error=NULL, claimed_by=NULL, payload=NULL
+                    WHERE id=?
+                """, (attempts, now, outbox_id))
+            elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                db.execute("""
+                    UPDATE email_outbox
+                    SET status='failed', attempts=?, last_error=?, claimed_by=NULL, payload=NULL
+                    WHERE id=?
+                """, (attempts, (err or "")[:500], outbox_id))
+            else:
+                db.execute("""
+                    UPDATE email_outbox
+                    SET status='pending', attempts=?, last_error=?, claimed_by=NULL,
+                        next_attempt_at=?
+                    WHERE id=?
+                """, (attempts, (err or "")[:500], now + _outbox_backoff(attempts), outbox_id))
+
+    return len(results)
+
+
+def _outbox_loop():
+    while True:
+        OUTBOX_WAKE.wait(OUTBOX_POLL_SEC)
+        OUTBOX_WAKE.clear()
+        try:
+            while process_outbox_once() >= OUTBOX_BATCH:
+                pass
+            if time.time() - OUTBOX_PURGED_AT["value"] > OUTBOX_PURGE_EVERY_SEC:
+                OUTBOX_PURGED_AT["value"] = time.time()
+                purge_outbox()
+        except Exception as e:
+            print("⚠️ outbox sender error:", e)
+
+
+def _ensure_outbox_sender():
+    if OUTBOX_SENDER["thread"] and OUTBOX_SENDER["pid"] == os.getpid():
+        return
+    t = threading.Thread(target=_outbox_loop, name="email-outbox", daemon=True)
+    t.start()
+    OUTBOX_SENDER["thread"] = t
+    OUTBOX_SENDER["pid"] = os.getpid()
+
+
+# =========================================================
+# ✅ PASSWORD HASHING (bounded process pool)
+# =========================================================
+# KDF calls are CPU-bound; running them in a small per-worker process
+# pool keeps a login burst from starving every other request.
+PASSWORD_HASH_METHOD = (os.environ.get("PASSWORD_HASH_METHOD") or "scrypt:32768:8:1").strip()
+PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", "2"))
+PASSWORD_MAX_INFLIGHT = int(os.environ.get("PASSWORD_MAX_INFLIGHT", "8"))
+PASSWORD_DEADLINE_SEC = float(os.environ.get("PASSWORD_DEADLINE_SEC", "5"))
+PASSWORD_SLOTS = threading.BoundedSemaphore(PASSWORD_MAX_INFLIGHT)
+PASSWORD_POOL = {"executor": None, "pid": None}
+
+
+def _password_hash_prefix(method: str):
+    """
+    The "<method>" part werkzeug writes for this setting: it fills in
+    defaults ("scrypt" -> "scrypt:32768:8:1"). Derived, not hashed, so
+    importing the app stays cheap.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        return "scrypt:32768:8:1"
+    if name == "pbkdf2" and len(args) < 2:
+        return f"pbkdf2:{(args or ['sha256'])[0]}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+PASSWORD_HASH_PREFIX = _password_hash_prefix(PASSWORD_HASH_METHOD)
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+def _password_executor():
+    # created lazily so every forked worker owns its pool
+    if PASSWORD_POOL["executor"] is None or PASSWORD_POOL["pid"] != os.getpid():
+        if PASSWORD_POOL_WORKERS <= 0:
+            return None
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            PASSWORD_POOL["executor"] = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+            PASSWORD_POOL["pid"] = os.getpid()
+        except Exception as e:
+            print("⚠️ password pool unavailable, hashing inline:", e)
+            return None
+    return PASSWORD_POOL["executor"]
+
+
+def _release_password_slot(_fut=None):
+    PASSWORD_SLOTS.release()
+
+
+def _run_password_job(fn, *args):
+    from concurrent.futures.process import BrokenProcessPool
+
+    deadline = time.monotonic() + PASSWORD_DEADLINE_SEC
+    if not PASSWORD_SLOTS.acquire(timeout=PASSWORD_DEADLINE_SEC):
+        raise PasswordBusy()
+    handed_off = False
+    try:
+        ex = _password_executor()
+        if ex is None:
+            return fn(*args)
+        try:
+            fut = ex.submit(fn, *args)
+        except BrokenProcessPool:
+            PASSWORD_POOL["executor"] = None
+            return fn(*args)
+        # the slot follows the job, not this request: a job we stop waiting
+        # for keeps running in the pool and holds its slot until it ends
+        fut.add_done_callback(_release_password_slot)
+        handed_off = True
+    finally:
+        if not handed_off:
+            _release_password_slot()
+    try:
+        return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        fut.cancel()
+        raise PasswordBusy()
+    except BrokenProcessPool:
+        PASSWORD_POOL["executor"] = None
+        return fn(*args)
+
+
+def hash_password(password: str):
+    return _run_password_job(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash: str, password: str):
+    if not pwhash:
+        return False
+    return bool(_run_password_job(check_password_hash, pwhash, password))
+
+
+def password_needs_rehash(pwhash: str):
+    # werkzeug format: "<method>$<salt>$<hash>"
+    return (pwhash or "").split("$", 1)[0] != PASSWORD_HASH_PREFIX
+
+
+def busy_response():
+    return jsonify({"success": False, "message": "Server busy, please try again"})
 
 
 # =========================================================
@@ -367,9 +1643,179 @@ def current_user():
     return None
 
 
+# =========================================================
+# ✅ USER ROW CACHE (per worker, TTL + generation counter)
+# =========================================================
+USER_CACHE = OrderedDict()  # uid -> {"expires_at", "row"}, LRU order
+USER_CACHE_MAX = int(os.environ.get("USER_CACHE_MAX", "5000"))
+USER_CACHE_TTL_SEC = 60
+USER_CACHE_GEN_CHECK_SEC = 2
+USER_CACHE_GEN = {"value": None, "checked_at": 0.0}
+
+
+def _user_cache_sync_gen():
+    """
+    Cross-worker invalidation:
+    every write bumps app_meta.user_cache_gen, other workers notice it
+    (checked at most every USER_CACHE_GEN_CHECK_SEC) and drop their cache.
+    """
+    now = time.time()
+    if now - USER_CACHE_GEN["checked_at"] < USER_CACHE_GEN_CHECK_SEC:
+        return
+    USER_CACHE_GEN["checked_at"] = now
+    try:
+        with get_db() as db:
+            row = db.execute("SELECT value FROM app_meta WHERE key=?", ("user_cache_gen",)).fetchone()
+        gen = row["value"] if row else "0"
+    except:
+        return
+    if gen != USER_CACHE_GEN["value"]:
+        USER_CACHE.clear()
+        USER_CACHE_GEN["value"] = gen
+
+
+def invalidate_user_cache(*uids):
+    for uid in uids:
+        USER_CACHE.pop(int(uid), None)
+    try:
+        with get_db() as db:
+            db.execute("""
+                UPDATE app_meta SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT)
+                WHERE key=?
+            """, ("user_cache_gen",))
+            row = db.execute("SELECT value FROM app_meta WHERE key=?", ("user_cache_gen",)).fetchone()
+        gen = row["value"] if row else "0"
+        # our own bump alone must not wipe the whole local cache, but if another
+        # worker bumped since our last sync, its invalidation still applies here
+        try:
+            ours = int(gen) == int(USER_CACHE_GEN["value"]) + 1
+        except (TypeError, ValueError):
+            ours = False
+        if not ours:
+            USER_CACHE.clear()
+        USER_CACHE_GEN["value"] = gen
+    except Exception as e:
+        print("⚠️ invalidate_user_cache error:", e)
+
+
 def user_row(uid):
+    try:
+        uid = int(uid)
+    except:
+        return None
+
+    _user_cache_sync_gen()
+
+    item = USER_CACHE.get(uid)
+    if item and item["expires_at"] > time.time():
+        USER_CACHE.move_to_end(uid)
+        cache_hit("user_row", True)
+        return _with_pending_mood(item["row"])
+    cache_hit("user_row", False)
+
     with get_db() as db:
-        return db.execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
+        row = db.execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
+
+    if not row:
+        USER_CACHE.pop(uid, None)
+        return None
+
+    row = dict(row)
+    USER_CACHE[uid] = {"expires_at": time.time() + USER_CACHE_TTL_SEC, "row": row}
+    USER_CACHE.move_to_end(uid)
+    if len(USER_CACHE) > USER_CACHE_MAX:
+        USER_CACHE.popitem(last=False)
+    return _with_pending_mood(row)
+
+
+# =========================================================
+# ✅ MOOD WRITE-BEHIND QUEUE
+# =========================================================
+# /api/mood/set fires on every dropdown change; those writes are
+# coalesced per user and flushed in one transaction every interval.
+# Auth / follows / favorites keep their synchronous writes.
+MOOD_FLUSH_INTERVAL_SEC = float(os.environ.get("MOOD_FLUSH_INTERVAL_SEC", "2"))
+MOOD_WRITE_QUEUE = {}
+MOOD_WRITE_LOCK = threading.Lock()
+MOOD_FLUSHER = {"thread": None, "pid": None}
+
+
+def pending_mood(uid):
+    try:
+        return MOOD_WRITE_QUEUE.get(int(uid))
+    except:
+        return None
+
+
+def _with_pending_mood(row):
+    """read-your-writes: overlay a queued mood on top of the stored row"""
+    if not row:
+        return row
+    mood = pending_mood(row["id"])
+    if mood is None or mood == row["current_mood"]:
+        return row
+    out = dict(row)
+    out["current_mood"] = mood
+    return out
+
+
+def flush_mood_writes():
+    with MOOD_WRITE_LOCK:
+        if not MOOD_WRITE_QUEUE:
+            return 0
+        batch = list(MOOD_WRITE_QUEUE.items())
+
+    try:
+        with get_db() as db:
+            db.executemany("UPDATE users SET current_mood=? WHERE id=?",
+                           [(mood, uid) for uid, mood in batch])
+    except Exception as e:
+        print("⚠️ flush_mood_writes error:", e)
+        return 0
+
+    with MOOD_WRITE_LOCK:
+        for uid, mood in batch:
+            # a newer value may have been queued while we were writing
+            if MOOD_WRITE_QUEUE.get(uid) == mood:
+                MOOD_WRITE_QUEUE.pop(uid, None)
+
+    # local eviction only, so a flush does not make every worker drop its
+    # whole user cache. Staleness limit: another worker can show the old
+    # mood for up to MOOD_FLUSH_INTERVAL_SEC + USER_CACHE_TTL_SEC (2 s + 60 s
+    # by default) after the change. Accepted because mood is not a privacy
+    # field; username, privacy, picture and password changes still go through
+    # invalidate_user_cache.
+    for uid, _ in batch:
+        USER_CACHE.pop(uid, None)
+    return len(batch)
+
+
+def _mood_flush_loop():
+    while True:
+        time.sleep(MOOD_FLUSH_INTERVAL_SEC)
+        try:
+            flush_mood_writes()
+        except Exception as e:
+            print("⚠️ mood flusher error:", e)
+
+
+def _ensure_mood_flusher():
+    # started lazily so each forked worker gets its own thread
+    if MOOD_FLUSHER["thread"] and MOOD_FLUSHER["pid"] == os.getpid():
+        return
+    t = threading.Thread(target=_mood_flush_loop, name="mood-flusher", daemon=True)
+    t.start()
+    MOOD_FLUSHER["thread"] = t
+    MOOD_FLUSHER["pid"] = os.getpid()
+
+
+def queue_mood_write(uid, mood):
+    with MOOD_WRITE_LOCK:
+        MOOD_WRITE_QUEUE[int(uid)] = mood
+    _ensure_mood_flusher()
+
+
+atexit.register(flush_mood_writes)
 
 
 def user_by_username(username):
@@ -378,49 +1824,339 @@ def user_by_username(username):
         return db.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
 
 
+# =========================================================
+# ✅ RELATIONSHIP RESOLVER (viewer -> many targets, 1 query)
+# =========================================================
+RELATIONSHIP_CHUNK = 400
+
+def _relationship_memo():
+    """
+    Per-request memo stored on flask.g:
+      (viewer_id, target_id) -> relationship dict
+    Lives only as long as the request, so writes are visible next request.
+    """
+    try:
+        memo = getattr(g, "_relationship_memo", None)
+        if memo is None:
+            memo = {}
+            g._relationship_memo = memo
+        return memo
+    except RuntimeError:
+        # outside request context -> no memo
+        return {}
+
+
+def _empty_relationship(viewer_id, target_id):
+    is_self = bool(viewer_id) and int(viewer_id) == int(target_id)
+    return {
+        "status": "none",
+        "follows_viewer": False,
+        "mutual": False,
+        "can_view_private": is_self,
+    }
+
+
+def resolve_relationships(viewer_id, target_ids):
+    """
+    Resolve follow state of one viewer against many targets.
+    Returns:
+      { target_id: { status, follows_viewer, mutual, can_view_private } }
+    - status: viewer -> target ("none" / "pending" / "accepted")
+    - follows_viewer: target -> viewer is accepted
+    - mutual: both directions accepted
+    - can_view_private: self or accepted follower
+    """
+    ids = []
+    for t in target_ids or []:
+        try:
+            ids.append(int(t))
+        except:
+            continue
+
+    out = {}
+    if not ids:
+        return out
+
+    memo = _relationship_memo()
+    viewer_key = int(viewer_id) if viewer_id else 0
+
+    missing = []
+    queued = set()
+    for t in ids:
+        hit = memo.get((viewer_key, t))
+        if hit is not None:
+            out[t] = hit
+        elif t not in queued:
+            queued.add(t)
+            missing.append(t)
+
+    if not missing:
+        return out
+
+    fresh = {t: _empty_relationship(viewer_key, t) for t in missing}
+
+    if viewer_key:
+        rows = []
+        with get_db() as db:
+            # chunked to stay under SQLite's bound-variable limit
+            for i in range(0, len(missing), RELATIONSHIP_CHUNK):
+                chunk = missing[i:i + RELATIONSHIP_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows += db.execute(f"""
+                    SELECT follower_id, following_id, status
+                    FROM follows
+                    WHERE (follower_id=? AND following_id IN ({marks}))
+                       OR (following_id=? AND follower_id IN ({marks}))
+                """, (viewer_key, *chunk, viewer_key, *chunk)).fetchall()
+
+        for r in rows:
+            if int(r["follower_id"]) == viewer_key:
+                rel = fresh.get(int(r["following_id"]))
+                if rel is not None:
+                    rel["status"] = r["status"]
+            else:
+                rel = fresh.get(int(r["follower_id"]))
+                if rel is not None and r["status"] == "accepted":
+                    rel["follows_viewer"] = True
+
+        for rel in fresh.values():
+            rel["mutual"] = rel["status"] == "accepted" and rel["follows_viewer"]
+            if rel["status"] == "accepted":
+                rel["can_view_private"] = True
+
+    for t, rel in fresh.items():
+        memo[(viewer_key, t)] = rel
+        out[t] = rel
+
+    return out
+
+
+def resolve_relationship(viewer_id, target_id):
+    return resolve_relationships(viewer_id, [target_id]).get(
+        int(target_id), _empty_relationship(viewer_id, target_id)
+    )
+
+
 def follow_status(viewer_id, target_id):
     if not viewer_id:
         return "none"
-    with get_db() as db:
-        row = db.execute("""
-            SELECT status FROM follows
-            WHERE follower_id=? AND following_id=?
-        """, (viewer_id, target_id)).fetchone()
-    if not row:
-        return "none"
-    return row["status"]
+    return resolve_relationship(viewer_id, target_id)["status"]
 
 
 def can_view_private(viewer_id, target_id):
-    if viewer_id and viewer_id == target_id:
-        return True
-    with get_db() as db:
-        row = db.execute("""
-            SELECT status FROM follows
-            WHERE follower_id=? AND following_id=? AND status='accepted'
-        """, (viewer_id, target_id)).fetchone()
-    return True if row else False
+    return resolve_relationship(viewer_id, target_id)["can_view_private"]
+
+
+def delete_profile_pic_file(profile_pic_url: str, owner_id=None):
+    try:
+        if not profile_pic_url:
+            return
+        url = profile_pic_url.strip()
+        if not url.startswith("/"):
+            return
+
+        # content-addressed files can be shared by users uploading the same image
+        if owner_id is not None:
+            with get_db() as db:
+                other = db.execute("SELECT id FROM users WHERE profile_pic=? AND id<>?",
+                                   (url, owner_id)).fetchone()
+            if other:
+                return
+
+        allowed_root = os.path.abspath(UPLOAD_FOLDER)
+
+        for variant_url in pfp_variant_urls(url):
+            abs_path = os.path.abspath(variant_url.lstrip("/"))
+            if not abs_path.startswith(allowed_root):
+                continue
+            if os.path.exists(abs_path):
+                os.remove(abs_path)
+    except Exception as e:
+        print("⚠️ delete_profile_pic_file error:", e)
+
+
+# =========================================================
+# ✅ PFP PIPELINE (stream -> decode off-thread -> webp variants)
+# =========================================================
+PFP_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pfp")
+PFP_PROCESS_TIMEOUT_SEC = 20
+
+
+class PfpError(Exception):
+    pass
+
+
+def pfp_url(digest: str, size: int):
+    return "/" + os.path.join(UPLOAD_FOLDER, f"pfp_{digest}_{size}.webp").replace("\\", "/")
+
+
+# pfp_<digest>_<size>.webp; single-file uploads are pfp_<digest>.<ext>
+PFP_VARIANT_RE = re.compile(r"pfp_([0-9a-f]+)_(\d+)\.webp")
+
+
+def _pfp_variant_digest(url: str):
+    m = PFP_VARIANT_RE.fullmatch(url.rsplit("/", 1)[-1])
+    return m.group(1) if m else None
+
+
+def pfp_variant_urls(url: str):
+    """
+    All files behind a stored profile_pic url.
+    Legacy uploads (user_<id>_<ts>.<ext>) and originals stored without
+    Pillow (pfp_<digest>.<ext>) are a single file.
+    """
+    url = (url or "").strip()
+    digest = _pfp_variant_digest(url)
+    if digest:
+        return [pfp_url(digest, sz) for sz in PFP_SIZES]
+    return [url] if url else []
+
 
+def pfp_small(url: str):
+    """avatar url for lists/search (small variant when available)"""
+    url = (url or "").strip()
+    digest = _pfp_variant_digest(url)
+    if digest:
+        return pfp_url(digest, PFP_LIST_SIZE)
+    return url
 
-def delete_profile_pic_file(profile_pic_url: str):
+
+def _spool_upload(chunks, limit_bytes: int):
+    """
+    Writes an iterable of byte chunks to a temp file,
+    aborting as soon as the size cap is crossed.
+    Returns: (temp_path, sha256_hex)
+    """
+    h = hashlib.sha256()
+    total = 0
+    fd, tmp_path = tempfile.mkstemp(prefix="pfp_", suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                total += len(chunk)
+                if total > limit_bytes:
+                    raise PfpError(f"Max {MAX_PFP_SIZE_MB}MB allowed")
+                h.update(chunk)
+                fp.write(chunk)
+        if total == 0:
+            raise PfpError("No file uploaded")
+        return tmp_path, h.hexdigest()
+    except:
+        _silent_remove(tmp_path)
+        raise
+
+
+def _silent_remove(path):
+    try:
+        os.remove(path)
+    except:
+        pass
+
+
+def _iter_file_chunks(stream, chunk_size=64 * 1024):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_b64_chunks(b64: str, chunk_chars=64 * 1024):
+    # whitespace is stripped per slice and 4-char aligned pieces decode
+    # independently (the remainder carries over) -> no full copy of either
+    # the cleaned text or the decoded bytes
+    carry = ""
+    for i in range(0, len(b64) + 1, chunk_chars):
+        part = carry + "".join(b64[i:i + chunk_chars].split())
+        last = i + chunk_chars >= len(b64)
+        cut = len(part) if last else len(part) - len(part) % 4
+        carry = part[cut:]
+        if not cut:
+            continue
+        try:
+            yield base64.b64decode(part[:cut])
+        except Exception:
+            raise PfpError("Invalid image data")
+
+
+def _render_pfp_variants(tmp_path: str, digest: str):
+    """
+    Runs on PFP_EXECUTOR: decode, drop metadata, square-crop,
+    write every PFP_SIZES variant as webp under content-hashed names.
+    """
+    short = digest[:24]
+    targets = [(sz, pfp_url(short, sz).lstrip("/")) for sz in PFP_SIZES]
+
+    # same image already stored -> nothing to do
+    if all(os.path.exists(path) for _, path in targets):
+        return pfp_url(short, PFP_PAGE_SIZE)
+
+    Image, ImageOps = _pil()
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    try:
+        with Image.open(tmp_path) as im:
+            if im.format not in ("PNG", "JPEG", "WEBP"):
+                raise PfpError("Only PNG/JPG/WEBP allowed")
+            if im.width * im.height > PFP_MAX_PIXELS:
+                raise PfpError("Image too large")
+
+            im = ImageOps.exif_transpose(im)
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+
+            side = min(im.width, im.height)
+            left = (im.width - side) // 2
+            top = (im.height - side) // 2
+            square = im.crop((left, top, left + side, top + side))
+
+            for sz, path in targets:
+                out = square.resize((sz, sz), Image.LANCZOS) if side > sz else square
+                part = path + ".part"
+                # no exif/icc passed -> metadata stripped
+                out.save(part, "WEBP", quality=82, method=4)
+                os.replace(part, path)
+    except PfpError:
+        raise
+    except Exception as e:
+        print("⚠️ pfp decode error:", e)
+        raise PfpError("Invalid image data")
+
+    return pfp_url(short, PFP_PAGE_SIZE)
+
+
+def _store_original_pfp(tmp_path: str, digest: str, ext: str):
+    # fallback when Pillow is not installed: keep bytes, still content-hashed
+    filename = secure_filename(f"pfp_{digest[:24]}.{ext}")
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    save_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(save_path):
+        os.replace(tmp_path, save_path)
+    return "/" + save_path.replace("\\", "/")
+
+
+def process_pfp_upload(chunks, ext: str):
+    """
+    Returns the stored profile_pic url (256px variant).
+    Raises PfpError with a user-facing message.
+    """
+    tmp_path, digest = _spool_upload(chunks, MAX_PFP_SIZE_MB * 1024 * 1024)
     try:
-        if not profile_pic_url:
-            return
-        url = profile_pic_url.strip()
-        if not url.startswith("/"):
-            return
+        if _pil()[0] is None:
+            return _store_original_pfp(tmp_path, digest, ext)
+        fut = PFP_EXECUTOR.submit(_render_pfp_variants, tmp_path, digest)
+        return fut.result(timeout=PFP_PROCESS_TIMEOUT_SEC)
+    finally:
+        _silent_remove(tmp_path)
 
-        rel_path = url.lstrip("/")
-        abs_path = os.path.abspath(rel_path)
 
-        allowed_root = os.path.abspath(UPLOAD_FOLDER)
-        if not abs_path.startswith(allowed_root):
-            return
+def _set_profile_pic(uid, old_pic: str, url: str):
+    with get_db() as db:
+        db.execute("UPDATE users SET profile_pic=? WHERE id=?", (url, uid))
+    invalidate_user_cache(uid)
 
-        if os.path.exists(abs_path):
-            os.remove(abs_path)
-    except Exception as e:
-        print("⚠️ delete_profile_pic_file error:", e)
+    if old_pic and old_pic != url:
+        delete_profile_pic_file(old_pic, owner_id=uid)
 
 
 # =========================================================
@@ -450,7 +2186,7 @@ def home():
         resp.delete_cookie("remember_token")
         return resp
 
-    return render_template(
+    return render_cached(
         "index.html",
         username=user["name"],
         user_username=user["username"] or ""
@@ -471,9 +2207,23 @@ def login():
         with get_db() as db:
             user = db.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
 
-        if not user or not check_password_hash(user["password"], password):
+        try:
+            ok = bool(user) and verify_password(user["password"], password)
+        except PasswordBusy:
+            return busy_response()
+
+        if not ok:
             return jsonify({"success": False, "message": "Invalid email or password"})
 
+        if password_needs_rehash(user["password"]):
+            try:
+                new_hash = hash_password(password)
+                with get_db() as db:
+                    db.execute("UPDATE users SET password=? WHERE id=?", (new_hash, user["id"]))
+                invalidate_user_cache(user["id"])
+            except Exception as e:
+                print("⚠️ rehash on login failed:", e)
+
         session["user_id"] = user["id"]
         resp = make_response(jsonify({"success": True, "name": user["name"], "username": user["username"]}))
 
@@ -481,11 +2231,12 @@ def login():
             token = str(uuid.uuid4())
             with get_db() as db:
                 db.execute("UPDATE users SET remember_token=? WHERE id=?", (token, user["id"]))
+            invalidate_user_cache(user["id"])
             resp.set_cookie("remember_token", token, max_age=60 * 60 * 24 * 30, httponly=True)
 
         return resp
 
-    return render_template("login.html")
+    return render_cached("login.html")
 
 
 @app.route("/signup", methods=["GET", "POST"])
@@ -504,7 +2255,10 @@ def signup():
         if not name or not username or not email or not password:
             return jsonify({"success": False, "message": "All fields are required"})
 
-        hashed = generate_password_hash(password)
+        try:
+            hashed = hash_password(password)
+        except PasswordBusy:
+            return busy_response()
 
         try:
             with get_db() as db:
@@ -526,7 +2280,7 @@ def signup():
             print("Signup error:", e)
             return jsonify({"success": False, "message": "Email already exists"})
 
-    return render_template("signup.html")
+    return render_cached("signup.html")
 
 
 @app.route("/logout")
@@ -556,6 +2310,71 @@ def api_admin_maintenance():
     return jsonify({"success": True, "maintenance": get_maintenance_mode()})
 
 
+def migrate_legacy_pfps():
+    """
+    One-time rename of old user_<id>_<ts>.<ext> uploads
+    to content-addressed pfp_<digest>.<ext> names.
+    """
+    try:
+        with get_db() as db:
+            rows = db.execute("""
+                SELECT id, profile_pic FROM users
+                WHERE profile_pic LIKE '%/user\\_%' ESCAPE '\\'
+            """).fetchall()
+            for r in rows:
+                old_url = (r["profile_pic"] or "").strip()
+                old_path = old_url.lstrip("/")
+                if not os.path.exists(old_path):
+                    continue
+                ext = old_path.rsplit(".", 1)[-1].lower()
+                digest = _file_digest(old_path, length=24)
+                new_path = os.path.join(UPLOAD_FOLDER, secure_filename(f"pfp_{digest}.{ext}"))
+                if not os.path.exists(new_path):
+                    os.replace(old_path, new_path)
+                else:
+                    os.remove(old_path)
+                new_url = "/" + new_path.replace("\\", "/")
+                db.execute("UPDATE users SET profile_pic=? WHERE id=?", (new_url, r["id"]))
+    except Exception as e:
+        print("⚠️ migrate_legacy_pfps error:", e)
+
+
+
+# =========================================================
+# ✅ METRICS ENDPOINT (admin only, Prometheus text format)
+# =========================================================
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    uid = current_user()
+    if not uid or not is_admin(uid):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+
+    resp = make_response(render_prometheus())
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@app.route("/api/admin/slow_requests", methods=["GET"])
+def api_admin_slow_requests():
+    uid = current_user()
+    if not uid or not is_admin(uid):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+
+    try:
+        limit = max(1, min(200, int(request.args.get("limit", 50))))
+    except:
+        limit = 50
+
+    return jsonify({
+        "success": True,
+        "enabled": PROFILE_ENABLED,
+        "sample_pct": PROFILE_SAMPLE_PCT,
+        "slow_ms": PROFILE_SLOW_MS,
+        "list": slowest_recent_requests(limit=limit)
+    })
+
+
 # =========================================================
 # ✅ PROFILE PFP UPLOAD
 # =========================================================
@@ -580,27 +2399,18 @@ def api_upload_pfp():
     if not allowed_file(f.filename):
         return jsonify({"success": False, "message": "Only PNG/JPG/WEBP allowed"})
 
-    f.seek(0, os.SEEK_END)
-    size_bytes = f.tell()
-    f.seek(0)
-    if size_bytes > MAX_PFP_SIZE_MB * 1024 * 1024:
-        return jsonify({"success": False, "message": f"Max {MAX_PFP_SIZE_MB}MB allowed"})
-
-    old_pic = (u["profile_pic"] or "").strip()
-    if old_pic:
-        delete_profile_pic_file(old_pic)
-
     ext = f.filename.rsplit(".", 1)[1].lower()
-    filename = secure_filename(f"user_{uid}_{int(time.time())}.{ext}")
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    f.save(save_path)
-
-    url = "/" + save_path.replace("\\", "/")
+    try:
+        url = process_pfp_upload(_iter_file_chunks(f.stream), ext)
+    except PfpError as e:
+        return jsonify({"success": False, "message": str(e)})
+    except Exception as e:
+        print("⚠️ upload_pfp error:", e)
+        return jsonify({"success": False, "message": "Upload failed"})
 
-    with get_db() as db:
-        db.execute("UPDATE users SET profile_pic=? WHERE id=?", (url, uid))
+    _set_profile_pic(uid, (u["profile_pic"] or "").strip(), url)
 
-    return jsonify({"success": True, "url": url})
+    return jsonify({"success": True, "url": url, "thumb": pfp_small(url)})
 
 
 @app.route("/api/profile/upload_pfp_base64", methods=["POST"])
@@ -615,10 +2425,11 @@ def api_upload_pfp_base64():
         return jsonify({"success": False, "message": "Session expired"})
 
     data_url = (request.json.get("data_url") or "").strip()
-    if not data_url.startswith("data:image/"):
+    if not data_url.startswith("data:image/") or "," not in data_url:
         return jsonify({"success": False, "message": "Invalid image data"})
 
     header, b64 = data_url.split(",", 1)
+    data_url = None
 
     mime = header.split(";")[0].replace("data:", "").strip().lower()
     mime_to_ext = {
@@ -630,27 +2441,17 @@ def api_upload_pfp_base64():
     if mime not in mime_to_ext:
         return jsonify({"success": False, "message": "Only PNG/JPG/WEBP allowed"})
 
-    raw = base64.b64decode(b64)
-    if len(raw) > MAX_PFP_SIZE_MB * 1024 * 1024:
-        return jsonify({"success": False, "message": f"Max {MAX_PFP_SIZE_MB}MB allowed"})
-
-    old_pic = (u["profile_pic"] or "").strip()
-    if old_pic:
-        delete_profile_pic_file(old_pic)
-
-    ext = mime_to_ext[mime]
-    filename = secure_filename(f"user_{uid}_{int(time.time())}.{ext}")
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-
-    with open(save_path, "wb") as fp:
-        fp.write(raw)
-
-    url = "/" + save_path.replace("\\", "/")
+    try:
+        url = process_pfp_upload(_iter_b64_chunks(b64), mime_to_ext[mime])
+    except PfpError as e:
+        return jsonify({"success": False, "message": str(e)})
+    except Exception as e:
+        print("⚠️ upload_pfp_base64 error:", e)
+        return jsonify({"success": False, "message": "Upload failed"})
 
-    with get_db() as db:
-        db.execute("UPDATE users SET profile_pic=? WHERE id=?", (url, uid))
+    _set_profile_pic(uid, (u["profile_pic"] or "").strip(), url)
 
-    return jsonify({"success": True, "url": url})
+    return jsonify({"success": True, "url": url, "thumb": pfp_small(url)})
 
 
 @app.route("/api/profile/me", methods=["GET"])
@@ -690,6 +2491,7 @@ def api_update_username():
             return jsonify({"success": False, "message": "Username already taken"})
 
         db.execute("UPDATE users SET username=? WHERE id=?", (new_username, uid))
+    invalidate_user_cache(uid)
 
     return jsonify({"success": True, "username": new_username})
 
@@ -703,6 +2505,7 @@ def api_toggle_privacy():
     new_state = 1 if request.json.get("is_private", False) else 0
     with get_db() as db:
         db.execute("UPDATE users SET is_private=? WHERE id=?", (new_state, uid))
+    invalidate_user_cache(uid)
     return jsonify({"success": True, "is_private": new_state})
 
 
@@ -724,18 +2527,27 @@ def api_account_delete():
         session.clear()
         return jsonify({"success": False, "message": "Session expired"})
 
-    if not check_password_hash(u["password"], password):
-        return jsonify({"success": False, "message": "Incorrect password"})
+    try:
+        if not verify_password(u["password"], password):
+            return jsonify({"success": False, "message": "Incorrect password"})
+    except PasswordBusy:
+        return busy_response()
 
     profile_pic = (u["profile_pic"] or "").strip()
     if profile_pic:
-        delete_profile_pic_file(profile_pic)
+        delete_profile_pic_file(profile_pic, owner_id=uid)
 
     with get_db() as db:
+        saved = db.execute("SELECT place_id, created_at FROM favorites WHERE user_id=?", (uid,)).fetchall()
+        for r in saved:
+            record_save(db, r["place_id"], r["created_at"], -1)
         db.execute("DELETE FROM favorites WHERE user_id=?", (uid,))
+        db.execute("DELETE FROM friend_saves WHERE user_id=?", (uid,))
+        db.execute("DELETE FROM friend_saves WHERE friend_id=?", (uid,))
         db.execute("DELETE FROM follows WHERE follower_id=? OR following_id=?", (uid, uid))
         db.execute("DELETE FROM password_resets WHERE user_id=?", (uid,))
         db.execute("DELETE FROM users WHERE id=?", (uid,))
+    invalidate_user_cache(uid)
 
     session.clear()
     resp = make_response(jsonify({"success": True}))
@@ -753,22 +2565,10 @@ def api_set_mood():
         return jsonify({"success": False})
 
     mood = (request.json.get("mood") or "").strip()
-    ALLOWED_MOODS = [
-    "work",
-    "date",
-    "quick_bites",
-    "pocket_friendly",
-    "calm",
-    "high_adrenaline",
-    "exploring",
-    "late_night"
-]
-
     if mood not in ALLOWED_MOODS:
         return jsonify({"success": False})
 
-    with get_db() as db:
-        db.execute("UPDATE users SET current_mood=? WHERE id=?", (mood, uid))
+    queue_mood_write(uid, mood)
 
     return jsonify({"success": True})
 
@@ -788,7 +2588,7 @@ def api_users_search():
 
     with get_db() as db:
         rows = db.execute("""
-            SELECT username, name, is_private, profile_pic
+            SELECT id, username, name, is_private, profile_pic
             FROM users
             WHERE lower(username) LIKE ? OR lower(name) LIKE ?
             ORDER BY
@@ -798,13 +2598,18 @@ def api_users_search():
             LIMIT 10
         """, (f"%{q}%", f"%{q}%", q, f"{q}%")).fetchall()
 
+    rels = resolve_relationships(uid, [r["id"] for r in rows])
+
     out = []
     for r in rows:
+        rel = rels.get(int(r["id"])) or _empty_relationship(uid, r["id"])
         out.append({
             "username": r["username"],
             "name": r["name"],
             "is_private": int(r["is_private"] or 0),
-            "profile_pic": r["profile_pic"] or ""
+            "profile_pic": pfp_small(r["profile_pic"]),
+            "relationship": rel["status"],
+            "mutual": 1 if rel["mutual"] else 0
         })
     return jsonify(out)
 
@@ -819,15 +2624,17 @@ def public_profile(username):
         abort(404)
 
     viewer_id = current_user()
-    rel = follow_status(viewer_id, user["id"])
+    relationship = resolve_relationship(viewer_id, user["id"])
+    rel = relationship["status"]
 
     is_private = int(user["is_private"] or 0)
     allowed_to_view = True
     if is_private:
-        allowed_to_view = can_view_private(viewer_id, user["id"])
+        allowed_to_view = relationship["can_view_private"]
 
     places = []
     if allowed_to_view:
+        _ensure_place_warmer()
         with get_db() as db:
             rows = db.execute("""
                 SELECT place_id, name, category, lat, lon, created_at
@@ -837,20 +2644,21 @@ def public_profile(username):
             """, (user["id"],)).fetchall()
         places = [dict(r) for r in rows]
 
-    return render_template(
-        "profile.html",
-        profile_name=user["name"],
-        profile_username=user["username"],
-        current_mood=user["current_mood"] or "work",
-        is_private=is_private,
-        allowed=allowed_to_view,
-        relationship=rel,
-        viewer_logged_in=True if viewer_id else False,
-        is_owner=True if viewer_id and viewer_id == user["id"] else False,
-        profile_pic=user["profile_pic"] or "",
-        places=places,
-        admin=True if is_admin(viewer_id) else False
-    )
+    with profile_span("render"):
+        return render_template(
+            "profile.html",
+            profile_name=user["name"],
+            profile_username=user["username"],
+            current_mood=pending_mood(user["id"]) or user["current_mood"] or "work",
+            is_private=is_private,
+            allowed=allowed_to_view,
+            relationship=rel,
+            viewer_logged_in=True if viewer_id else False,
+            is_owner=True if viewer_id and viewer_id == user["id"] else False,
+            profile_pic=user["profile_pic"] or "",
+            places=places,
+            admin=True if is_admin(viewer_id) else False
+        )
 
 
 # =========================================================
@@ -882,6 +2690,10 @@ def api_follow_request():
             db.execute("""
                 UPDATE follows SET status=? WHERE follower_id=? AND following_id=?
             """, (status, uid, target["id"]))
+        if status == "accepted":
+            link_friend_feed(db, uid, target["id"])
+        else:
+            unlink_friend_feed(db, uid, target["id"])
 
     return jsonify({"success": True, "status": status})
 
@@ -901,6 +2713,7 @@ def api_follow_unfollow():
         db.execute("""
             DELETE FROM follows WHERE follower_id=? AND following_id=?
         """, (uid, target["id"]))
+        unlink_friend_feed(db, uid, target["id"])
 
     return jsonify({"success": True})
 
@@ -934,10 +2747,13 @@ def api_follow_requests_accept():
         return jsonify({"success": False})
 
     with get_db() as db:
-        db.execute("""
+        cur = db.execute("""
             UPDATE follows SET status='accepted'
             WHERE id=? AND following_id=?
         """, (req_id, uid))
+        if cur.rowcount:
+            row = db.execute("SELECT follower_id FROM follows WHERE id=?", (req_id,)).fetchone()
+            link_friend_feed(db, row["follower_id"], uid)
 
     return jsonify({"success": True})
 
@@ -1009,33 +2825,25 @@ def api_follow_list_followers():
 
     with get_db() as db:
         rows = db.execute("""
-            SELECT
-                u.username, u.name, u.profile_pic,
-                f.created_at,
-                CASE WHEN vf.id IS NULL THEN 0 ELSE 1 END AS viewer_follows_user,
-                CASE WHEN uv.id IS NULL THEN 0 ELSE 1 END AS user_follows_viewer
+            SELECT u.id, u.username, u.name, u.profile_pic, f.created_at
             FROM follows f
             JOIN users u ON u.id = f.follower_id
-
-            LEFT JOIN follows vf
-              ON vf.follower_id = ? AND vf.following_id = u.id AND vf.status='accepted'
-
-            LEFT JOIN follows uv
-              ON uv.follower_id = u.id AND uv.following_id = ? AND uv.status='accepted'
-
             WHERE f.following_id=? AND f.status='accepted'
             ORDER BY f.created_at DESC
-        """, (viewer_id, viewer_id, target["id"])).fetchall()
+        """, (target["id"],)).fetchall()
+
+    rels = resolve_relationships(viewer_id, [r["id"] for r in rows])
 
     out = []
     for r in rows:
+        rel = rels.get(int(r["id"])) or _empty_relationship(viewer_id, r["id"])
         out.append({
             "username": r["username"],
             "name": r["name"],
-            "profile_pic": r["profile_pic"] or "",
+            "profile_pic": pfp_small(r["profile_pic"]),
             "created_at": r["created_at"],
-            "viewer_follows_user": int(r["viewer_follows_user"] or 0),
-            "user_follows_viewer": int(r["user_follows_viewer"] or 0),
+            "viewer_follows_user": 1 if rel["status"] == "accepted" else 0,
+            "user_follows_viewer": 1 if rel["follows_viewer"] else 0,
         })
 
     return jsonify({"success": True, "list": out})
@@ -1054,33 +2862,25 @@ def api_follow_list_following():
 
     with get_db() as db:
         rows = db.execute("""
-            SELECT
-                u.username, u.name, u.profile_pic,
-                f.created_at,
-                CASE WHEN vf.id IS NULL THEN 0 ELSE 1 END AS viewer_follows_user,
-                CASE WHEN uv.id IS NULL THEN 0 ELSE 1 END AS user_follows_viewer
+            SELECT u.id, u.username, u.name, u.profile_pic, f.created_at
             FROM follows f
             JOIN users u ON u.id = f.following_id
-
-            LEFT JOIN follows vf
-              ON vf.follower_id = ? AND vf.following_id = u.id AND vf.status='accepted'
-
-            LEFT JOIN follows uv
-              ON uv.follower_id = u.id AND uv.following_id = ? AND uv.status='accepted'
-
             WHERE f.follower_id=? AND f.status='accepted'
             ORDER BY f.created_at DESC
-        """, (viewer_id, viewer_id, target["id"])).fetchall()
+        """, (target["id"],)).fetchall()
+
+    rels = resolve_relationships(viewer_id, [r["id"] for r in rows])
 
     out = []
     for r in rows:
+        rel = rels.get(int(r["id"])) or _empty_relationship(viewer_id, r["id"])
         out.append({
             "username": r["username"],
             "name": r["name"],
-            "profile_pic": r["profile_pic"] or "",
+            "profile_pic": pfp_small(r["profile_pic"]),
             "created_at": r["created_at"],
-            "viewer_follows_user": int(r["viewer_follows_user"] or 0),
-            "user_follows_viewer": int(r["user_follows_viewer"] or 0),
+            "viewer_follows_user": 1 if rel["status"] == "accepted" else 0,
+            "user_follows_viewer": 1 if rel["follows_viewer"] else 0,
         })
 
     return jsonify({"success": True, "list": out})
@@ -1102,6 +2902,7 @@ def api_follow_remove_follower():
             DELETE FROM follows
             WHERE follower_id=? AND following_id=? AND status='accepted'
         """, (target["id"], uid))
+        unlink_friend_feed(db, target["id"], uid)
 
     return jsonify({"success": True})
 
@@ -1111,12 +2912,12 @@ def api_follow_remove_follower():
 # =========================================================
 @app.route("/forgot")
 def forgot_page():
-    return render_template("forgot.html")
+    return render_cached("forgot.html")
 
 
 @app.route("/reset")
 def reset_page():
-    return render_template("reset.html")
+    return render_cached("reset.html")
 
 
 @app.route("/api/forgot", methods=["POST"])
@@ -1136,13 +2937,12 @@ def api_forgot():
         db.execute("DELETE FROM password_resets WHERE user_id=?", (user["id"],))
         db.execute("INSERT INTO password_resets(user_id, code, expires_at) VALUES(?,?,?)",
                    (user["id"], code, expires_at))
+        # same transaction: the email is queued iff the code is stored
+        enqueue_email("reset_code", email, {"code": code}, db=db)
+    wake_outbox()
 
     print("\n✅ MoodMap Reset Code:", code, "(valid for 10 minutes)\n")
 
-    ok = send_reset_email(email, code)
-    if not ok:
-        return jsonify({"success": False, "message": "Email sending failed. Try again later."})
-
     return jsonify({"success": True, "sent": True})
 
 
@@ -1172,13 +2972,175 @@ def api_reset():
         if int(row["expires_at"]) < int(time.time()):
             return jsonify({"success": False, "message": "Code expired"})
 
-        hashed = generate_password_hash(new_password)
+        try:
+            hashed = hash_password(new_password)
+        except PasswordBusy:
+            return busy_response()
         db.execute("UPDATE users SET password=? WHERE id=?", (hashed, user["id"]))
         db.execute("DELETE FROM password_resets WHERE user_id=?", (user["id"],))
+    invalidate_user_cache(user["id"])
 
     return jsonify({"success": True})
 
 
+# =========================================================
+# ✅ PLACE POPULARITY (time-decayed save counts)
+# =========================================================
+# place_popularity holds, per saved place, its saves with each one
+# fading by half every POPULARITY_HALF_LIFE_SEC. Every save is stored
+# pre-scaled to POPULARITY_EPOCH (2^((saved_at - epoch) / half life)),
+# so a save or unsave is one additive upsert and nothing is ever
+# rewritten to age it; readers scale by 2^(-(now - epoch) / half life).
+# (Float range lasts ~80 years from the epoch at a 30-day half life.)
+POPULARITY_EPOCH = 1767225600  # 2026-01-01 UTC
+POPULARITY_HALF_LIFE_SEC = 30 * 24 * 3600
+POPULARITY_MAX_POINTS = 12  # recommend boost approaches this
+POPULARITY_SATURATION = 3.0  # decayed saves worth half of it
+
+
+def _popularity_unit(ts):
+    return 2.0 ** ((int(ts or 0) - POPULARITY_EPOCH) / POPULARITY_HALF_LIFE_SEC)
+
+
+def record_save(db, place_id: str, saved_at, delta=1):
+    """delta=1: a save made at saved_at; delta=-1 takes that same save back out."""
+    now = int(time.time())
+    db.execute("""
+        INSERT INTO place_popularity(place_id, weight, saves, updated_at) VALUES(?,?,?,?)
+        ON CONFLICT(place_id) DO UPDATE SET
+            weight=MAX(0, weight + excluded.weight), saves=saves + excluded.saves, updated_at=excluded.updated_at
+    """, (place_id, delta * _popularity_unit(saved_at), delta, now))
+    if delta < 0:
+        db.execute("DELETE FROM place_popularity WHERE place_id=? AND saves<=0", (place_id,))
+
+
+def backfill_popularity(db):
+    """One-time: rebuilds place_popularity from favorites (migrate)."""
+    weights = {}
+    for r in db.execute("SELECT place_id, created_at FROM favorites"):
+        w, n = weights.get(r["place_id"], (0.0, 0))
+        weights[r["place_id"]] = (w + _popularity_unit(r["created_at"]), n + 1)
+    now = int(time.time())
+    db.execute("DELETE FROM place_popularity")
+    db.executemany("INSERT INTO place_popularity(place_id, weight, saves, updated_at) VALUES(?,?,?,?)",
+                   [(pid, w, n, now) for pid, (w, n) in weights.items()])
+
+
+def place_popularity(place_ids):
+    """Many place ids -> {place_id: decayed save count}, one query per 500 ids."""
+    ids = list(dict.fromkeys(place_ids))
+    scale = 2.0 ** (-(time.time() - POPULARITY_EPOCH) / POPULARITY_HALF_LIFE_SEC)
+    out = {}
+    try:
+        with get_db() as db:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = db.execute(f"""
+                    SELECT place_id, weight FROM place_popularity
+                    WHERE place_id IN ({",".join("?" * len(chunk))})
+                """, chunk).fetchall()
+                for r in rows:
+                    out[r["place_id"]] = r["weight"] * scale
+    except Exception as e:
+        print("⚠️ popularity read error:", e)
+    return out
+
+
+def popularity_points(decayed_saves: float):
+    return POPULARITY_MAX_POINTS * decayed_saves / (decayed_saves + POPULARITY_SATURATION)
+
+
+# =========================================================
+# ✅ FRIEND ACTIVITY FEED (fan-out on write, grid-bucketed)
+# =========================================================
+# friend_saves holds, for every user, the places saved by people they
+# follow (accepted follows only, same as who may see those favorites),
+# keyed (user_id, cy, cx, place_id, friend_id) on a FRIEND_CELL_DEG grid.
+# A save writes one row per follower; follow / unfollow / accept copy or
+# drop that friend's saves. Recommend then reads "friends' saves around
+# me" as one primary-key range scan instead of joining follows to
+# favorites and filtering by distance per request.
+FRIEND_CELL_DEG = 0.02  # ~2.2 km
+FRIEND_POINTS = 8  # per friend who saved a candidate
+FRIEND_MAX_POINTS = 20
+
+
+def _friend_cell(lat, lon):
+    try:
+        return int((float(lat) + 90) // FRIEND_CELL_DEG), int((float(lon) + 180) // FRIEND_CELL_DEG)
+    except:
+        return None
+
+
+def fan_out_save(db, saver_id, place_id: str, lat, lon, saved_at):
+    cell = _friend_cell(lat, lon)
+    if cell is None:
+        return
+    db.execute("""
+        INSERT OR IGNORE INTO friend_saves(user_id, cy, cx, place_id, friend_id, saved_at)
+        SELECT follower_id, ?, ?, ?, ?, ? FROM follows
+        WHERE following_id=? AND status='accepted'
+    """, (cell[0], cell[1], place_id, saver_id, saved_at, saver_id))
+
+
+def retract_save(db, saver_id, place_id: str):
+    db.execute("DELETE FROM friend_saves WHERE friend_id=? AND place_id=?", (saver_id, place_id))
+
+
+def link_friend_feed(db, follower_id, friend_id):
+    """follower_id now sees friend_id's saves (idempotent)."""
+    rows = db.execute("SELECT place_id, lat, lon, created_at FROM favorites WHERE user_id=?", (friend_id,)).fetchall()
+    feed = []
+    for r in rows:
+        cell = _friend_cell(r["lat"], r["lon"])
+        if cell is not None:
+            feed.append((follower_id, cell[0], cell[1], r["place_id"], friend_id, r["created_at"]))
+    db.executemany("""
+        INSERT OR IGNORE INTO friend_saves(user_id, cy, cx, place_id, friend_id, saved_at)
+        VALUES(?,?,?,?,?,?)
+    """, feed)
+
+
+def unlink_friend_feed(db, follower_id, friend_id):
+    db.execute("DELETE FROM friend_saves WHERE user_id=? AND friend_id=?", (follower_id, friend_id))
+
+
+def backfill_friend_feed(db):
+    """One-time: fills friend_saves from the accepted follows (migrate)."""
+    db.execute("DELETE FROM friend_saves")
+    for r in db.execute("SELECT follower_id, following_id FROM follows WHERE status='accepted'").fetchall():
+        link_friend_feed(db, r["follower_id"], r["following_id"])
+
+
+def friend_saves_near(uid, lat, lon, radius_m, place_ids):
+    """
+    {place_id: how many followed users saved it} for the given places,
+    read from the grid cells within ~radius_m of (lat, lon).
+    """
+    ids = list(dict.fromkeys(place_ids))
+    out = {}
+    try:
+        lat, lon = float(lat), float(lon)
+        dlat = radius_m / 111320.0
+        dlon = radius_m / (111320.0 * max(0.01, cos(radians(lat))))
+        lo = _friend_cell(lat - dlat, lon - dlon)
+        hi = _friend_cell(lat + dlat, lon + dlon)
+        with get_db() as db:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = db.execute(f"""
+                    SELECT place_id, COUNT(*) AS n FROM friend_saves
+                    WHERE user_id=? AND cy BETWEEN ? AND ? AND cx BETWEEN ? AND ?
+                      AND place_id IN ({",".join("?" * len(chunk))})
+                    GROUP BY place_id
+                """, [uid, lo[0], hi[0], lo[1], hi[1]] + chunk).fetchall()
+                for r in rows:
+                    out[r["place_id"]] = r["n"]
+    except Exception as e:
+        print("⚠️ friend feed read error:", e)
+    return out
+
+
 # =========================================================
 # ✅ FAVORITES
 # =========================================================
@@ -1188,6 +3150,8 @@ def api_favorites_list():
     if not uid:
         return jsonify([])
 
+    _ensure_place_warmer()
+
     with get_db() as db:
         rows = db.execute("""
             SELECT place_id, name, category, lat, lon, created_at
@@ -1216,11 +3180,14 @@ def api_favorites_add():
         return jsonify({"success": False})
 
     try:
+        now = int(time.time())
         with get_db() as db:
             db.execute("""
                 INSERT INTO favorites(user_id, place_id, name, category, lat, lon, created_at)
                 VALUES(?,?,?,?,?,?,?)
-            """, (uid, place_id, name, category, lat, lon, int(time.time())))
+            """, (uid, place_id, name, category, lat, lon, now))
+            record_save(db, place_id, now)
+            fan_out_save(db, uid, place_id, lat, lon, now)
     except:
         pass
 
@@ -1236,7 +3203,12 @@ def api_favorites_remove():
     place_id = request.json.get("place_id")
 
     with get_db() as db:
-        db.execute("DELETE FROM favorites WHERE user_id=? AND place_id=?", (uid, place_id))
+        row = db.execute("SELECT created_at FROM favorites WHERE user_id=? AND place_id=?",
+                         (uid, place_id)).fetchone()
+        if row:
+            db.execute("DELETE FROM favorites WHERE user_id=? AND place_id=?", (uid, place_id))
+            record_save(db, place_id, row["created_at"], -1)
+            retract_save(db, uid, place_id)
 
     return jsonify({"success": True})
 
@@ -1257,328 +3229,818 @@ def _safe_str(x):
     return (x or "").strip()
 
 
-def _contains_any(text: str, keywords):
+# =========================================================
+# ✅ OPENING HOURS (compiled once per distinct string)
+# =========================================================
+# Subset of the OSM opening_hours grammar: "24/7", weekday ranges/lists,
+# comma separated time spans (past-midnight ends allowed), "off"/"closed".
+# Later rules override earlier ones for the days they name. Anything else
+# (months, PH-only rules, sunrise, "||" fallbacks...) compiles to None and
+# the client-side parser stays in charge of that place.
+OPENING_HOURS_CACHE = OrderedDict()
+OPENING_HOURS_CACHE_MAX = 4096
+OPENING_CLOSING_SOON_MIN = 45
+WEEK_MIN = 7 * 1440
+OH_DAYS = ("mo", "tu", "we", "th", "fr", "sa", "su")
+OH_DAY_RE = re.compile(r"^((?:(?:mo|tu|we|th|fr|sa|su|ph)(?:\s*-\s*(?:mo|tu|we|th|fr|sa|su))?\s*,?\s*)+)(.*)$")
+OH_SPAN_RE = re.compile(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$")
+_OH_UNPARSEABLE = object()
+
+
+def _oh_days(spec: str):
+    days = set()
+    for part in spec.replace(" ", "").strip(",").split(","):
+        if part == "ph":
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            i, j = OH_DAYS.index(a), OH_DAYS.index(b)
+            days.update(OH_DAYS[(i + k) % 7] for k in range(((j - i) % 7) + 1))
+        else:
+            days.add(part)
+    return [OH_DAYS.index(d) for d in days]
+
+
+def _oh_spans(spec: str):
+    spec = spec.strip()
+    if spec in ("", "24/7"):
+        return [(0, 1440)]
+    if spec in ("off", "closed"):
+        return []
+    spans = []
+    for part in spec.split(","):
+        m = OH_SPAN_RE.match(part.strip())
+        if not m:
+            raise ValueError(part)
+        h1, m1, h2, m2 = (int(x) for x in m.groups())
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        if start >= 1440 or end > 48 * 60 or m1 >= 60 or m2 >= 60:
+            raise ValueError(part)
+        if end <= start:
+            end += 1440
+        spans.append((start, end))
+    return spans
+
+
+def compile_opening_hours(oh: str):
+    """
+    opening_hours string -> {"starts", "ends", "always", "late"} or None.
+    starts/ends: sorted, merged minute-of-week intervals (Monday 00:00 = 0).
+    """
+    text = (oh or "").strip().lower().replace("–", "-")
     if not text:
-        return False
-    t = text.lower()
-    return any(k in t for k in keywords)
+        return None
+    if text == "24/7":
+        return {"starts": (0,), "ends": (WEEK_MIN,), "always": True, "late": True}
+
+    week = [[] for _ in range(7)]
+    try:
+        for rule in text.split(";"):
+            rule = rule.strip()
+            if not rule:
+                continue
+            m = OH_DAY_RE.match(rule)
+            if m:
+                days = _oh_days(m.group(1))
+                if not days:
+                    continue  # PH-only rule: holidays are not modelled
+                spans = _oh_spans(m.group(2))
+            else:
+                days = range(7)
+                spans = _oh_spans(rule)
+            for d in days:
+                week[d] = spans
+    except (ValueError, IndexError):
+        return None
+
+    raw = []
+    for d, spans in enumerate(week):
+        for s, e in spans:
+            s, e = d * 1440 + s, d * 1440 + e
+            if e > WEEK_MIN:
+                raw.append((0, e - WEEK_MIN))
+                e = WEEK_MIN
+            raw.append((s, e))
+    raw.sort()
+    merged = []
+    for s, e in raw:
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+
+    always = merged == [[0, WEEK_MIN]]
+    # open past 23:30 / before 03:00 on any night
+    late = any(s < d * 1440 + 180 and e > d * 1440 - 30 for s, e in merged for d in range(8))
+    return {
+        "starts": tuple(s for s, _ in merged),
+        "ends": tuple(e for _, e in merged),
+        "always": always,
+        "late": late,
+    }
+
+
+def opening_hours_compiled(oh: str):
+    """compile_opening_hours() memoized per distinct string (LRU)."""
+    key = (oh or "").strip()
+    item = OPENING_HOURS_CACHE.get(key)
+    cache_hit("opening_hours", item is not None)
+    if item is None:
+        item = compile_opening_hours(key)
+        OPENING_HOURS_CACHE[key] = _OH_UNPARSEABLE if item is None else item
+        if len(OPENING_HOURS_CACHE) > OPENING_HOURS_CACHE_MAX:
+            OPENING_HOURS_CACHE.popitem(last=False)
+        return item
+    OPENING_HOURS_CACHE.move_to_end(key)
+    return None if item is _OH_UNPARSEABLE else item
+
+
+def local_now(tz_offset_min=None):
+    """
+    Viewer's wall clock. tz_offset_min is JS Date.getTimezoneOffset()
+    (UTC - local, in minutes); without it the server's local time is used.
+    """
+    if tz_offset_min is None:
+        return datetime.datetime.now()
+    utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return utc - datetime.timedelta(minutes=int(tz_offset_min))
+
+
+def open_states(hours_strings, now=None, soon_min=OPENING_CLOSING_SOON_MIN):
+    """
+    Bulk open-now evaluation for one recommendation batch.
+    Returns: {opening_hours string: {"open_now", "closing_soon", "next_change_at"}}
+    for every parseable string; next_change_at is epoch ms (None when 24/7).
+    """
+    now = now or datetime.datetime.now()
+    minute = now.weekday() * 1440 + now.hour * 60 + now.minute + now.second / 60.0
+    now_ms = int(time.time() * 1000)
+
+    out = {}
+    for oh in set(h for h in hours_strings if h):
+        c = opening_hours_compiled(oh)
+        if c is None:
+            continue
+        starts, ends = c["starts"], c["ends"]
+        if c["always"]:
+            out[oh] = {"open_now": True, "closing_soon": False, "next_change_at": None}
+            continue
+        if not starts:
+            out[oh] = {"open_now": False, "closing_soon": False, "next_change_at": None}
+            continue
+
+        i = bisect.bisect_right(starts, minute) - 1
+        is_open = i >= 0 and minute < ends[i]
+        if is_open:
+            change = ends[i]
+            if change == WEEK_MIN and starts[0] == 0:
+                change = WEEK_MIN + ends[0]  # open across Sunday -> Monday
+        else:
+            change = starts[i + 1] if i + 1 < len(starts) else starts[0] + WEEK_MIN
+        wait_min = change - minute
+        out[oh] = {
+            "open_now": is_open,
+            "closing_soon": is_open and wait_min <= soon_min,
+            "next_change_at": now_ms + int(wait_min * 60000),
+        }
+    return out
+
 
 
 # ✅ keyword banks for strict filtering
-WORK_KEYWORDS = [
+# (tuples/frozensets: built once, shared copy-on-write by preloaded workers)
+WORK_KEYWORDS = (
     "starbucks", "ccd", "cafe coffee day", "third wave", "thirdwave",
     "book cafe", "book café", "roastery", "coffee", "coffee house",
     "cowork", "co-work", "workspace", "study", "library", "reading",
     "iraj", "irani"
-]
+)
 
-DATE_KEYWORDS = [
+DATE_KEYWORDS = (
     "bistro", "lounge", "rooftop", "terrace", "garden", "aesthetic",
     "cafe", "café", "coffee", "patisserie", "bakery", "brunch"
-]
+)
 
-DATE_BAD_KEYWORDS = [
+DATE_BAD_KEYWORDS = (
     "dhaba", "canteen", "mess", "misal", "vada pav", "vadapav", "tapri",
     "roll", "shawarma", "momos"
-]
+)
 
-BUDGET_KEYWORDS = [
+BUDGET_KEYWORDS = (
     "misal", "vadapav", "vada pav", "poha", "upma", "chai", "tea", "tapri",
     "momos", "roll", "shawarma", "sandwich", "bhurji", "omelette",
     "chinese", "noodles", "fried rice", "thali", "mess", "bhojanalay",
     "snacks", "juice", "cold coffee", "tiffin"
-]
+)
 
-EXPENSIVE_KEYWORDS = [
+EXPENSIVE_KEYWORDS = (
     "fine dine", "fine-dine", "luxury", "premium", "bar", "pub"
-]
+)
 
+WIFI_VALUES = frozenset(("yes", "wlan", "wifi"))
+SPORT_LEISURE = frozenset(("fitness_centre", "sports_centre", "swimming_pool", "pitch", "track"))
+LATE_NIGHT_AMENITIES = frozenset(("cafe", "restaurant", "fast_food", "bar", "pub", "nightclub"))
+NIGHTLIFE_AMENITIES = frozenset(("bar", "pub", "nightclub"))
 
-def _hard_filter_place(mood: str, tags: dict):
-    amenity = _safe_str(tags.get("amenity", "")).lower()
-    name = _safe_str(tags.get("name", "")).lower()
-
-    # WORK
-    if mood == "work":
-        if amenity == "coworking_space":
-            return True
-        if _safe_str(tags.get("office")).lower() == "coworking":
-            return True
-        if amenity == "cafe":
-            wifi_ok = _safe_str(tags.get("internet_access")).lower() in ["yes", "wlan", "wifi"]
-            kw_ok = _contains_any(name, WORK_KEYWORDS)
-            return wifi_ok or kw_ok
-        return False
 
-    # DATE
-    if mood == "date":
-        if amenity not in ["cafe", "restaurant"]:
-            return False
-        if amenity == "fast_food":
-            return False
-        if _contains_any(name, DATE_BAD_KEYWORDS):
-            return False
-        vibe_ok = (
-            _contains_any(name, DATE_KEYWORDS)
-            or _safe_str(tags.get("outdoor_seating")).lower() == "yes"
-            or _safe_str(tags.get("wheelchair")).lower() == "yes"
-        )
-        return vibe_ok
+# =========================================================
+# ✅ MOOD RULES (one declarative spec per mood, compiled at import)
+# =========================================================
+# Conditions are plain tuples:
+#   ("tag", key, values)   lowercased tag value in values (values=None: tag present)
+#   ("name", bank)         place name contains a keyword from bank
+#   ("hours", test)        opening_hours: always / late / closed / closing_soon / present
+#   ("not", c), ("any", c, ...), ("all", c, ...)
+# "score" lists (condition, points) added on top of MOOD_BASE_SCORE and the
+# distance ladder. compile_mood() turns a spec into the Overpass query
+# (generated from "match", see _overpass_clauses), a match predicate and a
+# scorer; adding a mood is a spec entry.
+def _tag(key, *values):
+    return ("tag", key, frozenset(values) if values else None)
+
+
+def _any(*conds):
+    return ("any",) + conds
+
+
+def _all(*conds):
+    return ("all",) + conds
+
+
+def _not(cond):
+    return ("not", cond)
+
+
+def _name(bank):
+    return ("name", bank)
+
+
+def _hours(test):
+    return ("hours", test)
+
+
+DISTANCE_POINTS = ((0.3, 18), (0.8, 14), (1.5, 10), (2.5, 6), (4, 2))
+DISTANCE_FAR_POINTS = -2
+
+MOOD_BASE_SCORE = (
+    (_tag("opening_hours"), 2),
+    (_any(_tag("website"), _tag("contact:website")), 2),
+    (_any(_tag("phone"), _tag("contact:phone")), 1),
+    (_tag("internet_access", *WIFI_VALUES), 5),
+)
+
+MOOD_SPECS = MappingProxyType({
+    "work": {
+        "radius": 6000,
+        "match": _any(
+            _tag("amenity", "coworking_space"),
+            _tag("office", "coworking"),
+            _all(_tag("amenity", "cafe"), _any(_tag("internet_access", *WIFI_VALUES), _name(WORK_KEYWORDS))),
+        ),
+        "score": (
+            (_any(_tag("amenity", "coworking_space"), _tag("office", "coworking")), 60),
+            (_tag("amenity", "cafe"), 16),
+            (_name(WORK_KEYWORDS), 14),
+            (_tag("amenity", "fast_food"), -40),
+        ),
+    },
+    "date": {
+        "radius": 5000,
+        "match": _all(
+            _tag("amenity", "cafe", "restaurant"),
+            _not(_name(DATE_BAD_KEYWORDS)),
+            _any(_name(DATE_KEYWORDS), _tag("outdoor_seating", "yes"), _tag("wheelchair", "yes")),
+        ),
+        "score": (
+            (_tag("amenity", "cafe"), 18),
+            (_tag("amenity", "restaurant"), 14),
+            (_tag("outdoor_seating", "yes"), 14),
+            (_name(DATE_KEYWORDS), 12),
+            (_name(DATE_BAD_KEYWORDS), -25),
+            (_tag("amenity", "fast_food"), -60),
+        ),
+    },
+    "quick_bites": {
+        "radius": 4000,
+        "match": _tag("amenity", "fast_food"),
+        "score": (
+            (_tag("amenity", "fast_food"), 30),
+            (_not(_tag("amenity", "fast_food")), -70),
+        ),
+    },
+    "pocket_friendly": {
+        "radius": 7000,
+        "match": _all(
+            _tag("amenity", "restaurant", "fast_food", "food_court"),
+            _not(_name(EXPENSIVE_KEYWORDS)),
+        ),
+        "score": (
+            (_tag("amenity", "fast_food"), 12),
+            (_tag("amenity", "restaurant"), 10),
+            (_tag("amenity", "food_court"), 14),
+            (_name(BUDGET_KEYWORDS), 22),
+            (_name(EXPENSIVE_KEYWORDS), -18),
+        ),
+    },
+    "calm": {
+        "radius": 6000,
+        "match": _any(_tag("leisure", "park"), _tag("tourism", "viewpoint"), _tag("amenity", "bench")),
+    },
+    "high_adrenaline": {
+        "radius": 7000,
+        "match": _any(_tag("amenity", "gym"), _tag("leisure", *SPORT_LEISURE), _tag("sport")),
+    },
+    "exploring": {
+        "radius": 9000,
+        "match": _any(_tag("tourism"), _tag("historic"), _tag("natural")),
+    },
+    "late_night": {
+        "radius": 5000,
+        "match": _tag("amenity", *LATE_NIGHT_AMENITIES),
+        "score": (
+            (_tag("amenity", *NIGHTLIFE_AMENITIES), 30),
+            (_hours("always"), 40),
+            (_hours("late"), 25),
+            (_hours("closed"), -30),
+            (_hours("closing_soon"), -12),
+            (_hours("present"), 8),
+        ),
+    },
+})
+
+
+class _PlaceView:
+    """What the compiled conditions look at, computed once per place."""
+    __slots__ = ("tags", "name", "hours_text", "hours", "state")
+
+    def __init__(self, tags, state=None, with_hours=False):
+        self.tags = tags
+        self.name = _safe_str(tags.get("name")).lower()
+        self.state = state
+        raw = tags.get("opening_hours") if with_hours else None
+        self.hours_text = (raw or "").lower()
+        self.hours = opening_hours_compiled(raw) if raw else None
+
+
+def _hours_always(v):
+    return v.hours["always"] if v.hours else "24/7" in v.hours_text
+
+
+def _hours_late(v):
+    if v.hours:
+        return v.hours["late"] and not v.hours["always"]
+    # unparsed string: textual hints
+    return "24:00" in v.hours_text or "02:00" in v.hours_text or "03:00" in v.hours_text
+
+
+HOURS_TESTS = MappingProxyType({
+    "always": _hours_always,
+    "late": _hours_late,
+    "closed": lambda v: v.state is not None and not v.state["open_now"],
+    "closing_soon": lambda v: v.state is not None and v.state["open_now"] and v.state["closing_soon"],
+    "present": lambda v: bool(v.hours_text),
+})
+
+
+def _compile_condition(cond):
+    op = cond[0]
+    if op == "tag":
+        _, key, values = cond
+        if values is None:
+            return lambda v: bool(_safe_str(v.tags.get(key)))
+        return lambda v: _safe_str(v.tags.get(key)).lower() in values
+    if op == "name":
+        bank = cond[1]
+        return lambda v: any(k in v.name for k in bank)
+    if op == "hours":
+        return HOURS_TESTS[cond[1]]
+    if op == "not":
+        inner = _compile_condition(cond[1])
+        return lambda v: not inner(v)
+    parts = tuple(_compile_condition(c) for c in cond[1:])
+    if op == "any":
+        return lambda v: any(f(v) for f in parts)
+    if op == "all":
+        return lambda v: all(f(v) for f in parts)
+    raise ValueError(f"unknown mood condition: {op!r}")
+
+
+def _uses_hours(cond):
+    if cond[0] == "hours":
+        return True
+    if cond[0] in ("not", "any", "all"):
+        return any(_uses_hours(c) for c in cond[1:])
+    return False
 
-    # QUICK BITES
-    if mood == "quick_bites":
-        return amenity == "fast_food"
 
-    # POCKET FRIENDLY
-    if mood == "pocket_friendly":
-        if amenity not in ["restaurant", "fast_food", "food_court"]:
-            return False
-        if _contains_any(name, EXPENSIVE_KEYWORDS):
-            return False
-        return True
+def _distance_points(distance_km: float):
+    for limit, points in DISTANCE_POINTS:
+        if distance_km <= limit:
+            return points
+    return DISTANCE_FAR_POINTS
 
-    # CALM
-    if mood == "calm":
-        return (
-            tags.get("leisure") == "park"
-            or tags.get("tourism") == "viewpoint"
-            or tags.get("amenity") == "bench"
-        )
 
-    # HIGH ON ADRENALINE
-    if mood == "high_adrenaline":
-        return (
-            tags.get("amenity") == "gym"
-            or tags.get("leisure") in [
-                "fitness_centre",
-                "sports_centre",
-                "swimming_pool",
-                "pitch",
-                "track"
-            ]
-            or tags.get("sport") is not None
-        )
+# recommend drops nameless places further than this whose category
+# (amenity, else leisure, else office) is one of UNNAMED_GENERIC
+UNNAMED_MAX_KM = 1.2
+UNNAMED_GENERIC = ("cafe", "restaurant", "fast food", "place")
+UNNAMED_CATEGORY_KEYS = ("amenity", "leisure", "office")
+OVERPASS_NODE_LIMIT = 160
+OVERPASS_AREA_LIMIT = 60
+QL_REGEX_SPECIAL = re.compile(r'([.^$|?*+()\[\]{}\\])')
 
-    # EXPLORING
-    if mood == "exploring":
-        return (
-            tags.get("tourism") is not None
-            or tags.get("historic") is not None
-            or tags.get("natural") is not None
-        )
 
-    # LATE NIGHT
-    if mood == "late_night":
-        return amenity in [
-            "cafe", "restaurant", "fast_food",
-            "bar", "pub", "nightclub"
-        ]
+def _ql_regex(words):
+    rx = "|".join(QL_REGEX_SPECIAL.sub(r"\\\1", w) for w in sorted(words))
+    return rx.replace("\\", "\\\\").replace('"', '\\"')
 
-    return False
 
+def _ql_atom(atom):
+    kind = atom[0]
+    if kind == "has":
+        return f'["{atom[1]}"]'
+    if kind == "hasnot":
+        return f'[!"{atom[1]}"]'
+    if kind in ("in", "notin"):
+        _, key, values = atom
+        # match() lowercases tag values, so "=" would miss "Yes" / "WiFi"
+        return f'["{key}"{"~" if kind == "in" else "!~"}"^({_ql_regex(values)})$",i]'
+    if kind in ("name", "notname"):
+        return f'["name"{"~" if kind == "name" else "!~"}"{_ql_regex(atom[1])}",i]'
+    raise ValueError(f"unknown overpass atom: {kind!r}")
 
 
-def _score_place(mood: str, tags: dict, distance_km: float):
+def _overpass_clauses(cond):
     """
-    Ranking system:
-    - distance matters
-    - mood-based scoring + keyword boosts
+    Match condition -> OR of AND-clauses of Overpass filters (DNF).
+    Parts Overpass cannot express (opening hours, negated groups) are left
+    out, so the query returns a superset and match() stays the final word.
     """
-    score = 0.0
+    op = cond[0]
+    if op == "tag":
+        if cond[2] is None:
+            return [(("has", cond[1]),)]
+        return [(("in", cond[1], cond[2]),)]
+    if op == "name":
+        return [(("name", cond[1]),)]
+    if op == "not":
+        inner = cond[1]
+        if inner[0] == "tag":
+            return [(("hasnot", inner[1]),)] if inner[2] is None else [(("notin", inner[1], inner[2]),)]
+        if inner[0] == "name":
+            return [(("notname", inner[1]),)]
+        return [()]
+    if op == "any":
+        out = []
+        for c in cond[1:]:
+            sub = _overpass_clauses(c)
+            if () in sub:
+                return [()]
+            out += sub
+        return out
+    if op == "all":
+        out = [()]
+        for c in cond[1:]:
+            out = [a + b for a in out for b in _overpass_clauses(c)]
+        return out
+    return [()]
+
+
+def _unnamed_kept_ql():
+    # one filter chain per category key recommend looks at, in its order:
+    # the category is that key's value, kept unless it is a generic one
+    generic = _ql_regex({v for w in UNNAMED_GENERIC for v in (w, w.replace(" ", "_"))})
+    out = []
+    for i, key in enumerate(UNNAMED_CATEGORY_KEYS):
+        missing = "".join(f'[!"{k}"]' for k in UNNAMED_CATEGORY_KEYS[:i])
+        out.append(f'{missing}["{key}"]["{key}"!~"^({generic})$",i]')
+    return tuple(out)
 
-    # base distance
-    if distance_km <= 0.3:
-        score += 18
-    elif distance_km <= 0.8:
-        score += 14
-    elif distance_km <= 1.5:
-        score += 10
-    elif distance_km <= 2.5:
-        score += 6
-    elif distance_km <= 4:
-        score += 2
-    else:
-        score -= 2
-
-    name = _safe_str(tags.get("name", "")).lower()
-    amenity = _safe_str(tags.get("amenity", "")).lower()
-
-    # boosts
-    if _safe_str(tags.get("opening_hours")):
-        score += 2
-    if _safe_str(tags.get("website")) or _safe_str(tags.get("contact:website")):
-        score += 2
-    if _safe_str(tags.get("phone")) or _safe_str(tags.get("contact:phone")):
-        score += 1
-
-    if _safe_str(tags.get("internet_access")).lower() in ["yes", "wlan", "wifi"]:
-        score += 5
-
-    if mood == "work":
-        if amenity == "coworking_space" or _safe_str(tags.get("office")).lower() == "coworking":
-            score += 60
-        if amenity == "cafe":
-            score += 16
-        if _contains_any(name, WORK_KEYWORDS):
-            score += 14
-        if amenity == "fast_food":
-            score -= 40
-
-    elif mood == "date":
-        if amenity == "cafe":
-            score += 18
-        if amenity == "restaurant":
-            score += 14
-        if _safe_str(tags.get("outdoor_seating")).lower() == "yes":
-            score += 14
-        if _contains_any(name, DATE_KEYWORDS):
-            score += 12
-        if _contains_any(name, DATE_BAD_KEYWORDS):
-            score -= 25
-        if amenity == "fast_food":
-            score -= 60
-
-    elif mood == "quick_bite":
-        if amenity == "fast_food":
-            score += 30
-        else:
-            score -= 70
-
-    elif mood == "budget":
-        if amenity == "fast_food":
-            score += 12
-        if amenity == "restaurant":
-            score += 10
-        if amenity == "food_court":
-            score += 14
-        if _contains_any(name, BUDGET_KEYWORDS):
-            score += 22
-        if _contains_any(name, EXPENSIVE_KEYWORDS):
-            score -= 18
-    
-    elif mood == "late_night":
-        if tags.get("amenity") in [
-            "bar", "pub", "nightclub"
-        ]:
-            score += 30
-
-        opening = (tags.get("opening_hours") or "").lower()
-
-        # boost 24/7
-        if "24/7" in opening:
-            score += 40
-
-        # boost midnight+
-        if "24:00" in opening or "02:00" in opening or "03:00" in opening:
-            score += 25
-
-        # small boost if opening hours exist
-        if opening:
-            score += 8
-
-
-    return score
-
-
-def fetch_places_for_mood(mood, lat, lon, radius=5000):
-    lat = float(lat)
-    lon = float(lon)
-
-    blocks = []
-
-    if mood == "work":
-        blocks += [
-            f'node["amenity"="coworking_space"](around:{radius},{lat},{lon});',
-            f'node["office"="coworking"](around:{radius},{lat},{lon});',
-            f'node["amenity"="cafe"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "date":
-        blocks += [
-            f'node["amenity"="cafe"](around:{radius},{lat},{lon});',
-            f'node["amenity"="restaurant"](around:{radius},{lat},{lon});',
-            f'node["outdoor_seating"="yes"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "quick_bites":
-        blocks += [
-            f'node["amenity"="fast_food"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "pocket_friendly":
-        blocks += [
-            f'node["amenity"="restaurant"](around:{radius},{lat},{lon});',
-            f'node["amenity"="fast_food"](around:{radius},{lat},{lon});',
-            f'node["amenity"="food_court"](around:{radius},{lat},{lon});',
-            f'node["amenity"="street_vendor"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "calm":
-        blocks += [
-            f'node["leisure"="park"](around:{radius},{lat},{lon});',
-            f'node["tourism"="viewpoint"](around:{radius},{lat},{lon});',
-            f'node["amenity"="bench"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "high_adrenaline":
-        blocks += [
-            f'node["amenity"="gym"](around:{radius},{lat},{lon});',
-            f'node["leisure"="fitness_centre"](around:{radius},{lat},{lon});',
-            f'node["leisure"="sports_centre"](around:{radius},{lat},{lon});',
-            f'node["leisure"="swimming_pool"](around:{radius},{lat},{lon});',
-            f'node["sport"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "exploring":
-        blocks += [
-            f'node["tourism"](around:{radius},{lat},{lon});',
-            f'node["historic"](around:{radius},{lat},{lon});',
-            f'node["natural"](around:{radius},{lat},{lon});'
-        ]
-
-    elif mood == "late_night":
-        blocks += [
-            f'node["amenity"="cafe"](around:{radius},{lat},{lon});',
-            f'node["amenity"="restaurant"](around:{radius},{lat},{lon});',
-            f'node["amenity"="fast_food"](around:{radius},{lat},{lon});',
-            f'node["amenity"="bar"](around:{radius},{lat},{lon});',
-            f'node["amenity"="pub"](around:{radius},{lat},{lon});',
-            f'node["amenity"="nightclub"](around:{radius},{lat},{lon});'
-        ]
 
-    query = f"""
-    [out:json][timeout:30];
-    (
-      {''.join(blocks)}
-    );
-    out 160;
+_UNNAMED_KEPT_QL = _unnamed_kept_ql()
+
+
+def _overpass_query(spec: dict):
+    """
+    Overpass QL template ({radius}/{unnamed}/{lat}/{lon}) for a mood.
+    Each anchor tag (first key filter of a DNF clause) is searched once
+    around the user into a named set; the remaining filters then run on
+    that set. Nameless matches of a generic category only within
+    UNNAMED_MAX_KM (see UNNAMED_GENERIC); nodes come with coordinates,
+    ways/relations with their centre and tags only.
+    """
+    elements = spec.get("elements", "nwr")
+    anchors = {}
+    stmts = []
+    for clause in _overpass_clauses(spec["match"]):
+        anchor = next((a for a in clause if a[0] in ("in", "has")), None)
+        if anchor is None:
+            raise ValueError("mood match has a branch without a tag filter; it would fetch everything")
+        name = anchors.setdefault(anchor, f"a{len(anchors)}")
+        rest = [a for a in clause if a is not anchor]
+        atoms = "".join(_ql_atom(a) for a in rest)
+        if not any(a[0] == "name" for a in rest):
+            unnamed = "".join(_ql_atom(a) for a in rest if a[0] != "notname")
+            stmts.append(f'{elements}.{name}{unnamed}[!"name"](around:{{unnamed}},{{lat}},{{lon}});')
+            stmts += [f'{elements}.{name}{unnamed}[!"name"]{c};' for c in _UNNAMED_KEPT_QL]
+            atoms += '["name"]'
+        stmts.append(f"{elements}.{name}{atoms};")
+
+    sets = "".join(
+        f"{elements}{_ql_atom(anchor)}(around:{{radius}},{{lat}},{{lon}})->.{name};"
+        for anchor, name in anchors.items()
+    )
+    return (
+        "[out:json][timeout:30];" + sets
+        + "(" + "".join(dict.fromkeys(stmts)) + ")->.r;"
+        + f"node.r;out qt {OVERPASS_NODE_LIMIT};"
+        + f"(way.r;relation.r;);out tags center qt {OVERPASS_AREA_LIMIT};"
+    )
+
+
+def compile_mood(spec: dict):
+    """
+    spec -> {"radius", "query", "match", "score"}
+    query: Overpass QL template with {radius}/{unnamed}/{lat}/{lon} placeholders
+    match(tags) -> bool, score(tags, distance_km, open_state=None) -> float
     """
+    test = _compile_condition(spec["match"])
+    score_rules = MOOD_BASE_SCORE + tuple(spec.get("score", ()))
+    rules = tuple((_compile_condition(c), float(points)) for c, points in score_rules)
+    with_hours = any(_uses_hours(c) for c, _ in score_rules)
+
+    def match(tags):
+        return test(_PlaceView(tags))
+
+    def score(tags, distance_km, open_state=None):
+        view = _PlaceView(tags, open_state, with_hours)
+        total = float(_distance_points(distance_km))
+        for check, points in rules:
+            if check(view):
+                total += points
+        return total
+
+    return MappingProxyType({
+        "radius": int(spec["radius"]),
+        "query": _overpass_query(spec),
+        "match": match,
+        "score": score,
+    })
+
+
+COMPILED_MOODS = MappingProxyType({mood: compile_mood(spec) for mood, spec in MOOD_SPECS.items()})
+ALLOWED_MOODS = frozenset(MOOD_SPECS)
+
+
+# =========================================================
+# ✅ OVERPASS RESPONSE PARSING (sniffed, one pass, compact records)
+# =========================================================
+# Mood searches can return megabytes of JSON. Instead of lowercasing a
+# copy of the body to spot HTML error pages and then building the full
+# element tree, the body is sniffed from its Content-Type / first byte
+# and decoded in one pass whose object hook reduces every element to a
+# Poi (only the tags recommend reads) the moment the decoder closes it,
+# so full per-element dicts never pile up.
+def _condition_tag_keys(cond):
+    op = cond[0]
+    if op == "tag":
+        return {cond[1]}
+    if op == "name":
+        return {"name"}
+    if op == "hours":
+        return {"opening_hours"}
+    if op == "not":
+        return _condition_tag_keys(cond[1])
+    return set().union(*(_condition_tag_keys(c) for c in cond[1:]))
+
+
+# every key a mood rule tests, plus what recommend puts in its output
+POI_TAG_KEYS = frozenset(
+    {"name", "opening_hours", "amenity", "leisure", "office",
+     "phone", "contact:phone", "website", "contact:website"}.union(
+        *(_condition_tag_keys(c) for c, _ in MOOD_BASE_SCORE),
+        *(_condition_tag_keys(spec["match"]) for spec in MOOD_SPECS.values()),
+        *(_condition_tag_keys(c) for spec in MOOD_SPECS.values() for c, _ in spec.get("score", ())),
+    )
+)
 
 
+class Poi:
+    """One mood-search candidate; tags trimmed to POI_TAG_KEYS."""
+    __slots__ = ("type", "id", "lat", "lon", "tags")
+
+    def __init__(self, osm_type, osm_id, lat, lon, tags):
+        self.type = osm_type
+        self.id = osm_id
+        self.lat = lat
+        self.lon = lon
+        self.tags = tags
+
+
+def poi_from_element(el: dict):
+    # ways/relations come back with a centre instead of lat/lon
+    center = el.get("center") or {}
+    lat = el.get("lat", center.get("lat"))
+    lon = el.get("lon", center.get("lon"))
+    if not lat or not lon:
+        return None
+    raw = el.get("tags") or {}
+    # the full tags dict is released together with its element
+    tags = {k: raw[k] for k in POI_TAG_KEYS if k in raw}
+    return Poi(el.get("type", "node"), el.get("id"), lat, lon, tags)
+
+
+def overpass_is_json(res) -> bool:
+    """Content-Type first, then the first non-blank byte; never scans the body."""
+    ctype = (res.headers.get("Content-Type") or "").lower()
+    if "html" in ctype or "xml" in ctype:
+        return False
+    return res.content[:256].lstrip()[:1] == b"{"
+
+
+def parse_overpass(body: bytes, make=None):
+    """
+    -> (elements, remark). With make, each element object goes through
+    make() as soon as it is decoded (None drops it).
+    """
+    def hook(obj):
+        # elements carry an integer id; tags/center/members never do
+        if type(obj.get("id")) is int and "type" in obj:
+            return make(obj)
+        return obj
+
+    data = json.loads(body, object_hook=hook if make else None)
+    elements = data.get("elements") or []
+    if make:
+        elements = [el for el in elements if el is not None]
+    return elements, _safe_str(data.get("remark"))
+
+
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="fetch_places_for_mood")
+def fetch_places_for_mood(mood, lat, lon, radius=None):
+    rules = COMPILED_MOODS.get(mood)
+    if not rules:
+        return []
+    radius = int(radius or rules["radius"])
+    query = rules["query"].format(
+        radius=radius,
+        # recommend compares the distance rounded to 10 m; a little slack
+        # also covers Overpass measuring with a slightly different earth
+        unnamed=min(radius, int(UNNAMED_MAX_KM * 1000) + 10),
+        lat=float(lat),
+        lon=float(lon),
+    )
+
     headers = {
-        "User-Agent": "MoodMap/1.0 (contact: moodmap)",
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
         "Cache-Control": "no-cache"
     }
 
     for url in OVERPASS_URLS:
         try:
-            res = requests.post(url, data=query, timeout=28, headers=headers)
-            txt = (res.text or "").strip()
+            res = http_session().post(url, data=query, timeout=http_timeout(28), headers=headers)
+            metrics_inc("moodmaps_overpass_response_bytes_total", len(res.content), mirror=url)
 
-            if not txt or "html" in txt.lower():
+            if not overpass_is_json(res):
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="html")
                 continue
 
-            data = res.json()
-            elements = data.get("elements", [])
+            elements, remark = parse_overpass(res.content, poi_from_element)
             if elements:
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="ok")
                 return elements
+            # overloaded mirrors answer with an empty set plus a runtime-error remark
+            if "error" in remark.lower():
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="remark")
+                continue
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="empty")
+            return []
 
         except Exception as e:
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="error")
             print("⚠️ Overpass fail:", url, "->", e)
             continue
 
-    return []
+    # None: no mirror answered (vs [] = nothing there)
+    return None
+
+
+# =========================================================
+# ✅ ADAPTIVE SEARCH RADIUS (rings + learned per-tile density)
+# =========================================================
+# recommend starts with the smallest ring that should hold RECOMMEND_TARGET
+# matching candidates given what earlier responses taught us about this
+# map tile, and widens ring by ring (up to the mood's radius) until it has
+# enough. Dense centres stay on 1-2 km queries, sparse areas jump straight
+# to the wide ring instead of walking up to it every time.
+RADIUS_RINGS_M = (1000, 2000, 3500, 5000, 7000, 9000)
+RADIUS_START_M = 2000  # tile never seen
+RECOMMEND_TARGET = 40
+DENSITY_TILE_DEG = 0.05  # ~5.5 km
+DENSITY_ALPHA = 0.3  # weight of the newest observation
+DENSITY_PERSIST_SEC = 5 * 60
+TILE_DENSITY = OrderedDict()  # (mood, tile) -> {"density", "samples", "persisted_at"}
+TILE_DENSITY_MAX = 20000
+
+
+def density_tile(lat, lon):
+    return f"{int((float(lat) + 90) // DENSITY_TILE_DEG)}:{int((float(lon) + 180) // DENSITY_TILE_DEG)}"
+
+
+def _tile_density_item(mood, tile):
+    key = (mood, tile)
+    item = TILE_DENSITY.get(key)
+    cache_hit("tile_density", item is not None)
+    if item is not None:
+        TILE_DENSITY.move_to_end(key)
+        return item
+
+    row = None
+    try:
+        with get_db() as db:
+            row = db.execute("SELECT density, samples FROM tile_density WHERE mood=? AND tile=?", key).fetchone()
+    except Exception as e:
+        print("⚠️ tile_density read error:", e)
+    item = {
+        "density": float(row["density"]) if row else None,
+        "samples": int(row["samples"] or 0) if row else 0,
+        "persisted_at": time.time() if row else 0,
+    }
+    TILE_DENSITY[key] = item
+    if len(TILE_DENSITY) > TILE_DENSITY_MAX:
+        TILE_DENSITY.popitem(last=False)
+    return item
+
+
+def record_tile_density(mood, tile, matched, radius_m, truncated=False):
+    """
+    Folds one observation (matched candidates within radius_m) into the
+    tile's EWMA. A truncated response only proves a lower bound.
+    """
+    item = _tile_density_item(mood, tile)
+    observed = matched / (pi * (radius_m / 1000.0) ** 2)
+    if item["density"] is None:
+        item["density"] = observed
+    elif truncated:
+        item["density"] = max(item["density"], observed)
+    else:
+        item["density"] += DENSITY_ALPHA * (observed - item["density"])
+    item["samples"] += 1
+
+    # other workers learn from the DB copy; no need to write every request
+    now = time.time()
+    if item["samples"] > 3 and now - item["persisted_at"] < DENSITY_PERSIST_SEC:
+        return
+    item["persisted_at"] = now
+    try:
+        with get_db() as db:
+            db.execute("""
+                INSERT INTO tile_density(mood, tile, density, samples, updated_at) VALUES(?,?,?,?,?)
+                ON CONFLICT(mood, tile) DO UPDATE SET
+                    density=excluded.density, samples=excluded.samples, updated_at=excluded.updated_at
+            """, (mood, tile, item["density"], item["samples"], int(now)))
+    except Exception as e:
+        print("⚠️ tile_density write error:", e)
+
+
+def search_rings(mood, lat, lon, max_radius):
+    rings = [r for r in RADIUS_RINGS_M if r < max_radius] + [int(max_radius)]
+    density = _tile_density_item(mood, density_tile(lat, lon))["density"]
+    if density is None:
+        return [r for r in rings if r >= min(RADIUS_START_M, rings[-1])]
+    if density <= 0:
+        return rings[-1:]
+    need_m = 1000 * sqrt(RECOMMEND_TARGET / (pi * density))
+    return [r for r in rings if r >= need_m] or rings[-1:]
+
+
+def fetch_places_adaptive(mood, rules, lat, lon):
+    """
+    Widening ring search. Returns (elements, radius_used); elements is
+    None only when Overpass could not be reached at all. The first ring
+    no mirror answers ends the search: each ring is a full mirror sweep,
+    and an outage must not hold the worker past its timeout.
+    """
+    tile = density_tile(lat, lon)
+    found = {}
+    answered = False
+    radius = None
+    for radius in search_rings(mood, lat, lon, rules["radius"]):
+        raw = fetch_places_for_mood(mood, lat, lon, radius)
+        metrics_inc("moodmaps_recommend_rings_total", mood=mood, radius=radius)
+        if raw is None:
+            break
+        answered = True
+        for p in raw:
+            found[(p.type, p.id)] = p
+        matched = sum(1 for p in found.values() if rules["match"](p.tags))
+        # each element type has its own "out" limit, so count them apart
+        nodes = sum(1 for p in raw if p.type == "node")
+        truncated = nodes >= OVERPASS_NODE_LIMIT or len(raw) - nodes >= OVERPASS_AREA_LIMIT
+        record_tile_density(mood, tile, matched, radius, truncated)
+        if matched >= RECOMMEND_TARGET or truncated:
+            break
+    return (list(found.values()) if answered else None), radius
 
 
 # =========================================================
@@ -1590,13 +4052,17 @@ PLACE_DETAILS_TTL_SEC = 10 * 60
 
 
 def _cache_get(key: str):
+    cache = "address" if key.startswith("addr:") else "place_details"
     try:
         item = PLACE_DETAILS_CACHE.get(key)
         if not item:
+            cache_hit(cache, False)
             return None
         if int(time.time()) > int(item.get("expires_at", 0)):
             PLACE_DETAILS_CACHE.pop(key, None)
+            cache_hit(cache, False)
             return None
+        cache_hit(cache, True)
         return item.get("data")
     except:
         return None
@@ -1612,6 +4078,35 @@ def _cache_set(key: str, data):
         pass
 
 
+# Built payloads are also kept in the place_details table, shared by all
+# workers (and filled ahead of time by the FAVORITES WARMER), so a place
+# built once is not rebuilt by every worker every 10 minutes.
+PLACE_STORE_SEC = 2 * 24 * 3600
+
+
+def place_store_load(place_id: str):
+    try:
+        with get_db() as db:
+            row = db.execute("SELECT data, fetched_at FROM place_details WHERE place_id=?", (place_id,)).fetchone()
+    except Exception as e:
+        print("⚠️ place store read error:", e)
+        row = None
+    fresh = row is not None and time.time() - int(row["fetched_at"] or 0) < PLACE_STORE_SEC
+    cache_hit("place_store", fresh)
+    return json.loads(row["data"]) if fresh else None
+
+
+def place_store_save(place_id: str, data):
+    try:
+        with get_db() as db:
+            db.execute("""
+                INSERT INTO place_details(place_id, data, fetched_at) VALUES(?,?,?)
+                ON CONFLICT(place_id) DO UPDATE SET data=excluded.data, fetched_at=excluded.fetched_at
+            """, (place_id, json.dumps(data, ensure_ascii=False), int(time.time())))
+    except Exception as e:
+        print("⚠️ place store write error:", e)
+
+
 def _safe_float(x):
     try:
         return float(x)
@@ -1665,13 +4160,14 @@ def _extract_contact(tags: dict):
 
 
 
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="_reverse_geocode_nominatim")
 def _reverse_geocode_nominatim(lat, lon):
     """
     Returns:
       { display_name, address }
     """
     try:
-        url = "https://nominatim.openstreetmap.org/reverse"
+        url = f"{NOMINATIM_URL}/reverse"
         params = {
             "format": "jsonv2",
             "lat": lat,
@@ -1679,10 +4175,7 @@ def _reverse_geocode_nominatim(lat, lon):
             "zoom": 18,
             "addressdetails": 1
         }
-        headers = {
-            "User-Agent": "MoodMap/1.0 (contact: moodmap)"
-        }
-        r = requests.get(url, params=params, headers=headers, timeout=10)
+        r = http_session().get(url, params=params, timeout=http_timeout(10))
         if r.status_code != 200:
             return None
         data = r.json()
@@ -1692,55 +4185,243 @@ def _reverse_geocode_nominatim(lat, lon):
         return None
 
 
+# =========================================================
+# ✅ REVERSE-GEOCODE STORE (persistent, grid-indexed)
+# =========================================================
+# Addresses barely change, so every one we learn (from a place's addr:*
+# tags or from Nominatim) is kept in geocode_cache, bucketed by
+# GEOCODE_CELL_DEG grid cell. A lookup reuses the smallest known
+# building (bbox) containing the point, else the nearest entry within
+# GEOCODE_REUSE_M. Only real misses go to Nominatim, and those share
+# one 1/sec slot across all workers (usage policy) via app_meta.
+GEOCODE_CELL_DEG = 0.001  # ~110 m
+GEOCODE_REUSE_M = 12
+GEOCODE_AREA_MAX_CELLS = 16  # larger areas (parks, campuses) are stored as a point
+GEOCODE_TTL_SEC = 180 * 24 * 3600
+NOMINATIM_MIN_INTERVAL_SEC = float(os.environ.get("NOMINATIM_MIN_INTERVAL_SEC", "1.0"))  # 0: local stub
+NOMINATIM_MAX_WAIT_SEC = 2.0
+
+
+def _geo_cell(lat, lon):
+    return int((float(lat) + 90) // GEOCODE_CELL_DEG), int((float(lon) + 180) // GEOCODE_CELL_DEG)
+
+
+def _geo_cell_key(i, j):
+    return f"{i}:{j}"
+
+
+def _bbox_cells(bounds):
+    """cells covered by an Overpass/Nominatim bbox, or None when it is too large"""
+    try:
+        lo = _geo_cell(bounds["minlat"], bounds["minlon"])
+        hi = _geo_cell(bounds["maxlat"], bounds["maxlon"])
+    except:
+        return None
+    if (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) > GEOCODE_AREA_MAX_CELLS:
+        return None
+    return [_geo_cell_key(i, j) for i in range(lo[0], hi[0] + 1) for j in range(lo[1], hi[1] + 1)]
+
+
+def geocode_lookup(lat, lon):
+    lat, lon = float(lat), float(lon)
+    ci, cj = _geo_cell(lat, lon)
+    cells = [_geo_cell_key(ci + di, cj + dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)]
+    try:
+        with get_db() as db:
+            rows = db.execute(f"""
+                SELECT lat, lon, min_lat, min_lon, max_lat, max_lon, address FROM geocode_cache
+                WHERE cell IN ({",".join("?" * len(cells))}) AND updated_at >= ?
+            """, cells + [int(time.time()) - GEOCODE_TTL_SEC]).fetchall()
+    except Exception as e:
+        print("⚠️ geocode store read error:", e)
+        return None
+
+    best_area = best_point = None
+    for r in rows:
+        if r["min_lat"] is not None and r["min_lat"] <= lat <= r["max_lat"] and r["min_lon"] <= lon <= r["max_lon"]:
+            area = (r["max_lat"] - r["min_lat"]) * (r["max_lon"] - r["min_lon"])
+            if best_area is None or area < best_area[0]:
+                best_area = (area, r["address"])
+            continue
+        d = haversine(lat, lon, r["lat"], r["lon"]) * 1000
+        if d <= GEOCODE_REUSE_M and (best_point is None or d < best_point[0]):
+            best_point = (d, r["address"])
+    if best_area:
+        return best_area[1]
+    return best_point[1] if best_point else None
+
+
+def remember_address(lat, lon, address, source, bounds=None):
+    address = _safe_str(address)
+    if not address:
+        return
+    lat, lon = float(lat), float(lon)
+    now = int(time.time())
+    cells = _bbox_cells(bounds) if bounds else None
+    if cells:
+        box = (float(bounds["minlat"]), float(bounds["minlon"]), float(bounds["maxlat"]), float(bounds["maxlon"]))
+    else:
+        cells, box = [_geo_cell_key(*_geo_cell(lat, lon))], (None, None, None, None)
+    try:
+        with get_db() as db:
+            db.executemany("""
+                INSERT OR REPLACE INTO geocode_cache(cell, lat, lon, min_lat, min_lon, max_lat, max_lon,
+                                                     address, source, updated_at)
+                VALUES(?,?,?,?,?,?,?,?,?,?)
+            """, [(cell, lat, lon) + box + (address, source, now) for cell in cells])
+    except Exception as e:
+        print("⚠️ geocode store write error:", e)
+
+
+def _nominatim_slot():
+    """Claims the shared 1/sec Nominatim slot; waits up to NOMINATIM_MAX_WAIT_SEC."""
+    if NOMINATIM_MIN_INTERVAL_SEC <= 0:
+        return True
+    deadline = time.monotonic() + NOMINATIM_MAX_WAIT_SEC
+    while True:
+        now = time.time()
+        try:
+            with get_db() as db:
+                cur = db.execute("""
+                    UPDATE app_meta SET value=? WHERE key='nominatim_next_at' AND CAST(value AS REAL) <= ?
+                """, (str(now + NOMINATIM_MIN_INTERVAL_SEC), now))
+                if cur.rowcount == 0:
+                    cur = db.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES('nominatim_next_at', ?)",
+                                     (str(now + NOMINATIM_MIN_INTERVAL_SEC),))
+                if cur.rowcount == 1:
+                    return True
+        except Exception as e:
+            print("⚠️ nominatim slot error:", e)
+            return False
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+
+
+def _nominatim_bounds(rev):
+    # building-level matches only; a street's bbox says nothing about this point
+    try:
+        if int(rev.get("place_rank") or 0) < 28:
+            return None
+        s, n, w, e = (float(x) for x in rev.get("boundingbox") or ())
+        return {"minlat": s, "maxlat": n, "minlon": w, "maxlon": e}
+    except:
+        return None
+
+
+def address_for_point(lat, lon):
+    """Store first, Nominatim on a miss (result stored). None when neither knows it."""
+    address = geocode_lookup(lat, lon)
+    cache_hit("geocode", address is not None)
+    if address is not None:
+        metrics_inc("moodmaps_geocode_lookups_total", source="store")
+        return address
+
+    if not _nominatim_slot():
+        metrics_inc("moodmaps_geocode_lookups_total", source="throttled")
+        return None
+    rev = _reverse_geocode_nominatim(lat, lon)
+    address = _safe_str(rev.get("display_name")) if rev else ""
+    metrics_inc("moodmaps_geocode_lookups_total", source="nominatim" if address else "failed")
+    if not address:
+        return None
+    remember_address(lat, lon, address, "nominatim", _nominatim_bounds(rev))
+    return address
+
+
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="_fetch_overpass_element")
 def _fetch_overpass_element(osm_type: str, osm_id: int):
     """
-    Returns an element dict with tags + center/lat/lon.
+    Returns an element dict with tags + lat/lon (nodes) or bounds (ways/relations).
     """
     osm_type = (osm_type or "").strip().lower()
     if osm_type not in ["node", "way", "relation"]:
         return None
 
-    # for way/relation, ask for center
+    # for way/relation, ask for the bbox (its centre is what "out center" returns)
     query = f"""
     [out:json][timeout:25];
     (
       {osm_type}({int(osm_id)});
     );
-    out center tags;
+    out bb tags;
     """
 
     headers = {
-        "User-Agent": "MoodMap/1.0 (contact: moodmap)",
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
         "Cache-Control": "no-cache"
     }
 
     for url in OVERPASS_URLS:
         try:
-            res = requests.post(url, data=query, timeout=22, headers=headers)
-            txt = (res.text or "").strip()
+            res = http_session().post(url, data=query, timeout=http_timeout(22), headers=headers)
 
-            if not txt or "html" in txt.lower():
+            if not overpass_is_json(res):
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="html")
                 continue
 
-            data = res.json()
-            elements = data.get("elements", [])
+            elements, _ = parse_overpass(res.content)
             if not elements:
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="empty")
                 continue
 
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="ok")
             return elements[0]
         except Exception as e:
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="error")
             print("⚠️ Overpass element fail:", url, "->", e)
             continue
 
     return None
 
 
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="_fetch_overpass_elements")
+def _fetch_overpass_elements(refs):
+    """
+    Many (osm_type, osm_id) in one query -> {"type/id": element}.
+    Elements Overpass no longer knows are absent; None when every mirror failed.
+    """
+    stmts = "".join(f"{t}({int(i)});" for t, i in refs if t in ["node", "way", "relation"])
+    if not stmts:
+        return {}
+    query = f"[out:json][timeout:25];({stmts});out bb tags;"
+
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+        "Cache-Control": "no-cache"
+    }
+
+    for url in OVERPASS_URLS:
+        try:
+            res = http_session().post(url, data=query, timeout=http_timeout(22), headers=headers)
+
+            if not overpass_is_json(res):
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="html")
+                continue
+
+            elements, remark = parse_overpass(res.content)
+            if remark and not elements:
+                # runtime error / timeout reported inside a 200
+                metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="empty")
+                continue
+
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="ok")
+            return {f"{el.get('type')}/{el.get('id')}": el for el in elements}
+        except Exception as e:
+            metrics_inc("moodmaps_overpass_requests_total", mirror=url, result="error")
+            print("⚠️ Overpass elements fail:", url, "->", e)
+            continue
+
+    return None
+
+
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="_wiki_summary_from_title")
 def _wiki_summary_from_title(title: str):
     """
     Wikipedia REST API summary for image + short extract.
     Returns:
-      { ok, title, extract, thumbnail }
+      { ok, title, extract, thumbnail }   (ok False: no such page)
+      None on upstream errors
     """
     try:
         if not title:
@@ -1755,14 +4436,12 @@ def _wiki_summary_from_title(title: str):
 
         t = t.strip().replace(" ", "_")
 
-        url = f"https://{lang}.wikipedia.org/api/rest_v1/page/summary/{t}"
-        headers = {
-            "User-Agent": "MoodMap/1.0 (contact: moodmap)"
-        }
-        r = requests.get(url, headers=headers, timeout=10)
-        if r.status_code != 200:
+        url = WIKIPEDIA_URL.replace("{lang}", lang) + f"/api/rest_v1/page/summary/{t}"
+        status, data = http_get_json_cached(url, 10)
+        if status == 404:
+            return {"ok": False, "title": "", "extract": "", "thumbnail": ""}
+        if status != 200:
             return None
-        data = r.json()
         thumb = ""
         try:
             thumb = (data.get("thumbnail") or {}).get("source") or ""
@@ -1780,6 +4459,289 @@ def _wiki_summary_from_title(title: str):
         return None
 
 
+# =========================================================
+# ✅ WIKIPEDIA SUMMARY CACHE (long-lived, SQLite-backed)
+# =========================================================
+# Extracts and thumbnails change rarely, so summaries are kept per
+# (lang, title) in the wiki_summaries table (plus an in-process LRU)
+# instead of dying with the 10-minute place details entry. Past
+# WIKI_FRESH_SEC an entry is still served while a background thread
+# refreshes it; only entries older than WIKI_MAX_AGE_SEC (or unseen
+# ones) are fetched inline. Several titles resolve in one MediaWiki
+# query per WIKI_BULK_BATCH titles (wiki_summaries), which the details
+# endpoint and prefetch paths share.
+WIKI_LANGS = ("en", "hi", "mr")
+WIKI_FRESH_SEC = 7 * 24 * 3600
+WIKI_MAX_AGE_SEC = 90 * 24 * 3600
+WIKI_MISSING_SEC = 24 * 3600  # negative entries (page does not exist)
+WIKI_BULK_BATCH = 20  # MediaWiki returns at most 20 intro extracts per query
+WIKI_CACHE = OrderedDict()  # (lang, title) -> {"summary", "fetched_at"}
+WIKI_CACHE_MAX = 5000
+WIKI_REFRESH_INTERVAL_SEC = 5
+WIKI_REFRESH_QUEUE = set()
+WIKI_REFRESH_LOCK = threading.Lock()
+WIKI_REFRESH_WAKE = threading.Event()
+WIKI_REFRESHER = {"thread": None, "pid": None}
+
+
+def wiki_key(tag: str):
+    """`wikipedia=` tag value ("en:Some Page" / "Some Page") -> (lang, Title_with_underscores)"""
+    tag = (tag or "").strip()
+    if ":" in tag and tag.split(":", 1)[0] in WIKI_LANGS:
+        lang, t = tag.split(":", 1)
+    else:
+        lang, t = "en", tag
+    t = t.strip().replace(" ", "_")
+    if not t:
+        return None
+    # MediaWiki titles are case-insensitive in the first letter only
+    return lang, t[:1].upper() + t[1:]
+
+
+def _wiki_remember(key, item):
+    WIKI_CACHE[key] = item
+    WIKI_CACHE.move_to_end(key)
+    if len(WIKI_CACHE) > WIKI_CACHE_MAX:
+        WIKI_CACHE.popitem(last=False)
+
+
+def _wiki_cache_load(keys, memo=True):
+    out = {}
+    by_lang = {}
+    for key in keys:
+        item = WIKI_CACHE.get(key) if memo else None
+        if item is not None:
+            out[key] = item
+        else:
+            by_lang.setdefault(key[0], []).append(key[1])
+    if not by_lang:
+        return out
+
+    try:
+        with get_db() as db:
+            for lang, titles in by_lang.items():
+                for i in range(0, len(titles), 500):
+                    chunk = titles[i:i + 500]
+                    rows = db.execute(f"""
+                        SELECT title, ok, resolved_title, extract, thumbnail, fetched_at
+                        FROM wiki_summaries WHERE lang=? AND title IN ({",".join("?" * len(chunk))})
+                    """, [lang] + chunk).fetchall()
+                    for r in rows:
+                        summary = None
+                        if r["ok"]:
+                            summary = {
+                                "ok": True,
+                                "title": r["resolved_title"] or "",
+                                "extract": r["extract"] or "",
+                                "thumbnail": r["thumbnail"] or "",
+                            }
+                        item = {"summary": summary, "fetched_at": int(r["fetched_at"] or 0)}
+                        out[(lang, r["title"])] = item
+                        _wiki_remember((lang, r["title"]), item)
+    except Exception as e:
+        print("⚠️ wiki cache read error:", e)
+    return out
+
+
+def _wiki_cache_store(results):
+    """results: {(lang, title): summary or None (page missing)}"""
+    now = int(time.time())
+    rows = []
+    for (lang, title), s in results.items():
+        _wiki_remember((lang, title), {"summary": s, "fetched_at": now})
+        rows.append((lang, title, 1 if s else 0, (s or {}).get("title", ""),
+                     (s or {}).get("extract", ""), (s or {}).get("thumbnail", ""), now))
+    if not rows:
+        return
+    try:
+        with get_db() as db:
+            db.executemany("""
+                INSERT INTO wiki_summaries(lang, title, ok, resolved_title, extract, thumbnail, fetched_at)
+                VALUES(?,?,?,?,?,?,?)
+                ON CONFLICT(lang, title) DO UPDATE SET
+                    ok=excluded.ok, resolved_title=excluded.resolved_title, extract=excluded.extract,
+                    thumbnail=excluded.thumbnail, fetched_at=excluded.fetched_at
+            """, rows)
+    except Exception as e:
+        print("⚠️ wiki cache write error:", e)
+
+
+def _wiki_state(item, now):
+    if item is None:
+        return "miss"
+    age = now - item["fetched_at"]
+    if item["summary"] is None:
+        return "fresh" if age < WIKI_MISSING_SEC else "miss"
+    if age < WIKI_FRESH_SEC:
+        return "fresh"
+    return "stale" if age < WIKI_MAX_AGE_SEC else "miss"
+
+
+@timed("moodmaps_upstream_seconds", span_kind="upstream", helper="_wiki_query_bulk")
+def _wiki_query_bulk(lang, titles):
+    """
+    MediaWiki query API (extracts + pageimages), WIKI_BULK_BATCH titles
+    per request. Returns {title: summary or None (missing)}; titles of a
+    failed batch are left out.
+    """
+    out = {}
+    url = WIKIPEDIA_URL.replace("{lang}", lang) + "/w/api.php"
+    for i in range(0, len(titles), WIKI_BULK_BATCH):
+        batch = titles[i:i + WIKI_BULK_BATCH]
+        try:
+            r = http_session().get(url, params={
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "prop": "extracts|pageimages",
+                "exintro": "1",
+                "explaintext": "1",
+                "exsentences": "4",
+                "exlimit": "max",
+                "piprop": "thumbnail",
+                "pithumbsize": "320",
+                "pilimit": "max",
+                "redirects": "1",
+                "titles": "|".join(batch),
+            }, timeout=http_timeout(15))
+            if r.status_code != 200:
+                continue
+            q = r.json().get("query") or {}
+        except Exception as e:
+            print("⚠️ wiki bulk error:", e)
+            continue
+
+        # requested title -> page title, through normalisation and redirects
+        alias = {a.get("from"): a.get("to") for a in (q.get("normalized") or []) + (q.get("redirects") or [])}
+        pages = {p.get("title"): p for p in q.get("pages") or []}
+        for t in batch:
+            name, hops = t, 0
+            while name in alias and hops < 5:
+                name, hops = alias[name], hops + 1
+            p = pages.get(name) or pages.get(name.replace("_", " "))
+            if p is None:
+                continue
+            if p.get("missing") or p.get("invalid"):
+                out[t] = None
+                continue
+            out[t] = {
+                "ok": True,
+                "title": p.get("title") or "",
+                "extract": p.get("extract") or "",
+                "thumbnail": (p.get("thumbnail") or {}).get("source") or "",
+            }
+        metrics_inc("moodmaps_wiki_titles_fetched_total", len(batch), mode="bulk")
+    return out
+
+
+def _wiki_fetch(keys):
+    """Fetches and stores keys -> {key: summary or None}; failed keys are absent."""
+    results = {}
+    if len(keys) == 1:
+        lang, title = keys[0]
+        s = _wiki_summary_from_title(f"{lang}:{title}")
+        metrics_inc("moodmaps_wiki_titles_fetched_total", mode="single")
+        if s is not None:
+            results[keys[0]] = s if s.get("ok") else None
+    else:
+        by_lang = {}
+        for lang, title in keys:
+            by_lang.setdefault(lang, []).append(title)
+        for lang, titles in by_lang.items():
+            for title, s in _wiki_query_bulk(lang, titles).items():
+                results[(lang, title)] = s
+    _wiki_cache_store(results)
+    return results
+
+
+def wiki_summaries(tags):
+    """
+    Many `wikipedia=` tag values -> {tag: summary or None}.
+    summary: { ok, title, extract, thumbnail }
+    """
+    keys = {}
+    for tag in tags:
+        key = wiki_key(tag)
+        if key:
+            keys[tag] = key
+    items = _wiki_cache_load(set(keys.values()))
+    now = time.time()
+
+    out, missing, stale = {}, [], []
+    for tag, key in keys.items():
+        state = _wiki_state(items.get(key), now)
+        cache_hit("wiki", state != "miss")
+        if state == "miss":
+            missing.append(key)
+            continue
+        out[tag] = items[key]["summary"]
+        if state == "stale":
+            stale.append(key)
+
+    if stale:
+        queue_wiki_refresh(stale)
+    if missing:
+        fetched = _wiki_fetch(list(dict.fromkeys(missing)))
+        for tag, key in keys.items():
+            if tag in out:
+                continue
+            if key in fetched:
+                out[tag] = fetched[key]
+            else:
+                # upstream failed: an expired copy beats nothing
+                out[tag] = (items.get(key) or {}).get("summary")
+    return out
+
+
+def wiki_summary(tag: str):
+    return wiki_summaries([tag]).get(tag)
+
+
+def wiki_refresh(keys):
+    """Re-fetches keys that are still stale in the DB (another worker may have refreshed them)."""
+    now = time.time()
+    current = _wiki_cache_load(keys, memo=False)
+    due = [k for k in keys if _wiki_state(current.get(k), now) != "fresh"]
+    if not due:
+        return 0
+    metrics_inc("moodmaps_wiki_refresh_total", len(due))
+    return len(_wiki_fetch(due))
+
+
+def _wiki_refresh_loop():
+    while True:
+        WIKI_REFRESH_WAKE.wait(WIKI_REFRESH_INTERVAL_SEC)
+        WIKI_REFRESH_WAKE.clear()
+        with WIKI_REFRESH_LOCK:
+            batch = list(WIKI_REFRESH_QUEUE)
+            WIKI_REFRESH_QUEUE.clear()
+        if not batch:
+            continue
+        try:
+            wiki_refresh(batch)
+        except Exception as e:
+            print("⚠️ wiki refresher error:", e)
+
+
+def _ensure_wiki_refresher():
+    # started lazily so each forked worker gets its own thread
+    if WIKI_REFRESHER["thread"] and WIKI_REFRESHER["pid"] == os.getpid():
+        return
+    t = threading.Thread(target=_wiki_refresh_loop, name="wiki-refresher", daemon=True)
+    t.start()
+    WIKI_REFRESHER["thread"] = t
+    WIKI_REFRESHER["pid"] = os.getpid()
+
+
+def queue_wiki_refresh(keys):
+    with WIKI_REFRESH_LOCK:
+        WIKI_REFRESH_QUEUE.update(keys)
+        full = len(WIKI_REFRESH_QUEUE) >= WIKI_BULK_BATCH
+    _ensure_wiki_refresher()
+    if full:
+        WIKI_REFRESH_WAKE.set()
+
+
 def _place_image_fallback(category: str):
     """
     Professional fallback images (free, stable).
@@ -1841,7 +4803,7 @@ def _resolve_place_image(tags: dict, category: str):
         # 2) wikipedia tag
         wiki = (tags.get("wikipedia") or "").strip()
         if wiki:
-            ws = _wiki_summary_from_title(wiki)
+            ws = wiki_summary(wiki)
             if ws and ws.get("thumbnail"):
                 wiki_extract = ws.get("extract") or ""
                 return ws.get("thumbnail"), gallery, wiki_extract
@@ -1855,55 +4817,37 @@ def _resolve_place_image(tags: dict, category: str):
     return _place_image_fallback(category), gallery, wiki_extract
 
 
-@app.route("/api/place_details", methods=["GET"])
-def api_place_details():
-    uid = current_user()
-    if not uid:
-        return jsonify({"ok": False, "message": "Login required"}), 403
-
-    osm_type = (request.args.get("type") or "").strip().lower()
-    osm_id = request.args.get("id")
-
-    lat = request.args.get("lat")
-    lon = request.args.get("lon")
-
-    # optional: name/category as fallback
-    fallback_name = (request.args.get("name") or "").strip()
-    fallback_category = (request.args.get("category") or "").strip()
-
-    # ================= cache =================
-    cache_key = ""
-    if osm_type and osm_id:
-        cache_key = f"{osm_type}/{osm_id}"
-        cached = _cache_get(cache_key)
-        if cached:
-            return jsonify({"success": True, "place": cached})
-
-
-    element = None
+def build_place_details(osm_type, osm_id, lat=None, lon=None, fallback_name="", fallback_category="", element=None):
+    """
+    The place_details payload for one place. A given `element` skips the
+    Overpass fetch (the favorites warmer prefetches a batch in one query).
+    Returns: (place, cacheable); place is None without coordinates.
+    """
+    cacheable = True
     tags = {}
     pl_lat = None
     pl_lon = None
 
     # ================= Overpass element =================
-    if osm_type in ["node", "way", "relation"] and osm_id:
+    if element is None and osm_type in ["node", "way", "relation"] and osm_id:
         try:
             element = _fetch_overpass_element(osm_type, int(osm_id))
         except:
             element = None
 
-        if element:
-            tags = element.get("tags", {}) or {}
+    if element:
+        tags = element.get("tags", {}) or {}
 
-            # node has lat/lon
-            if element.get("lat") and element.get("lon"):
-                pl_lat = element.get("lat")
-                pl_lon = element.get("lon")
-            else:
-                # way/relation center
-                c = element.get("center") or {}
-                pl_lat = c.get("lat")
-                pl_lon = c.get("lon")
+        # node has lat/lon
+        if element.get("lat") and element.get("lon"):
+            pl_lat = element.get("lat")
+            pl_lon = element.get("lon")
+        else:
+            # way/relation: centre of the bbox
+            b = element.get("bounds") or {}
+            if b:
+                pl_lat = round((b["minlat"] + b["maxlat"]) / 2, 7)
+                pl_lon = round((b["minlon"] + b["maxlon"]) / 2, 7)
 
                 
 
@@ -1914,17 +4858,21 @@ def api_place_details():
         pl_lon = _safe_float(lon)
 
     if pl_lat is None or pl_lon is None:
-        return jsonify({"ok": False, "message": "Missing coordinates"}), 400
-
-# ================= reverse geocode (cached) =================
-    addr_cache_key = f"addr:{round(pl_lat,5)},{round(pl_lon,5)}"
-    cached_addr = _cache_get(addr_cache_key)
-    if cached_addr:
-        address = cached_addr
+        return None, False
+
+# ================= address (addr:* tags, else geocode store) =================
+    address = format_address(tags) if tags.get("addr:street") else ""
+    if address:
+        # teach the store, so untagged neighbours in the same building reuse it
+        bounds = (element or {}).get("bounds")
+        if geocode_lookup(pl_lat, pl_lon) != address:
+            remember_address(pl_lat, pl_lon, address, "osm", bounds)
     else:
-        rev = _reverse_geocode_nominatim(pl_lat, pl_lon)
-        address = rev.get("display_name", "") if rev else ""
-        _cache_set(addr_cache_key, address)
+        address = address_for_point(pl_lat, pl_lon)
+        if address is None:
+            # Nominatim busy/down: answer without it, but don't pin the gap in the cache
+            address = ""
+            cacheable = False
 
 # ================= category & name (ALWAYS RUN) =================
     category = _pick_category_from_tags(tags)
@@ -1998,111 +4946,317 @@ def api_place_details():
 
 
 
-    if cache_key:
+    return place_out, cacheable
+
+
+@app.route("/api/place_details", methods=["GET"])
+def api_place_details():
+    uid = current_user()
+    if not uid:
+        return jsonify({"ok": False, "message": "Login required"}), 403
+
+    osm_type = (request.args.get("type") or "").strip().lower()
+    osm_id = request.args.get("id")
+
+    lat = request.args.get("lat")
+    lon = request.args.get("lon")
+
+    # optional: name/category as fallback
+    fallback_name = (request.args.get("name") or "").strip()
+    fallback_category = (request.args.get("category") or "").strip()
+
+    # ================= cache =================
+    cache_key = ""
+    if osm_type and osm_id:
+        cache_key = f"{osm_type}/{osm_id}"
+        cached = _cache_get(cache_key)
+        if not cached:
+            cached = place_store_load(cache_key)
+            if cached:
+                _cache_set(cache_key, cached)
+        if cached:
+            # time-of-day estimate, not part of what is cached
+            cached["crowd_level"] = estimate_crowd_osm(cached.get("category"))
+            return jsonify({"success": True, "place": cached})
+
+    place_out, cacheable = build_place_details(osm_type, osm_id, lat, lon, fallback_name, fallback_category)
+    if place_out is None:
+        return jsonify({"ok": False, "message": "Missing coordinates"}), 400
+
+    if cache_key and cacheable:
         _cache_set(cache_key, place_out)
+        place_store_save(cache_key, place_out)
 
     return jsonify({"success": True, "place": place_out})
 
 
+# =========================================================
+# ✅ FAVORITES WARMER (saved places' details built ahead of time)
+# =========================================================
+# Saved places are the ones people open again, often from someone
+# else's list. One worker at a time (lease in app_meta) walks the saved
+# OSM places whose place_details row is missing or older than
+# PLACE_WARM_REFRESH_SEC, most saved / most recently saved first, and
+# rebuilds them: one Overpass query and one bulk wiki lookup per
+# PLACE_WARM_BATCH places, then at most PLACE_WARM_RATE_PER_SEC places
+# per second (Nominatim keeps its own 1/sec slot). The pass position
+# lives in app_meta, so a restarted or replaced worker resumes it.
+PLACE_WARM_RATE_PER_SEC = float(os.environ.get("PLACE_WARM_RATE_PER_SEC", "0.5"))  # 0 = off
+PLACE_WARM_BATCH = 20
+PLACE_WARM_REFRESH_SEC = 24 * 3600  # well inside PLACE_STORE_SEC
+PLACE_WARM_PASS_GAP_SEC = 15 * 60
+PLACE_WARM_POLL_SEC = 30
+PLACE_WARMER = {"thread": None, "pid": None}
+OSM_PLACE_ID_RE = re.compile(r"^(node|way|relation)/(\d+)$")
+
+
+def _place_warm_lease_sec():
+    # a batch must finish inside the lease
+    return int(60 + 2 * PLACE_WARM_BATCH / max(PLACE_WARM_RATE_PER_SEC, 0.01))
+
+
+def _place_warm_claim():
+    """Takes or renews the cross-worker lease ("<until>:<pid>")."""
+    now = int(time.time())
+    owner = str(os.getpid())
+    with get_db() as db:
+        cur = db.execute("""
+            UPDATE app_meta SET value=?
+            WHERE key='place_warm_lease' AND (CAST(value AS INTEGER) < ? OR value LIKE ?)
+        """, (f"{now + _place_warm_lease_sec()}:{owner}", now, f"%:{owner}"))
+    return cur.rowcount == 1
+
+
+def place_warm_cursor():
+    try:
+        with get_db() as db:
+            row = db.execute("SELECT value FROM app_meta WHERE key='place_warm_cursor'").fetchone()
+        return json.loads(row["value"]) if row else {}
+    except:
+        return {}
+
+
+def _save_place_warm_cursor(cursor):
+    with get_db() as db:
+        db.execute("INSERT OR REPLACE INTO app_meta(key, value) VALUES(?,?)", ("place_warm_cursor", json.dumps(cursor)))
+
+
+def _place_warm_candidates(cursor, limit):
+    """
+    Saved OSM places still due, ranked by saves / (1 + days since last
+    save) as of the pass start, after the cursor's (rank, place_id).
+    """
+    rank = cursor.get("rank")
+    with get_db() as db:
+        rows = db.execute("""
+            SELECT f.place_id, MAX(f.name) AS name, MAX(f.category) AS category,
+                   MAX(f.lat) AS lat, MAX(f.lon) AS lon,
+                   COUNT(*) / (1.0 + (? - COALESCE(MAX(f.created_at), 0)) / 86400.0) AS warm_rank
+            FROM favorites f
+            LEFT JOIN place_details d ON d.place_id = f.place_id
+            WHERE (f.place_id LIKE 'node/%' OR f.place_id LIKE 'way/%' OR f.place_id LIKE 'relation/%')
+              AND (d.fetched_at IS NULL OR d.fetched_at < ?)
+            GROUP BY f.place_id
+            HAVING ? IS NULL OR warm_rank < ? OR (warm_rank = ? AND f.place_id > ?)
+            ORDER BY warm_rank DESC, f.place_id
+            LIMIT ?
+        """, (cursor["pass_at"], cursor["pass_at"] - PLACE_WARM_REFRESH_SEC,
+              rank, rank, rank, cursor.get("place_id") or "", limit)).fetchall()
+    return [dict(r) for r in rows if OSM_PLACE_ID_RE.match(r["place_id"])]
+
+
+def warm_favorites_batch():
+    """
+    Warms the next batch of the current pass (starting one when the gap
+    since the last pass is over). Returns places attempted; 0 when there
+    is nothing to do right now.
+    """
+    cursor = place_warm_cursor()
+    now = int(time.time())
+    if not cursor.get("pass_at"):
+        if now - int(cursor.get("finished_at") or 0) < PLACE_WARM_PASS_GAP_SEC:
+            return 0
+        cursor = {"pass_at": now, "rank": None, "place_id": "", "warmed": 0, "missing": 0, "deferred": 0}
+
+    rows = _place_warm_candidates(cursor, PLACE_WARM_BATCH)
+    if not rows:
+        cursor.update(pass_at=0, finished_at=now)
+        _save_place_warm_cursor(cursor)
+        metrics_inc("moodmaps_place_warm_passes_total")
+        return 0
+
+    refs = [OSM_PLACE_ID_RE.match(r["place_id"]).groups() for r in rows]
+    elements = _fetch_overpass_elements(refs)
+    if elements is None:
+        # Overpass down: keep the position, retry on the next poll
+        return 0
+    # one bulk lookup, so building each place below hits the wiki cache
+    wiki_summaries([el.get("tags", {}).get("wikipedia") for el in elements.values()
+                    if (el.get("tags") or {}).get("wikipedia")])
+
+    gap = 1.0 / PLACE_WARM_RATE_PER_SEC
+    for row, (osm_type, osm_id) in zip(rows, refs):
+        t0 = time.monotonic()
+        element = elements.get(row["place_id"])
+        result = "missing"
+        if element is not None:
+            place, cacheable = build_place_details(osm_type, osm_id, row["lat"], row["lon"], row["name"] or "",
+                                                   row["category"] or "", element=element)
+            result = "warmed" if place and cacheable else "deferred"
+            if result == "warmed":
+                place_store_save(row["place_id"], place)
+        cursor[result] = cursor.get(result, 0) + 1
+        metrics_inc("moodmaps_place_warm_total", result=result)
+        time.sleep(max(0.0, gap - (time.monotonic() - t0)))
+
+    cursor.update(rank=rows[-1]["warm_rank"], place_id=rows[-1]["place_id"])
+    _save_place_warm_cursor(cursor)
+    return len(rows)
+
+
+def _place_warm_loop():
+    while True:
+        time.sleep(PLACE_WARM_POLL_SEC)
+        try:
+            while _place_warm_claim() and warm_favorites_batch():
+                pass
+        except Exception as e:
+            print("⚠️ place warmer error:", e)
+
+
+def _ensure_place_warmer():
+    # started lazily (by the favorites endpoints) so each forked worker gets its own thread
+    if PLACE_WARM_RATE_PER_SEC <= 0:
+        return
+    if PLACE_WARMER["thread"] and PLACE_WARMER["pid"] == os.getpid():
+        return
+    t = threading.Thread(target=_place_warm_loop, name="place-warmer", daemon=True)
+    t.start()
+    PLACE_WARMER["thread"] = t
+    PLACE_WARMER["pid"] = os.getpid()
+
+
+@app.route("/api/admin/place_warmer", methods=["GET"])
+def api_admin_place_warmer():
+    uid = current_user()
+    if not uid or not is_admin(uid):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+
+    with get_db() as db:
+        stored = db.execute("SELECT COUNT(*) FROM place_details WHERE fetched_at>=?",
+                            (int(time.time()) - PLACE_WARM_REFRESH_SEC,)).fetchone()[0]
+        saved = db.execute("SELECT COUNT(DISTINCT place_id) FROM favorites").fetchone()[0]
+    return jsonify({
+        "success": True,
+        "enabled": PLACE_WARM_RATE_PER_SEC > 0,
+        "rate_per_sec": PLACE_WARM_RATE_PER_SEC,
+        "saved_places": saved,
+        "fresh_details": stored,
+        "cursor": place_warm_cursor(),
+    })
+
 
 @app.route("/api/recommend", methods=["POST"])
 def recommend():
-    if not current_user():
+    uid = current_user()
+    if not uid:
         return jsonify([])
 
     data = request.json
     mood = (data.get("mood") or "").strip()
     user_lat = data.get("latitude")
     user_lon = data.get("longitude")
+    tz_offset = data.get("tz_offset")
+    try:
+        tz_offset = None if tz_offset is None else max(-900, min(900, int(tz_offset)))
+    except:
+        tz_offset = None
 
-    ALLOWED_MOODS = [
-    "work",
-    "date",
-    "quick_bites",
-    "pocket_friendly",
-    "calm",
-    "high_adrenaline",
-    "exploring",
-    "late_night"
-    ]
-    if mood not in ALLOWED_MOODS:
+    rules = COMPILED_MOODS.get(mood)
+    if not rules:
         return jsonify([])
 
 
     if not user_lat or not user_lon:
         return jsonify([])
 
-    radius = 5000
-    if mood == "work":
-        radius = 6000
-    elif mood == "quick_bites":
-        radius = 4000
-    elif mood == "pocket_friendly":
-        radius = 7000
-    elif mood == "calm":
-        radius = 6000
-    elif mood == "high_adrenaline":
-        radius = 7000
-    elif mood == "exploring":
-        radius = 9000
-    elif mood == "late_night":
-        radius = 5000
-
-    raw = fetch_places_for_mood(mood, user_lat, user_lon, radius)
-
-    if not raw:
-        time.sleep(0.7)
-        raw = fetch_places_for_mood(mood, user_lat, user_lon, radius)
+    raw, radius = fetch_places_adaptive(mood, rules, user_lat, user_lon)
 
-    places = []
-    seen = set()
-
-    for i, p in enumerate(raw):
-        t = p.get("tags", {})
-        lat = p.get("lat")
-        lon = p.get("lon")
-        if not lat or not lon:
-            continue
-
-        # ✅ CRITICAL FIX: strict mood filter
-        if not _hard_filter_place(mood, t):
-            continue
-
-        osm_id = p.get("id", i)
-        pid = f"{p.get('type','node')}/{osm_id}"
+    if raw is None:
+        # upstream unreachable: answer empty rather than sweep the mirrors again
+        raw = []
 
-        if pid in seen:
-            continue
-        seen.add(pid)
+    with profile_span("scoring"):
+        places = []
+        seen = set()
+        hours = open_states([p.tags.get("opening_hours") for p in raw], now=local_now(tz_offset))
 
-        distance = round(haversine(user_lat, user_lon, lat, lon), 2)
-        category = t.get("amenity") or t.get("leisure") or t.get("office") or "place"
-        name = t.get("name", (category or "place").replace("_", " ").title())
+        filtered = 0
+        for p in raw:
+            t = p.tags
+            lat, lon = p.lat, p.lon
 
-        if not name or name.strip().lower() in ["cafe", "restaurant", "fast food", "place"]:
-            if distance > 1.2:
+            # ✅ CRITICAL FIX: strict mood filter
+            if not rules["match"](t):
+                filtered += 1
                 continue
 
-        score = _score_place(mood, t, float(distance))
-
-        places.append({
-            "place_id": pid,
-            "name": name,
-            "category": category,
-            "distance": distance,
-            "lat": lat,
-            "lon": lon,
-            "opening_hours": t.get("opening_hours", None),
-            "phone": t.get("phone", t.get("contact:phone", None)),
-            "website": t.get("website", t.get("contact:website", None)),
-            "_score": score,
-
-            # ✅ NEW: needed for place details system
-            "osm_type": p.get("type", "node"),
-            "osm_id": osm_id
-        })
+            osm_id = p.id
+            pid = f"{p.type}/{osm_id}"
 
-    places.sort(key=lambda x: (-x["_score"], x["distance"]))
+            if pid in seen:
+                continue
+            seen.add(pid)
+
+            distance = round(haversine(user_lat, user_lon, lat, lon), 2)
+            category = t.get("amenity") or t.get("leisure") or t.get("office") or "place"
+            name = t.get("name", (category or "place").replace("_", " ").title())
+
+            if not name or name.strip().lower() in UNNAMED_GENERIC:
+                if distance > UNNAMED_MAX_KM:
+                    filtered += 1
+                    continue
+
+            state = hours.get(t.get("opening_hours"))
+            score = rules["score"](t, float(distance), state)
+
+            places.append({
+                "place_id": pid,
+                "name": name,
+                "category": category,
+                "distance": distance,
+                "lat": lat,
+                "lon": lon,
+                "opening_hours": t.get("opening_hours", None),
+                "open_now": state["open_now"] if state else None,
+                "closing_soon": state["closing_soon"] if state else None,
+                "next_change_at": state["next_change_at"] if state else None,
+                "phone": t.get("phone", t.get("contact:phone", None)),
+                "website": t.get("website", t.get("contact:website", None)),
+                "_score": score,
+
+                # ✅ NEW: needed for place details system
+                "osm_type": p.type,
+                "osm_id": osm_id
+            })
+
+        # how often (and how lately) people saved each candidate: one lookup for all
+        popularity = place_popularity([p["place_id"] for p in places])
+        for p in places:
+            if p["place_id"] in popularity:
+                p["_score"] += popularity_points(popularity[p["place_id"]])
+
+        # saves by people this user follows, one range read over the search area
+        friends = friend_saves_near(uid, user_lat, user_lon, radius or rules["radius"], [p["place_id"] for p in places])
+        for p in places:
+            p["friend_saves"] = friends.get(p["place_id"], 0)
+            if p["friend_saves"]:
+                p["_score"] += min(FRIEND_MAX_POINTS, FRIEND_POINTS * p["friend_saves"])
+
+        places.sort(key=lambda x: (-x["_score"], x["distance"]))
+
+    metrics_inc("moodmaps_recommend_candidates_total", len(places), mood=mood, result="kept")
+    metrics_inc("moodmaps_recommend_candidates_total", filtered, mood=mood, result="filtered")
 
     for p in places:
         p.pop("_score", None)
@@ -2118,7 +5272,7 @@ def generate_place_description(name, category, tags):
     if tags.get("outdoor_seating") == "yes":
         parts.append("offers outdoor seating")
 
-    if tags.get("internet_access") in ["yes", "wifi", "wlan"]:
+    if tags.get("internet_access") in WIFI_VALUES:
         parts.append("has Wi-Fi available")
 
     if tags.get("wheelchair") == "yes":
@@ -2158,7 +5312,7 @@ def compute_osm_rating(tags):
         score += 0.2
     if tags.get("opening_hours"):
         score += 0.3
-    if tags.get("internet_access") in ["yes", "wifi", "wlan"]:
+    if tags.get("internet_access") in WIFI_VALUES:
         score += 0.4
     if tags.get("outdoor_seating") == "yes":
         score += 0.3
@@ -2190,10 +5344,61 @@ def build_menu_from_cuisine(cuisine):
     return menu
 
 
+# =========================================================
+# ✅ PRELOAD / FORK (gunicorn.conf.py preloads app in the master)
+# =========================================================
+def prefork_warmup():
+    """
+    Runs once in the master before workers fork: builds what each worker
+    would otherwise build for itself so the pages stay shared (copy-on-write).
+    """
+    static_manifest()
+    for name in app.jinja_env.list_templates():
+        if not name.endswith(".html"):
+            continue
+        try:
+            app.jinja_env.get_template(name)
+        except Exception as e:
+            print("⚠️ template warmup error:", name, e)
+
+
+def _reinit_after_fork():
+    # a parent thread may have held these at fork time
+    global METRICS_LOCK, MOOD_WRITE_LOCK, OUTBOX_WAKE, HTTP_SESSION_LOCK, WIKI_REFRESH_LOCK, WIKI_REFRESH_WAKE
+    METRICS_LOCK = threading.Lock()
+    MOOD_WRITE_LOCK = threading.Lock()
+    HTTP_SESSION_LOCK = threading.Lock()
+    WIKI_REFRESH_LOCK = threading.Lock()
+    OUTBOX_WAKE = threading.Event()
+    WIKI_REFRESH_WAKE = threading.Event()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def start_worker_threads():
+    """
+    Background threads every serving process needs whether or not a
+    request has started them yet (gunicorn post_worker_init, `python app.py`):
+    the outbox sender picks up rows left behind by recycled or crashed workers.
+    """
+    _ensure_outbox_sender()
+
+
+ensure_schema()
+
+
 # =========================================================
 # ✅ DEPLOY RUN (Render/Cloud compatible)
 # =========================================================
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        migrate()
+        print("✅ schema version", SCHEMA_VERSION, "->", DB_PATH)
+        sys.exit(0)
+
     port = int(os.environ.get("PORT", 5000))
+    start_worker_threads()
     app.run(host="0.0.0.0", port=port, debug=True)
     
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""
+Benchmarks for MoodMaps (local upstream stub + scenario runner).
+
+    python -m bench.run --help
+"""
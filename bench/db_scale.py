@@ -0,0 +1,158 @@
+"""
+DB-scale benchmark for the social endpoints.
+
+Runs search, follow stats, follower/following lists and the public
+profile page in-process (Flask test client, no upstream calls) against
+a DB produced by bench/seed.py, and prints the SQLite query plan for
+each hot query so index changes can be judged on realistic sizes.
+
+    python -m bench.seed --db /tmp/mm-big.db --users 1000000
+    python -m bench.db_scale --db /tmp/mm-big.db --iterations 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from bench.run import percentile, git_sha, RESULTS_DIR
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the statements behind the benchmarked endpoints (see app.py)
+HOT_QUERIES = {
+    "search": ("""
+        SELECT id, username, name, is_private, profile_pic FROM users
+        WHERE lower(username) LIKE ? OR lower(name) LIKE ?
+        ORDER BY CASE WHEN lower(username)=? THEN 0 ELSE 1 END,
+                 CASE WHEN lower(username) LIKE ? THEN 0 ELSE 1 END, name ASC
+        LIMIT 10
+    """, ("%u12%", "%u12%", "u12", "u12%")),
+    "follow_stats:followers": ("SELECT COUNT(*) FROM follows WHERE following_id=? AND status='accepted'", (1,)),
+    "follow_stats:following": ("SELECT COUNT(*) FROM follows WHERE follower_id=? AND status='accepted'", (1,)),
+    "followers_list": ("""
+        SELECT u.id, u.username, u.name, u.profile_pic, f.created_at
+        FROM follows f JOIN users u ON u.id = f.follower_id
+        WHERE f.following_id=? AND f.status='accepted' ORDER BY f.created_at DESC
+    """, (1,)),
+    "following_list": ("""
+        SELECT u.id, u.username, u.name, u.profile_pic, f.created_at
+        FROM follows f JOIN users u ON u.id = f.following_id
+        WHERE f.follower_id=? AND f.status='accepted' ORDER BY f.created_at DESC
+    """, (1,)),
+    "relationships": ("""
+        SELECT follower_id, following_id, status FROM follows
+        WHERE (follower_id=? AND following_id IN (?,?,?)) OR (following_id=? AND follower_id IN (?,?,?))
+    """, (1, 2, 3, 4, 1, 2, 3, 4)),
+    "profile_favorites": ("""
+        SELECT place_id, name, category, lat, lon, created_at FROM favorites
+        WHERE user_id=? ORDER BY created_at DESC
+    """, (1,)),
+}
+
+
+def pick_subjects(db):
+    celeb = db.execute("""
+        SELECT following_id, COUNT(*) c FROM follows WHERE status='accepted'
+        GROUP BY following_id ORDER BY c DESC LIMIT 1
+    """).fetchone()
+    top_follower = db.execute("""
+        SELECT follower_id, COUNT(*) c FROM follows WHERE status='accepted'
+        GROUP BY follower_id ORDER BY c DESC LIMIT 1
+    """).fetchone()
+    n = db.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    median = db.execute("SELECT id FROM users WHERE id>=? ORDER BY id LIMIT 1", (n // 2,)).fetchone()[0]
+    name = lambda uid: db.execute("SELECT username FROM users WHERE id=?", (uid,)).fetchone()[0]
+    return {
+        "celebrity": (celeb[0], name(celeb[0]), celeb[1]),
+        "heavy_follower": (top_follower[0], name(top_follower[0]), top_follower[1]),
+        "median": (median, name(median), None),
+    }
+
+
+def explain(db):
+    plans = {}
+    for key, (sql, params) in HOT_QUERIES.items():
+        rows = db.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        plans[key] = [r[-1] for r in rows]
+    return plans
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--iterations", type=int, default=30)
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    os.environ["DB_PATH"] = os.path.abspath(args.db)
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+
+    db = app_module.get_db()
+    subjects = pick_subjects(db)
+    plans = explain(db)
+
+    print("query plans:")
+    for key, lines in plans.items():
+        print(f"  {key}:")
+        for ln in lines:
+            print(f"    {ln}")
+
+    viewer_id = subjects["median"][0]
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = viewer_id
+
+    cases = {}
+    for who in ("celebrity", "heavy_follower", "median"):
+        uname = subjects[who][1]
+        cases[f"follow_stats:{who}"] = f"/api/follow/stats?username={uname}"
+        cases[f"followers:{who}"] = f"/api/follow/followers?username={uname}"
+        cases[f"following:{who}"] = f"/api/follow/following?username={uname}"
+        cases[f"profile:{who}"] = f"/u/{uname}"
+    cases["search:prefix"] = "/api/users/search?q=u12"
+    cases["search:name"] = "/api/users/search?q=meera"
+
+    results = {}
+    for name, path in cases.items():
+        client.get(path)  # warm the page cache once
+        lat = []
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            r = client.get(path)
+            lat.append((time.perf_counter() - t0) * 1000)
+            if r.status_code != 200:
+                raise SystemExit(f"{path} -> {r.status_code}")
+        lat.sort()
+        results[name] = {
+            "p50_ms": round(percentile(lat, 50), 2),
+            "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2),
+            "bytes": len(r.data),
+        }
+        print(f"{name:<28}{results[name]['p50_ms']:>10}{results[name]['p95_ms']:>10}{results[name]['p99_ms']:>10}")
+
+    counts = {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("users", "follows", "favorites")}
+    report = {
+        "meta": {
+            "git": git_sha(),
+            "timestamp": int(time.time()),
+            "counts": counts,
+            "subjects": {k: {"id": v[0], "username": v[1], "degree": v[2]} for k, v in subjects.items()},
+        },
+        "plans": plans,
+        "results": results,
+    }
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"dbscale-{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['git']}.json")
+    with open(out, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nsaved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Upstream call latency: fresh connection per call vs the pooled session.
+
+Serves the stub over TLS (self-signed cert from the openssl CLI, so the
+handshake is part of the number) or plain HTTP, then times wiki summary
+and Overpass calls made the old way (requests.get/post, new TCP + TLS
+every call) and through app.http_session() (kept-alive connections).
+--url points both at a real upstream instead.
+
+    python -m bench.http_pool
+    python -m bench.http_pool --calls 300 --threads 4 --plain
+    python -m bench.http_pool --url https://en.wikipedia.org/api/rest_v1/page/summary/Pune
+"""
+import argparse
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.run import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_stub(tls, workdir):
+    from bench import stub_server
+
+    server, state, base = stub_server.start(pool_size=2000)
+    if not tls:
+        return base, None
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    # handshake per accepted connection, in the handler thread
+    server.socket = ctx.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    return base.replace("http://", "https://"), cert
+
+
+def run_calls(fn, calls, threads):
+    def one(i):
+        t0 = time.perf_counter()
+        r = fn(i)
+        if r.status_code != 200:
+            raise SystemExit(f"upstream answered {r.status_code}")
+        return (time.perf_counter() - t0) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        lat = sorted(ex.map(one, range(calls)))
+    return {"p50_ms": percentile(lat, 50), "p95_ms": percentile(lat, 95), "mean_ms": sum(lat) / len(lat)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=1)
+    ap.add_argument("--plain", action="store_true", help="stub over plain HTTP (no TLS handshake)")
+    ap.add_argument("--url", default="", help="GET this real URL instead of the stub")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="moodmaps-http-")
+    os.environ.setdefault("DB_PATH", os.path.join(work, "http.db"))
+    os.environ.setdefault("MOODMAPS_SKIP_MIGRATE", "1")
+    os.environ["HTTP_CACHE_MAX"] = "0"  # measure the transport, not the cache
+    sys.path.insert(0, REPO_ROOT)
+    import requests
+
+    if args.url:
+        base, verify = None, True
+    else:
+        base, cert = start_stub(not args.plain, work)
+        verify = cert or True
+
+    import app as app_module
+
+    session = app_module.http_session()
+    timeout = app_module.http_timeout(10)
+    query = app_module.COMPILED_MOODS["work"]["query"].format(radius=2000, unnamed=1200, lat=18.5204, lon=73.8567)
+
+    cases = {}
+    if args.url:
+        cases["get"] = (lambda i: requests.get(args.url, timeout=timeout, verify=verify),
+                        lambda i: session.get(args.url, timeout=timeout, verify=verify))
+    else:
+        wiki = base + "/api/rest_v1/page/summary/Place_{}"
+        interp = base + "/api/interpreter"
+        cases["wiki_summary"] = (lambda i: requests.get(wiki.format(i), timeout=timeout, verify=verify),
+                                 lambda i: session.get(wiki.format(i), timeout=timeout, verify=verify))
+        cases["overpass"] = (lambda i: requests.post(interp, data=query, timeout=timeout, verify=verify),
+                             lambda i: session.post(interp, data=query, timeout=timeout, verify=verify))
+
+    print(f"{'call':<14}{'client':<10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, (fresh, pooled) in cases.items():
+        for label, fn in (("fresh", fresh), ("pooled", pooled)):
+            fn(0)  # warm imports / first connection
+            r = run_calls(fn, args.calls, args.threads)
+            print(f"{name:<14}{label:<10}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['mean_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Worker cold-start budget for `import app`.
+
+Migrates a throwaway DB once, then measures `python -X importtime -c
+"import app"` (the worker boot path) several times and fails if the
+median cumulative import time exceeds the budget, or if any module
+that is meant to load lazily shows up at boot.
+
+    python -m bench.import_time
+    python -m bench.import_time --budget-ms 250 --runs 7
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# must not be imported by a booting worker (see "LAZY IMPORTS" in app.py)
+LAZY_MODULES = ("requests", "PIL", "multiprocessing", "cProfile", "pstats", "logging.handlers")
+
+LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(env):
+    """
+    Returns: (cumulative_us_for_app, {module: cumulative_us}, [top level modules])
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr[-2000:])
+    mods = {}
+    app_us = None
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if not m:
+            continue
+        cum, name = int(m.group(2)), m.group(4)
+        mods[name] = cum
+        if name == "app":
+            app_us = cum
+    return app_us, mods
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", "300")))
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="moodmaps-import-")
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": os.path.join(work, "boot.db"),
+        "JINJA_CACHE_DIR": os.path.join(work, "jinja"),
+        "METRICS_DIR": os.path.join(work, "metrics"),
+        "PROFILE_DIR": os.path.join(work, "profiles"),
+    })
+    subprocess.run([sys.executable, "app.py", "migrate"], cwd=REPO_ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    samples = []
+    mods = {}
+    for _ in range(args.runs):
+        app_us, mods = measure(env)
+        samples.append(app_us / 1000.0)
+
+    median = statistics.median(samples)
+    eager = sorted(m for m in mods if m.split(".")[0] in LAZY_MODULES or m in LAZY_MODULES)
+
+    print(f"import app: median {median:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    top = sorted(((v, k) for k, v in mods.items() if "." not in k and k != "app"), reverse=True)[:8]
+    for us, name in top:
+        print(f"  {name:<24}{us / 1000.0:>8.1f} ms")
+
+    failed = False
+    if eager:
+        print("FAIL: modules meant to load lazily were imported at boot: " + ", ".join(eager))
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
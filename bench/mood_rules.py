@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for the compiled mood rules (MOOD_SPECS -> COMPILED_MOODS).
+
+Times compile_mood() for every spec, then match + score over the stub
+POI pool per mood, without HTTP or Overpass in the way.
+
+    python -m bench.mood_rules
+    python -m bench.mood_rules --pool 50000 --repeat 5
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pool", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="moodmaps-rules-"), "rules.db"))
+    os.environ.setdefault("MOODMAPS_SKIP_MIGRATE", "1")
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    from bench.stub_server import build_pool
+
+    pool = [p["tags"] for p in build_pool(args.pool)]
+    rnd = random.Random(3)
+    dist = [rnd.uniform(0, 8) for _ in pool]
+    states = app_module.open_states([t.get("opening_hours") for t in pool], now=datetime.datetime.now())
+
+    t0 = time.perf_counter()
+    for spec in app_module.MOOD_SPECS.values():
+        app_module.compile_mood(spec)
+    print(f"compile all moods: {(time.perf_counter() - t0) * 1000:.2f} ms\n")
+
+    print(f"{'mood':<18}{'matched':>10}{'match µs/poi':>15}{'score µs/poi':>15}")
+    for mood, rules in app_module.COMPILED_MOODS.items():
+        match, score = rules["match"], rules["score"]
+        best_m = best_s = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            hits = [i for i, t in enumerate(pool) if match(t)]
+            best_m = min(best_m, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            for i in hits:
+                t = pool[i]
+                score(t, dist[i], states.get(t.get("opening_hours")))
+            best_s = min(best_s, time.perf_counter() - t0)
+        print(f"{mood:<18}{len(hits):>10}{best_m / len(pool) * 1e6:>15.2f}"
+              f"{(best_s / len(hits) * 1e6) if hits else 0:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
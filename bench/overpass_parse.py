@@ -0,0 +1,155 @@
+"""
+Overpass response parsing: CPU and peak memory on a large body.
+
+Builds a ~5 MB Overpass JSON fixture from the stub POI pool (padded with
+the kind of tags real OSM elements carry), then parses it the old way
+(res.text, lowercased HTML check, res.json() into one tree, then the
+per-element field reads recommend used to do) and the current way
+(overpass_is_json + parse_overpass -> Poi records). Peak is
+tracemalloc's, on top of the response body both paths share.
+
+    python -m bench.overpass_parse
+    python -m bench.overpass_parse --mb 20 --repeat 5
+    python -m bench.overpass_parse --fixture recorded.json    # a real response
+    python -m bench.overpass_parse --write-fixtures /tmp/fx   # for stub_server --fixtures
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# typical OSM noise around the tags the app reads
+EXTRA_TAGS = {
+    "source": "survey", "check_date": "2024-03-11", "addr:postcode": "411004", "addr:state": "Maharashtra",
+    "name:en": None, "name:mr": None, "cuisine": "indian;regional", "payment:cash": "yes", "payment:upi": "yes",
+    "diet:vegetarian": "yes", "wheelchair": "limited", "delivery": "yes", "takeaway": "yes", "level": "0",
+}
+
+
+def build_fixture(target_bytes, seed=11):
+    from bench.stub_server import build_pool, render
+
+    rnd = random.Random(seed)
+    elements, size = [], 64
+    pool = build_pool(5000)
+    i = 0
+    while size < target_bytes:
+        p = dict(pool[i % len(pool)])
+        p["id"] = 100000 + i
+        tags = dict(p["tags"])
+        for k, v in EXTRA_TAGS.items():
+            if rnd.random() < 0.6:
+                tags[k] = v or tags.get("name", "Place")
+        p["tags"] = tags
+        el = render(p, center=True)
+        elements.append(el)
+        size += len(json.dumps(el)) + 1
+        i += 1
+    doc = {
+        "version": 0.6,
+        "generator": "Overpass API 0.7.62",
+        "osm3s": {"timestamp_osm_base": "2026-10-19T00:00:00Z", "copyright": "ODbL"},
+        "elements": elements,
+    }
+    return json.dumps(doc, ensure_ascii=False).encode("utf-8")
+
+
+def make_response(body):
+    import requests
+
+    res = requests.models.Response()
+    res.status_code = 200
+    res._content = body
+    res.headers["Content-Type"] = "application/json"
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+
+def parse_before(res):
+    # what fetch_places_for_mood + recommend did before parse_overpass
+    txt = (res.text or "").strip()
+    if not txt or "html" in txt.lower():
+        return None
+    out = []
+    for p in res.json().get("elements", []):
+        center = p.get("center") or {}
+        out.append((p.get("type"), p.get("id"), p.get("lat", center.get("lat")), p.get("lon", center.get("lon")),
+                    p.get("tags") or {}))
+    return out
+
+
+def parse_after(app_module, res):
+    if not app_module.overpass_is_json(res):
+        return None
+    return app_module.parse_overpass(res.content, app_module.poi_from_element)[0]
+
+
+def measure(fn, body, repeat):
+    best_cpu = best_wall = float("inf")
+    for _ in range(repeat):
+        res = make_response(body)
+        gc.collect()
+        c0, t0 = time.process_time(), time.perf_counter()
+        out = fn(res)
+        best_cpu = min(best_cpu, time.process_time() - c0)
+        best_wall = min(best_wall, time.perf_counter() - t0)
+        del out, res
+
+    res = make_response(body)
+    gc.collect()
+    tracemalloc.start()
+    out = fn(res)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "cpu_ms": round(best_cpu * 1000, 1),
+        "wall_ms": round(best_wall * 1000, 1),
+        "peak_kb": peak // 1024,
+        "retained_kb": retained // 1024,
+        "elements": len(out or ()),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mb", type=float, default=5.0)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--fixture", default="", help="parse this recorded Overpass response instead")
+    ap.add_argument("--write-fixtures", default="", help="save the generated body as DIR/overpass.json and exit")
+    args = ap.parse_args()
+
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="moodmaps-parse-"), "parse.db"))
+    os.environ.setdefault("MOODMAPS_SKIP_MIGRATE", "1")
+    sys.path.insert(0, REPO_ROOT)
+
+    if args.fixture:
+        with open(args.fixture, "rb") as fp:
+            body = fp.read()
+    else:
+        body = build_fixture(int(args.mb * 1024 * 1024))
+    if args.write_fixtures:
+        os.makedirs(args.write_fixtures, exist_ok=True)
+        path = os.path.join(args.write_fixtures, "overpass.json")
+        with open(path, "wb") as fp:
+            fp.write(body)
+        print(f"saved {path} ({len(body) / 1048576:.1f} MB)")
+        return
+
+    import app as app_module
+
+    print(f"body {len(body) / 1048576:.2f} MB\n")
+    print(f"{'parser':<10}{'elements':>10}{'cpu ms':>10}{'wall ms':>10}{'peak kB':>12}{'retained kB':>14}")
+    for name, fn in (("before", parse_before), ("after", lambda res: parse_after(app_module, res))):
+        r = measure(fn, body, args.repeat)
+        print(f"{name:<10}{r['elements']:>10}{r['cpu_ms']:>10}{r['wall_ms']:>10}{r['peak_kb']:>12,}{r['retained_kb']:>14,}")
+
+
+if __name__ == "__main__":
+    main()
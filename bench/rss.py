@@ -0,0 +1,196 @@
+"""
+Per-worker memory under gunicorn.
+
+Starts gunicorn with gunicorn.conf.py against the upstream stub, logs in,
+drives every recommend mood plus the page/social endpoints through all
+workers, then reads /proc/<pid>/smaps_rollup for the master and each
+worker. Pss/Private_Dirty show how much of a worker's RSS is really its
+own; with preload most of the code and lookup tables stay shared.
+
+    python -m bench.rss --workers 4
+    python -m bench.rss --workers 4 --compare-preload   # preload on vs off
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.run import MOODS, BENCH_PASSWORD, REPO_ROOT, RESULTS_DIR, git_sha, seed
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_smaps(pid):
+    """kB values from /proc/<pid>/smaps_rollup (falls back to VmRSS only)."""
+    out = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fp:
+            for line in fp:
+                key, _, rest = line.partition(":")
+                if key in SMAPS_FIELDS:
+                    out[key] = int(rest.split()[0])
+    except OSError:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    out["Rss"] = int(line.split()[1])
+    return out
+
+
+def child_pids(pid):
+    kids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fp:
+                stat = fp.read()
+        except OSError:
+            continue
+        # field 4 (after the parenthesised comm) is the parent pid
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            kids.append(int(entry))
+    return sorted(kids)
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _wait_up(base, proc, timeout=30):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("gunicorn exited during startup")
+        try:
+            requests.get(base + "/login", timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise SystemExit("gunicorn did not come up")
+
+
+def measure(args, preload, stub_base, work):
+    import requests
+
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": os.path.join(work, "bench.db"),
+        "METRICS_DIR": os.path.join(work, "metrics"),
+        "PROFILE_DIR": os.path.join(work, "profiles"),
+        "JINJA_CACHE_DIR": os.path.join(work, "jinja"),
+        "EMAIL_TRANSPORT": "stub",
+        "OVERPASS_URLS": f"{stub_base}/api/interpreter",
+        "NOMINATIM_URL": stub_base,
+        "NOMINATIM_MIN_INTERVAL_SEC": "0",
+        "WIKIPEDIA_URL": stub_base,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(args.workers),
+        "GUNICORN_PRELOAD": "1" if preload else "0",
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        _wait_up(base, proc)
+        s = requests.Session()
+        r = s.post(base + "/login", json={"email": "bench@example.org", "password": BENCH_PASSWORD})
+        if not r.ok or not r.json().get("success"):
+            raise SystemExit(f"login failed: {r.text[:200]}")
+
+        # new connection per request -> spread across workers
+        cookies = s.cookies.get_dict()
+        for i in range(args.rounds):
+            for mood in MOODS:
+                requests.post(base + "/api/recommend", cookies=cookies,
+                              json={"mood": mood, "latitude": 18.5204, "longitude": 73.8567})
+            for path in ("/", "/u/star", "/api/follow/followers?username=star", f"/api/users/search?q=user_{i}"):
+                requests.get(base + path, cookies=cookies)
+
+        workers = child_pids(proc.pid)
+        report = {
+            "preload": preload,
+            "master": read_smaps(proc.pid),
+            "workers": {str(pid): read_smaps(pid) for pid in workers},
+        }
+        vals = list(report["workers"].values())
+        report["per_worker_avg_kb"] = {
+            k: int(sum(v.get(k, 0) for v in vals) / len(vals)) for k in SMAPS_FIELDS if vals
+        }
+        report["total_pss_kb"] = report["master"].get("Pss", 0) + sum(v.get("Pss", 0) for v in vals)
+        return report
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(rep):
+    print(f"preload={'on' if rep['preload'] else 'off'}   total Pss {rep['total_pss_kb']:,} kB")
+    head = f"{'pid':<10}" + "".join(f"{k:>15}" for k in SMAPS_FIELDS)
+    print(head)
+    print("-" * len(head))
+    rows = [("master", rep["master"])] + list(rep["workers"].items())
+    for pid, vals in rows:
+        print(f"{pid:<10}" + "".join(f"{vals.get(k, 0):>15,}" for k in SMAPS_FIELDS))
+    print()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rounds", type=int, default=10, help="passes over every scenario before measuring")
+    ap.add_argument("--compare-preload", action="store_true", help="also run with GUNICORN_PRELOAD=0")
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    if not os.path.exists("/proc/self/status"):
+        raise SystemExit("needs /proc (Linux)")
+
+    from bench import stub_server
+
+    work = tempfile.mkdtemp(prefix="moodmaps-rss-")
+    _, _, stub_base = stub_server.start()
+
+    # seed through the app module in this process, then serve from gunicorn
+    os.environ.update({"DB_PATH": os.path.join(work, "bench.db"), "JINJA_CACHE_DIR": os.path.join(work, "jinja"),
+                       "METRICS_DIR": os.path.join(work, "metrics")})
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    seed(app_module)
+
+    runs = [measure(args, True, stub_base, work)]
+    if args.compare_preload:
+        runs.append(measure(args, False, stub_base, work))
+    for rep in runs:
+        print_report(rep)
+
+    report = {"meta": {"git": git_sha(), "timestamp": int(time.time()), "args": vars(args)}, "runs": runs}
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"rss-{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['git']}.json")
+    with open(out, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Reproducible end-to-end benchmark.
+
+Boots the app on a throwaway DB against the local upstream stub
+(bench/stub_server.py), seeds a user with 10k followers, then drives
+the main scenarios over real HTTP and reports throughput and latency
+percentiles. Results are written as JSON so runs can be compared
+across commits.
+
+    python -m bench.run
+    python -m bench.run --requests 300 --concurrency 8 --latency-ms 40
+    python -m bench.run --compare bench/results/<previous>.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+MOODS = ["work", "date", "quick_bites", "pocket_friendly", "calm", "high_adrenaline", "exploring", "late_night"]
+FOLLOWERS = 10000
+BENCH_PASSWORD = "bench-pass"
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def git_sha():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def boot(args):
+    """
+    Env + stub + app import (order matters: app reads env at import).
+    Returns: (app_module, stub_state, app_base_url, work_dir)
+    """
+    from bench import stub_server
+
+    work = tempfile.mkdtemp(prefix="moodmaps-bench-")
+    _, stub_state, stub_base = stub_server.start(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        fail_rate=args.fail_rate,
+        fixtures=args.fixtures or None,
+    )
+
+    os.environ.update({
+        "DB_PATH": os.path.join(work, "bench.db"),
+        "METRICS_DIR": os.path.join(work, "metrics"),
+        "PROFILE_DIR": os.path.join(work, "profiles"),
+        "JINJA_CACHE_DIR": os.path.join(work, "jinja"),
+        "EMAIL_TRANSPORT": "stub",
+        "OVERPASS_URLS": f"{stub_base}/api/interpreter",
+        "NOMINATIM_URL": stub_base,
+        "NOMINATIM_MIN_INTERVAL_SEC": "0",
+        "WIKIPEDIA_URL": stub_base,
+    })
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return app_module, stub_state, f"http://127.0.0.1:{server.server_port}", work
+
+
+def seed(app_module):
+    from werkzeug.security import generate_password_hash
+
+    now = int(time.time())
+    with app_module.get_db() as db:
+        db.execute("""
+            INSERT INTO users(name, username, email, password, is_private, current_mood)
+            VALUES(?,?,?,?,?,?)
+        """, ("Bench", "bench", "bench@example.org", generate_password_hash(BENCH_PASSWORD), 0, "work"))
+        cur = db.execute("""
+            INSERT INTO users(name, username, email, password, is_private, current_mood)
+            VALUES(?,?,?,?,?,?)
+        """, ("Star", "star", "star@example.org", "!", 0, "calm"))
+        star_id = cur.lastrowid
+
+        db.executemany("""
+            INSERT INTO users(name, username, email, password, is_private, current_mood)
+            VALUES(?,?,?,?,?,?)
+        """, [(f"User {i}", f"user_{i}", f"user_{i}@example.org", "!", i % 5 == 0, "work")
+              for i in range(FOLLOWERS)])
+        ids = [r[0] for r in db.execute("SELECT id FROM users WHERE username LIKE 'user\\_%' ESCAPE '\\'")]
+        db.executemany("""
+            INSERT INTO follows(follower_id, following_id, status, created_at)
+            VALUES(?,?,?,?)
+        """, [(uid, star_id, "accepted", now - i) for i, uid in enumerate(ids)])
+        # bench follows a slice of them back -> non-trivial relationship flags
+        db.executemany("""
+            INSERT INTO follows(follower_id, following_id, status, created_at)
+            VALUES(?,?,?,?)
+        """, [(1, uid, "accepted", now) for uid in ids[::7]])
+        db.executemany("""
+            INSERT OR IGNORE INTO favorites(user_id, place_id, name, category, lat, lon, created_at)
+            VALUES(?,?,?,?,?,?,?)
+        """, [(star_id, f"node/{100000 + i}", f"Fav {i}", "cafe", 18.52, 73.85, now - i) for i in range(60)])
+
+
+def scenarios(stub_state):
+    center = (18.5204, 73.8567)
+    pool_ids = [p["id"] for p in stub_state.pool]
+
+    def near(i):
+        # 50 deterministic nearby points
+        k = i % 50
+        return round(center[0] + (k % 7 - 3) * 0.004, 6), round(center[1] + (k // 7 - 3) * 0.004, 6)
+
+    out = {}
+    for mood in MOODS:
+        def rec(i, mood=mood):
+            lat, lon = near(i)
+            return "POST", "/api/recommend", {"mood": mood, "latitude": lat, "longitude": lon}
+        out[f"recommend:{mood}"] = rec
+
+    def details_cold(i):
+        p = stub_state.by_id[pool_ids[(i * 37 + 11) % len(pool_ids)]]
+        return "GET", f"/api/place_details?type={p['type']}&id={p['id']}&lat={p['lat']}&lon={p['lon']}", None
+
+    def details_warm(i):
+        p = stub_state.by_id[pool_ids[0]]
+        return "GET", f"/api/place_details?type={p['type']}&id={p['id']}&lat={p['lat']}&lon={p['lon']}", None
+
+    out["place_details:cold"] = details_cold
+    out["place_details:warm"] = details_warm
+    out["profile_view"] = lambda i: ("GET", "/u/star", None)
+    out["followers_10k"] = lambda i: ("GET", "/api/follow/followers?username=star", None)
+    out["search"] = lambda i: ("GET", f"/api/users/search?q=user_{i % 97}", None)
+    return out
+
+
+def run_scenario(base, cookies, make_req, n, concurrency, offset):
+    import requests
+
+    local = threading.local()
+
+    def session():
+        s = getattr(local, "s", None)
+        if s is None:
+            s = requests.Session()
+            s.cookies.update(cookies)
+            local.s = s
+        return s
+
+    def one(i):
+        method, path, body = make_req(offset + i)
+        t0 = time.perf_counter()
+        try:
+            r = session().request(method, base + path, json=body, timeout=60)
+            ok = r.status_code == 200
+            size = len(r.content)
+        except Exception:
+            ok, size = False, 0
+        return time.perf_counter() - t0, ok, size
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(one, range(n)))
+    wall = time.perf_counter() - t_start
+
+    lat = sorted(r[0] * 1000 for r in results)
+    return {
+        "requests": n,
+        "errors": sum(1 for r in results if not r[1]),
+        "throughput_rps": round(n / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(lat, 50), 2),
+        "p95_ms": round(percentile(lat, 95), 2),
+        "p99_ms": round(percentile(lat, 99), 2),
+        "mean_ms": round(sum(lat) / len(lat), 2) if lat else 0.0,
+        "mean_bytes": int(sum(r[2] for r in results) / len(results)) if results else 0,
+    }
+
+
+def print_table(results, previous=None):
+    head = f"{'scenario':<28}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'err':>6}"
+    if previous:
+        head += f"{'p95 Δ':>10}"
+    print(head)
+    print("-" * len(head))
+    for name, r in results.items():
+        line = f"{name:<28}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>6}"
+        prev = (previous or {}).get(name)
+        if prev and prev.get("p95_ms"):
+            delta = (r["p95_ms"] - prev["p95_ms"]) / prev["p95_ms"] * 100
+            line += f"{delta:>+9.1f}%"
+        print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="stub upstream latency")
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="stub upstream failure rate (0-1)")
+    ap.add_argument("--fixtures", default="", help="dir with recorded overpass/nominatim/wiki .json")
+    ap.add_argument("--only", default="", help="comma separated scenario name prefixes")
+    ap.add_argument("--out", default="", help="result JSON path (default bench/results/<ts>-<sha>.json)")
+    ap.add_argument("--compare", default="", help="previous result JSON to diff against")
+    args = ap.parse_args()
+
+    import requests
+
+    app_module, stub_state, base, work = boot(args)
+    seed(app_module)
+
+    login = requests.post(base + "/login", json={"email": "bench@example.org", "password": BENCH_PASSWORD})
+    if not login.ok or not login.json().get("success"):
+        raise SystemExit(f"login failed: {login.text[:200]}")
+    cookies = login.cookies.get_dict()
+
+    wanted = [w.strip() for w in args.only.split(",") if w.strip()]
+    results = {}
+    offset = 0
+    for name, make_req in scenarios(stub_state).items():
+        if wanted and not any(name.startswith(w) for w in wanted):
+            continue
+        if args.warmup and not name.endswith(":cold"):
+            run_scenario(base, cookies, make_req, args.warmup, 1, 10_000_000)
+        results[name] = run_scenario(base, cookies, make_req, args.requests, args.concurrency, offset)
+        offset += args.requests
+        print(f"  {name}: {results[name]['p95_ms']} ms p95", file=sys.stderr)
+
+    candidates = {}
+    for (name, labels), value in list(app_module.METRICS_COUNTERS.items()):
+        if name == "moodmaps_recommend_candidates_total":
+            lab = dict(labels)
+            candidates.setdefault(lab["mood"], {})[lab["result"]] = value
+
+    report = {
+        "meta": {
+            "git": git_sha(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "stub_hits": dict(stub_state.hits),
+            # recommend: candidates kept vs thrown away after the Overpass fetch
+            "recommend_candidates": candidates,
+            # app + stub share this process; per-worker numbers: bench/rss.py
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp).get("results")
+
+    print_table(results, previous)
+
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['git']}.json")
+    with open(out, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nsaved {out}")
+
+
+if __name__ == "__main__":
+    main()
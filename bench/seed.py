@@ -0,0 +1,148 @@
+"""
+Synthetic large-dataset generator.
+
+Creates users, a power-law follow graph (a few accounts with huge
+follower counts, a long tail with a handful) and favorites, written
+with batched executemany inside large transactions. The schema comes
+from importing app.py against the target DB, so it always matches.
+
+    python -m bench.seed --db /tmp/moodmaps-big.db --users 1000000
+    python -m bench.seed --db /tmp/mm.db --users 200000 --avg-follows 30 --favorites 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST = ["Aarav", "Isha", "Kabir", "Meera", "Rohan", "Sara", "Vihaan", "Anaya", "Dev", "Tara",
+         "Arjun", "Diya", "Neel", "Riya", "Kiran", "Zoya", "Om", "Pia", "Yash", "Naina"]
+LAST = ["Patil", "Shah", "Iyer", "Khan", "Joshi", "Rao", "Das", "Gupta", "Kulkarni", "Mehta"]
+MOODS = ["work", "date", "quick_bites", "pocket_friendly", "calm", "high_adrenaline", "exploring", "late_night"]
+CATEGORIES = ["cafe", "restaurant", "fast_food", "park", "gym", "bar", "museum", "viewpoint"]
+
+
+def open_app_db(db_path):
+    os.environ["DB_PATH"] = db_path
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+
+    db = app_module.get_db()
+    # bulk load: durability does not matter for a throwaway dataset
+    db.execute("PRAGMA synchronous=OFF;")
+    db.execute("PRAGMA cache_size=-262144;")
+    db.execute("PRAGMA temp_store=MEMORY;")
+    return app_module, db
+
+
+def _batched(iterable, size):
+    batch = []
+    for row in iterable:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(db, sql, rows, batch_size, label):
+    total = 0
+    t0 = time.perf_counter()
+    for batch in _batched(rows, batch_size):
+        db.execute("BEGIN")
+        db.executemany(sql, batch)
+        db.execute("COMMIT")
+        total += len(batch)
+        print(f"\r  {label}: {total:,} ({total / max(1e-9, time.perf_counter() - t0):,.0f}/s)",
+              end="", file=sys.stderr)
+    print(file=sys.stderr)
+    return total
+
+
+def gen_users(n, start_id, private_ratio, rnd):
+    for i in range(n):
+        uid = start_id + i
+        name = f"{rnd.choice(FIRST)} {rnd.choice(LAST)}"
+        yield (uid, name, f"u{uid}", f"u{uid}@seed.invalid", "!",
+               1 if rnd.random() < private_ratio else 0, rnd.choice(MOODS))
+
+
+def powerlaw_target(rnd, lo, n, skew):
+    # rank ~ U^skew: small ranks (celebrities) are picked far more often
+    return lo + min(n - 1, int(n * (rnd.random() ** skew)))
+
+
+def gen_follows(lo, n, avg, skew, pending_ratio, rnd, now):
+    for follower in range(lo, lo + n):
+        # heavy-tailed out-degree with the requested mean
+        k = min(n - 1, int(rnd.paretovariate(2.0) * avg / 2.0))
+        seen = set()
+        for _ in range(k):
+            target = powerlaw_target(rnd, lo, n, skew)
+            if target == follower or target in seen:
+                continue
+            seen.add(target)
+            status = "pending" if rnd.random() < pending_ratio else "accepted"
+            yield (follower, target, status, now - rnd.randint(0, 365 * 86400))
+
+
+def gen_favorites(lo, n, avg, center, rnd, now):
+    lat0, lon0 = center
+    for uid in range(lo, lo + n):
+        for _ in range(int(rnd.expovariate(1.0 / avg)) if avg else 0):
+            # popular places are shared between many users
+            place = int(200000 * (rnd.random() ** 2.5))
+            yield (uid, f"node/{place}", f"Place {place}", CATEGORIES[place % len(CATEGORIES)],
+                   round(lat0 + rnd.uniform(-0.1, 0.1), 6), round(lon0 + rnd.uniform(-0.1, 0.1), 6),
+                   now - rnd.randint(0, 365 * 86400))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", required=True, help="target sqlite file (created if missing)")
+    ap.add_argument("--users", type=int, default=200000)
+    ap.add_argument("--avg-follows", type=float, default=20)
+    ap.add_argument("--skew", type=float, default=3.0, help="higher = more follows go to the top accounts")
+    ap.add_argument("--favorites", type=float, default=3, help="average favorites per user")
+    ap.add_argument("--private-ratio", type=float, default=0.15)
+    ap.add_argument("--pending-ratio", type=float, default=0.05)
+    ap.add_argument("--batch", type=int, default=50000)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    app_module, db = open_app_db(os.path.abspath(args.db))
+    db.isolation_level = None  # explicit BEGIN/COMMIT per batch
+    rnd = random.Random(args.seed)
+    now = int(time.time())
+
+    start_id = (db.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0] or 0) + 1
+    t0 = time.perf_counter()
+
+    _insert(db, """
+        INSERT INTO users(id, name, username, email, password, is_private, current_mood)
+        VALUES(?,?,?,?,?,?,?)
+    """, gen_users(args.users, start_id, args.private_ratio, rnd), args.batch, "users")
+
+    _insert(db, """
+        INSERT OR IGNORE INTO follows(follower_id, following_id, status, created_at)
+        VALUES(?,?,?,?)
+    """, gen_follows(start_id, args.users, args.avg_follows, args.skew, args.pending_ratio, rnd, now),
+        args.batch, "follows")
+
+    _insert(db, """
+        INSERT OR IGNORE INTO favorites(user_id, place_id, name, category, lat, lon, created_at)
+        VALUES(?,?,?,?,?,?,?)
+    """, gen_favorites(start_id, args.users, args.favorites, (18.5204, 73.8567), rnd, now),
+        args.batch, "favorites")
+
+    db.execute("ANALYZE")
+    counts = {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("users", "follows", "favorites")}
+    print(f"done in {time.perf_counter() - t0:.1f}s: " + ", ".join(f"{k}={v:,}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
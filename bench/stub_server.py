@@ -0,0 +1,430 @@
+"""
+Local stand-in for Overpass, Nominatim and Wikipedia.
+
+Serves deterministic synthetic data (or recorded fixtures from
+--fixtures DIR: overpass.json, nominatim.json, wiki.json) with
+configurable latency and failure injection, so benchmarks never
+touch the real services.
+
+    python -m bench.stub_server --port 8099 --latency-ms 40 --fail-rate 0.05
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import cos, radians
+from urllib.parse import parse_qs, unquote, urlparse
+
+CENTER = (18.5204, 73.8567)  # Pune
+
+# (tags template, weight) used to build the synthetic POI pool
+POI_KINDS = [
+    ({"amenity": "cafe"}, 14),
+    ({"amenity": "cafe", "internet_access": "wlan"}, 4),
+    ({"amenity": "restaurant"}, 16),
+    ({"amenity": "restaurant", "outdoor_seating": "yes"}, 4),
+    ({"amenity": "fast_food"}, 14),
+    ({"amenity": "food_court"}, 2),
+    ({"amenity": "street_vendor"}, 2),
+    ({"amenity": "bar"}, 3),
+    ({"amenity": "pub"}, 2),
+    ({"amenity": "nightclub"}, 1),
+    ({"amenity": "coworking_space"}, 1),
+    ({"office": "coworking"}, 1),
+    ({"amenity": "bench"}, 10),
+    ({"amenity": "gym"}, 3),
+    ({"leisure": "park"}, 5),
+    ({"leisure": "fitness_centre"}, 2),
+    ({"leisure": "sports_centre"}, 2),
+    ({"leisure": "swimming_pool"}, 1),
+    ({"leisure": "pitch", "sport": "cricket"}, 3),
+    ({"tourism": "viewpoint"}, 1),
+    ({"tourism": "museum", "wikipedia": "en:Raja Dinkar Kelkar Museum"}, 1),
+    ({"tourism": "hotel"}, 4),
+    ({"historic": "monument"}, 2),
+    ({"natural": "tree"}, 6),
+]
+
+NAME_WORDS = [
+    "Coffee", "Bistro", "Rooftop", "Garden", "Misal", "Vada Pav", "Chai", "Momos",
+    "Study", "Irani", "Lounge", "Thali", "Shawarma", "Bakery", "Terrace", "Corner",
+    "House", "Point", "Express", "Central", "Premium", "Dhaba", "Roll", "Juice",
+]
+
+# values that are usually mapped as areas (ways) rather than points
+AREA_VALUES = {"park", "sports_centre", "pitch", "swimming_pool", "museum", "hotel"}
+
+OPENING_HOURS = [
+    "", "", "Mo-Su 09:00-23:00", "24/7", "Mo-Sa 10:00-22:00; Su off",
+    "Mo-Su 18:00-02:00", "Mo-Fr 08:00-20:00", "Mo-Su 11:00-24:00",
+]
+
+
+def build_pool(n=20000, seed=7, center=CENTER, spread_km=12.0):
+    rnd = random.Random(seed)
+    kinds = [k for k, w in POI_KINDS for _ in range(w)]
+    lat0, lon0 = center
+    dlat = spread_km / 111.0
+    dlon = spread_km / (111.0 * cos(radians(lat0)))
+    pool = []
+    for i in range(n):
+        # denser towards the centre
+        r = rnd.random() ** 1.6
+        lat = lat0 + (rnd.uniform(-1, 1) * dlat * r)
+        lon = lon0 + (rnd.uniform(-1, 1) * dlon * r)
+        tags = dict(rnd.choice(kinds))
+        if rnd.random() < 0.85:
+            tags["name"] = f"{rnd.choice(NAME_WORDS)} {rnd.choice(NAME_WORDS)} {i}"
+        oh = rnd.choice(OPENING_HOURS)
+        if oh:
+            tags["opening_hours"] = oh
+        if rnd.random() < 0.3:
+            tags["website"] = f"https://example.org/p/{i}"
+        if rnd.random() < 0.3:
+            tags["phone"] = f"+91 20 {rnd.randint(1000000, 9999999)}"
+        if rnd.random() < 0.2:
+            tags["addr:street"] = "FC Road"
+            tags["addr:housenumber"] = str(rnd.randint(1, 500))
+            tags["addr:city"] = "Pune"
+        typ = "way" if AREA_VALUES.intersection(tags.values()) and rnd.random() < 0.6 else "node"
+        pool.append({"type": typ, "id": 100000 + i, "lat": round(lat, 7), "lon": round(lon, 7), "tags": tags})
+    return pool
+
+
+def render(p, center, bb=False):
+    """Element as Overpass prints it: nodes with lat/lon, ways with a centre, a bbox or node refs."""
+    if p["type"] == "node":
+        return p
+    if center:
+        return {"type": p["type"], "id": p["id"], "center": {"lat": p["lat"], "lon": p["lon"]}, "tags": p["tags"]}
+    if bb:
+        # ~45 x 45 m footprint around the centre
+        return {"type": p["type"], "id": p["id"], "tags": p["tags"], "bounds": {
+            "minlat": round(p["lat"] - 0.0002, 7), "minlon": round(p["lon"] - 0.0002, 7),
+            "maxlat": round(p["lat"] + 0.0002, 7), "maxlon": round(p["lon"] + 0.0002, 7)}}
+    return {"type": p["type"], "id": p["id"], "nodes": list(range(p["id"] * 100, p["id"] * 100 + 24)),
+            "tags": p["tags"]}
+
+
+def _km(lat1, lon1, lat2, lon2):
+    dx = (lon2 - lon1) * 111.0 * cos(radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * 111.0
+    return (dx * dx + dy * dy) ** 0.5
+
+
+AROUND = r'\(around:(\d+(?:\.\d+)?),([-\d.]+),([-\d.]+)\)'
+# node[..](around:..);  or  nwr[..](around:..)->.a0;  (named set)
+SELECTOR_RE = re.compile(r'(node|way|relation|nwr)((?:\[[^\]]*\])+)' + AROUND + r'(?:->\.(\w+))?')
+# nwr.a0[..](around:..)?;  filter over a named set
+FROM_SET_RE = re.compile(r'(node|way|relation|nwr)\.(\w+)((?:\[[^\]]*\])*)(?:' + AROUND + r')?;')
+FILTER_RE = re.compile(r'\[(!?)"?([^"=~!\]]+)"?(?:(=|~|!=|!~)"?([^"\]]*)"?(?:,i)?)?\]')
+ID_RE = re.compile(r'\b(node|way|relation)\((\d+)\)')
+OUT_RE = re.compile(r'(?<![\w\[])out\b([^;]*?)(\d+)?\s*;')  # not the [out:json] setting
+
+
+def _compile_filters(raw):
+    out = []
+    for neg, key, op, val in raw:
+        if op in ("~", "!~"):
+            try:
+                val = re.compile(val, re.I)
+            except re.error:
+                val = None
+        out.append((neg, key, op, val))
+    # cheap equality/presence checks first, regexes last
+    out.sort(key=lambda f: f[2] in ("~", "!~"))
+    return out
+
+
+def _match(tags, filters):
+    for neg, key, op, val in filters:
+        have = tags.get(key)
+        if not op:
+            ok = have is not None
+            if neg:
+                ok = not ok
+        elif op == "=":
+            ok = have == val
+        elif op == "!=":
+            ok = have != val
+        elif op in ("~", "!~"):
+            hit = have is not None and val is not None and val.search(have) is not None
+            ok = hit if op == "~" else not hit
+        else:
+            ok = True
+        if not ok:
+            return False
+    return True
+
+
+class StubState:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, fail_rate=0.0, fixtures=None, pool_size=20000, seed=7):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pool = build_pool(pool_size, seed)
+        self.by_id = {p["id"]: p for p in self.pool}
+        # per-tag-key, latitude-sorted indexes: around() with a positive key
+        # filter only scans a latitude band of that key, like Overpass' indexes
+        self.by_key = {}
+        for p in sorted(self.pool, key=lambda p: p["lat"]):
+            for key in [None] + list(p["tags"]) + [f"{k}={v}" for k, v in p["tags"].items()]:
+                self.by_key.setdefault(key, ([], []))
+                self.by_key[key][0].append(p["lat"])
+                self.by_key[key][1].append(p)
+        self.fixtures = {}
+        self.responses = {}
+        self.hits = {"overpass": 0, "overpass_bytes": 0, "nominatim": 0, "wiki": 0, "wiki_query": 0, "failed": 0}
+        if fixtures:
+            for name in ("overpass", "nominatim", "wiki"):
+                path = os.path.join(fixtures, f"{name}.json")
+                if os.path.exists(path):
+                    with open(path, "rb") as fp:
+                        self.fixtures[name] = fp.read()
+
+    def delay(self):
+        ms = self.latency_ms
+        if self.jitter_ms:
+            with self.lock:
+                ms += self.rnd.uniform(0, self.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    def should_fail(self):
+        if self.fail_rate <= 0:
+            return False
+        with self.lock:
+            return self.rnd.random() < self.fail_rate
+
+    def overpass(self, query: str):
+        if "overpass" in self.fixtures and not ID_RE.search(query):
+            return self.fixtures["overpass"]
+        # responses are deterministic: upstream time is modelled by --latency-ms,
+        # not by how fast this stub evaluates the query
+        body = self.responses.get(query)
+        if body is None:
+            body = self._overpass(query)
+            with self.lock:
+                if len(self.responses) >= 4096:
+                    self.responses.clear()
+                self.responses[query] = body
+        return body
+
+    def _overpass(self, query: str):
+        outs = OUT_RE.findall(query)
+        center = "center" in query
+        bb = re.search(r"\bbb\b", query) is not None
+
+        ids = ID_RE.findall(query)
+        if ids:
+            out = [render(self.by_id[int(i)], center, bb) for typ, i in ids
+                   if int(i) in self.by_id and self.by_id[int(i)]["type"] == typ]
+            return json.dumps({"elements": out}).encode()
+
+        seen = set()
+        found = []
+
+        def add(items):
+            for p in items:
+                if p["id"] not in seen:
+                    seen.add(p["id"])
+                    found.append(p)
+
+        sets = {}
+        for typ, filt, radius, lat, lon, into in SELECTOR_RE.findall(query):
+            hits = self._around(typ, _compile_filters(FILTER_RE.findall(filt)), float(radius), float(lat), float(lon))
+            if into:
+                sets[into] = hits
+            else:
+                add(hits)
+        for typ, name, filt, radius, lat, lon in FROM_SET_RE.findall(query):
+            if name not in sets:
+                continue  # e.g. the output step "node.r;"
+            filters = _compile_filters(FILTER_RE.findall(filt))
+            r_km = float(radius) / 1000.0 if radius else None
+            add(p for p in sets[name]
+                if typ in ("nwr", p["type"]) and _match(p["tags"], filters)
+                and (r_km is None or _km(float(lat), float(lon), p["lat"], p["lon"]) <= r_km))
+
+        def limited(items, out_stmt):
+            mods, limit = out_stmt if out_stmt else ("", "")
+            items = items[:int(limit)] if limit else items
+            return [render(p, "center" in mods) for p in items]
+
+        if "node.r;" in query and len(outs) >= 2:
+            # split output: nodes first, then ways/relations
+            out = limited([p for p in found if p["type"] == "node"], outs[0])
+            out += limited([p for p in found if p["type"] != "node"], outs[1])
+        else:
+            out = limited(found, outs[0] if outs else None)
+        return json.dumps({"elements": out}).encode()
+
+    def _around(self, typ, filters, radius_m, lat, lon):
+        r_km = radius_m / 1000.0
+        keys = [f"{k}={v}" if op == "=" else k for neg, k, op, v in filters if not neg and op in ("", "=", "~")]
+        lats, items = min((self.by_key.get(k, ([], [])) for k in keys or [None]), key=lambda ix: len(ix[0]))
+        lo = bisect.bisect_left(lats, lat - r_km / 111.0)
+        hi = bisect.bisect_right(lats, lat + r_km / 111.0)
+        return [p for p in items[lo:hi]
+                if typ in ("nwr", p["type"]) and _match(p["tags"], filters)
+                and _km(lat, lon, p["lat"], p["lon"]) <= r_km]
+
+    def nominatim(self, lat, lon):
+        if "nominatim" in self.fixtures:
+            return self.fixtures["nominatim"]
+        return json.dumps({
+            "display_name": f"Stub Road, near {float(lat):.4f},{float(lon):.4f}, Pune, Maharashtra, India",
+            "address": {"road": "Stub Road", "city": "Pune", "state": "Maharashtra", "country": "India"},
+        }).encode()
+
+    def wiki(self, title):
+        if "wiki" in self.fixtures:
+            return self.fixtures["wiki"]
+        t = unquote(title).replace("_", " ")
+        return json.dumps({
+            "title": t,
+            "extract": f"{t} is a stub article used for benchmarks.",
+            "thumbnail": {"source": f"https://upload.wikimedia.org/stub/{title}.jpg"},
+        }).encode()
+
+    def wiki_query(self, titles):
+        """MediaWiki action=query (formatversion=2) for extracts + pageimages."""
+        normalized, pages = [], []
+        for raw in titles:
+            t = raw.replace("_", " ")
+            if t != raw:
+                normalized.append({"from": raw, "to": t})
+            if t.lower().startswith("missing"):
+                pages.append({"ns": 0, "title": t, "missing": True})
+                continue
+            pages.append({
+                "pageid": abs(hash(t)) % 10 ** 7,
+                "ns": 0,
+                "title": t,
+                "extract": f"{t} is a stub article used for benchmarks.",
+                "thumbnail": {"source": f"https://upload.wikimedia.org/stub/{t.replace(' ', '_')}.jpg",
+                              "width": 320, "height": 240},
+            })
+        return json.dumps({"batchcomplete": True, "query": {"normalized": normalized, "pages": pages}}).encode()
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out as separate writes; without this a
+        # kept-alive client waits out delayed-ACK on every response
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body: bytes, ctype="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _maybe_fail(self):
+            state.delay()
+            if state.should_fail():
+                with state.lock:
+                    state.hits["failed"] += 1
+                # overpass style overload page
+                self._send(429, b"<html><body>rate_limited</body></html>", "text/html")
+                return True
+            return False
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(n).decode("utf-8", "replace")
+            if raw.startswith("data="):
+                raw = unquote(parse_qs(raw).get("data", [""])[0])
+            if not urlparse(self.path).path.endswith("/interpreter"):
+                return self._send(404, b"{}")
+            with state.lock:
+                state.hits["overpass"] += 1
+            if self._maybe_fail():
+                return
+            body = state.overpass(raw)
+            with state.lock:
+                state.hits["overpass_bytes"] += len(body)
+            self._send(200, body)
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            if u.path == "/reverse":
+                with state.lock:
+                    state.hits["nominatim"] += 1
+                if self._maybe_fail():
+                    return
+                q = parse_qs(u.query)
+                return self._send(200, state.nominatim(q.get("lat", ["0"])[0], q.get("lon", ["0"])[0]))
+            if u.path.startswith("/api/rest_v1/page/summary/"):
+                with state.lock:
+                    state.hits["wiki"] += 1
+                if self._maybe_fail():
+                    return
+                return self._send(200, state.wiki(u.path.rsplit("/", 1)[-1]))
+            if u.path == "/w/api.php":
+                with state.lock:
+                    state.hits["wiki_query"] += 1
+                if self._maybe_fail():
+                    return
+                titles = parse_qs(u.query).get("titles", [""])[0]
+                return self._send(200, state.wiki_query([t for t in titles.split("|") if t]))
+            if u.path == "/_stats":
+                return self._send(200, json.dumps(state.hits).encode())
+            self._send(404, b"{}")
+
+    return Handler
+
+
+def start(port=0, **kwargs):
+    """
+    Starts the stub in a daemon thread.
+    Returns: (server, state, base_url)
+    """
+    state = StubState(**kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--fixtures", default="")
+    ap.add_argument("--pool-size", type=int, default=20000)
+    args = ap.parse_args()
+
+    server, _, base = start(
+        args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        fail_rate=args.fail_rate,
+        fixtures=args.fixtures or None,
+        pool_size=args.pool_size,
+    )
+    print(f"stub listening on {base}")
+    print(f"  OVERPASS_URLS={base}/api/interpreter NOMINATIM_URL={base} WIKIPEDIA_URL={base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
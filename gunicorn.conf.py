@@ -0,0 +1,68 @@
+"""
+Production gunicorn profile: the app is imported once in the master
+(preload), warmed, and its heap frozen before workers fork, so the
+read-only parts (code, templates, keyword banks, mood tables) stay
+shared copy-on-write instead of being rebuilt per worker.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+GUNICORN_PRELOAD=0 falls back to per-worker imports (for comparison,
+see bench/rss.py).
+"""
+import gc
+import multiprocessing
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# capped: every worker holds its own caches and password pool, and SQLite
+# serialises writers anyway, so more processes add memory, not throughput
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# one thread per worker: the module-level caches (RENDER_CACHE, USER_CACHE,
+# the place/geocode caches) are plain dicts without locks
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+# one id per master start: workers (and their replacements) write their
+# metrics snapshots under it, a restart starts a fresh set
+os.environ.setdefault("MOODMAPS_RUN_ID", f"{int(time.time())}-{os.getpid()}")
+
+if preload_app:
+    # no collections in the master while the app is imported: a collection
+    # would touch every object header and un-share pages after fork
+    gc.disable()
+
+
+def when_ready(server):
+    # runs in the master after the preloaded import, before any fork
+    if not preload_app:
+        return
+    import app as moodmaps
+
+    moodmaps.prefork_warmup()
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+
+
+def post_worker_init(worker):
+    # the app is loaded in this worker by now; start threads that must not
+    # wait for a request (e.g. the outbox sender draining rows left behind
+    # by a recycled worker)
+    import app as moodmaps
+
+    moodmaps.start_worker_threads()
+
+
+def child_exit(server, worker):
+    # master side: fold the dead worker's metrics into the run's archive
+    import app as moodmaps
+
+    moodmaps.archive_worker_metrics(worker.pid)
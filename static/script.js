@@ -208,9 +208,23 @@ if (navigator.geolocation) {
   }
 
   /* open status */
+  const CLOSING_SOON_MS = 45 * 60 * 1000; // OPENING_CLOSING_SOON_MIN in app.py
+
   function getOpenStatus(place) {
     const oh = place.opening_hours;
 
+    // precomputed by /api/recommend, valid until next_change_at
+    const nc = place.next_change_at ? new Date(place.next_change_at) : null;
+    const fresh = !nc || Date.now() < nc.getTime();
+    if ((place.open_now === true || place.open_now === false) && fresh) {
+      if (place.open_now) {
+        // from next_change_at like the label: closing_soon was only true when served
+        const closingSoon = !!nc && nc.getTime() - Date.now() <= CLOSING_SOON_MS;
+        return { open: true, closingSoon, label: nc ? `Closes at ${formatTime(nc)}` : "Open 24/7" };
+      }
+      return { open: false, label: nc ? `Opens at ${formatTime(nc)}` : "Closed now" };
+    }
+
     if (!oh || typeof window.opening_hours === "undefined") {
       return { unknown: true };
     }
@@ -467,8 +481,10 @@ if (navigator.geolocation) {
 
   async function fetchPlaceDetails(place) {
     try {
-      const osmType = place.osm_type || null;
-      const osmId = place.osm_id || null;
+      // saved places only carry place_id ("node/123"), which is enough for the cached details
+      const ref = /^(node|way|relation)\/(\d+)$/.exec(place.place_id || "") || [];
+      const osmType = place.osm_type || ref[1] || null;
+      const osmId = place.osm_id || ref[2] || null;
 
       let url = "/api/place_details?";
 
@@ -1112,7 +1128,7 @@ function showNoPlacesMessage() {
       const r = await fetch("/api/recommend", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ mood, latitude: userLat, longitude: userLon })
+        body: JSON.stringify({ mood, latitude: userLat, longitude: userLon, tz_offset: new Date().getTimezoneOffset() })
       });
 
       const data = await r.json();